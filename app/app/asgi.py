@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the apps are loaded
+from cashback.live import LIVE_PATH, live_events  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """Serves the live events stream, everything else goes to Django"""
+    if scope['type'] == 'http' and scope['path'] == LIVE_PATH:
+        await live_events(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -27,6 +29,17 @@ DEBUG = int(os.environ.get('DEBUG', 0))
 ALLOWED_HOSTS = []
 
 
+# Settings profile of the process: 'full' serves everything, 'api' only
+# the JWT API and 'admin' only the admin site (see app/urls.py). API
+# workers leave out the apps and middleware only the admin and the
+# browsable API use: sessions, messages, CSRF, static files.
+DJANGO_PROFILE = os.environ.get('DJANGO_PROFILE', 'full')
+
+if DJANGO_PROFILE not in ('full', 'api', 'admin'):
+    raise ImproperlyConfigured(
+        "DJANGO_PROFILE must be 'full', 'api' or 'admin'")
+
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -46,6 +59,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.throttling.ThrottleMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -54,6 +68,29 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+API_UNUSED_APPS = (
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'rest_framework.authtoken',
+)
+
+API_UNUSED_MIDDLEWARE = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+)
+
+if DJANGO_PROFILE == 'api':
+    INSTALLED_APPS = [
+        app for app in INSTALLED_APPS if app not in API_UNUSED_APPS]
+    MIDDLEWARE = [
+        middleware for middleware in MIDDLEWARE
+        if middleware not in API_UNUSED_MIDDLEWARE]
+
 ROOT_URLCONF = 'app.urls'
 
 TEMPLATES = [
@@ -89,6 +126,32 @@ DATABASES = {
 }
 
 
+# Opt-in monthly partitioning of the Compra table (PostgreSQL 11+), see
+# core/partitioning.py and the partition_compra command. When enabled the
+# partitions of the next months are created after every migrate.
+COMPRA_PARTITIONING = bool(int(os.environ.get('COMPRA_PARTITIONING', 0)))
+
+COMPRA_PARTITIONS_AHEAD = 3
+
+# Months older than this are moved to the archive by archive_purchases
+COMPRA_ARCHIVE_RETENTION_MONTHS = int(
+    os.environ.get('COMPRA_ARCHIVE_RETENTION_MONTHS', 24))
+
+
+# Cache shared by the workers, e.g. CACHE_BACKEND=
+# django.core.cache.backends.memcached.PyMemcacheCache and
+# CACHE_LOCATION=memcached:11211. Defaults to a per process cache, where
+# the THROTTLE_RATES and CASHBACK_PROVIDER_RATE limits apply per process:
+# deployments running several workers must set a shared one.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -108,6 +171,115 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Background jobs, see core/jobs.py and the run_workers command. Failed
+# jobs are retried after JOB_RETRY_DELAY seconds, doubled every attempt.
+JOB_MAX_ATTEMPTS = 5
+
+JOB_RETRY_DELAY = 10
+
+# Seconds a worker holds a claimed job. A job still running after its
+# lease, its worker presumed dead, is claimed again by another one.
+JOB_LEASE = 300
+
+# Status decision service asked about every new purchase in validation,
+# by a background job. No check when unset.
+STATUS_DECISION_URL = os.environ.get('STATUS_DECISION_URL')
+
+# Live events stream (cashback/live.py): seconds between keepalives and
+# events buffered for a slow client
+LIVE_EVENTS_KEEPALIVE = 15
+
+LIVE_EVENTS_QUEUE_SIZE = 100
+
+# External cashback provider (cashback/provider.py)
+CASHBACK_PROVIDER_URL = os.environ.get(
+    'CASHBACK_PROVIDER_URL',
+    'https://mdaqk8ek5j.execute-api.us-east-1.amazonaws.com/v1/cashback')
+
+CASHBACK_PROVIDER_TOKEN = os.environ.get(
+    'CASHBACK_PROVIDER_TOKEN', 'ZXPURQOARHiMc6Y0flhRC1LVlZQVFRnm')
+
+CASHBACK_PROVIDER_TIMEOUT = 10
+
+# Provider calls in flight per process
+CASHBACK_PROVIDER_CONCURRENCY = int(
+    os.environ.get('CASHBACK_PROVIDER_CONCURRENCY', 10))
+
+# Seconds a provider balance is cached, see the warm_cashback_cache command
+CASHBACK_BALANCE_TTL = int(os.environ.get('CASHBACK_BALANCE_TTL', 900))
+
+# Where accumulated-cashback reads balances: 'provider', or 'mirror' for
+# the ExternalCashbackBalance table filled by sync_cashback_balances.
+# Mirrored balances older than CASHBACK_MIRROR_MAX_AGE seconds are asked
+# to the provider instead.
+CASHBACK_BALANCE_SOURCE = os.environ.get(
+    'CASHBACK_BALANCE_SOURCE', 'provider')
+
+CASHBACK_MIRROR_MAX_AGE = int(
+    os.environ.get('CASHBACK_MIRROR_MAX_AGE', 86400))
+
+# Seconds the purchases summary of a revendedor is cached
+CASHBACK_SUMMARY_TTL = int(os.environ.get('CASHBACK_SUMMARY_TTL', 300))
+
+# Largest top of the leaderboard endpoint, see core/rankings.py
+LEADERBOARD_MAX_SIZE = 100
+
+# CPFs accepted by one accumulated-cashback/batch request
+CASHBACK_BATCH_MAX_CPFS = 500
+
+# Provider calls per period, across every worker (shared CACHES). A call
+# waiting longer than CASHBACK_PROVIDER_TIMEOUT for its turn fails with a
+# 429. Empty for no limit.
+CASHBACK_PROVIDER_RATE = os.environ.get('CASHBACK_PROVIDER_RATE', '50/s')
+
+# Request rate limits, see core/throttling.py: 'N/period' sliding windows
+# per user (anonymous ones per client address) and per CPF asked, and per
+# user for the endpoints below, by URL name.
+THROTTLE_ENABLED = bool(int(os.environ.get('THROTTLE_ENABLED', 1)))
+
+THROTTLE_RATES = {
+    'user': os.environ.get('THROTTLE_USER_RATE', '600/m'),
+    'anon': os.environ.get('THROTTLE_ANON_RATE', '600/m'),
+    'cpf': os.environ.get('THROTTLE_CPF_RATE', '60/m'),
+}
+
+THROTTLE_ENDPOINT_RATES = {
+    'cashback:compra-accumulated-cashback': '120/m',
+    'cashback:compra-accumulated-cashback-batch': '10/m',
+    'user:create': '20/m',
+    'user:create-revendedor': '20/m',
+    'token_obtain_pair': '20/m',
+}
+
+# Password hashing, see core/hashers.py. The profile picks the hasher used
+# for new passwords: 'pbkdf2' (Django default) or 'argon2' (needs
+# argon2-cffi). Hashes of the other hashers still verify and are upgraded
+# to the preferred one on the next login.
+PASSWORD_HASHER_PROFILE = os.environ.get('PASSWORD_HASHER_PROFILE', 'pbkdf2')
+
+PASSWORD_HASHERS = [
+    'core.hashers.TunedPBKDF2PasswordHasher',
+    'core.hashers.TunedArgon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+if PASSWORD_HASHER_PROFILE == 'argon2':
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(1))
+
+PASSWORD_PBKDF2_ITERATIONS = int(
+    os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 260000))
+
+# Argon2id parameters (memory in KiB). One lane per hash: the hashing pool
+# already runs hashes in parallel.
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get('PASSWORD_ARGON2_TIME_COST', 2))
+PASSWORD_ARGON2_MEMORY_COST = int(
+    os.environ.get('PASSWORD_ARGON2_MEMORY_COST', 19456))
+PASSWORD_ARGON2_PARALLELISM = int(
+    os.environ.get('PASSWORD_ARGON2_PARALLELISM', 1))
+
+# Threads hashing passwords off the request threads, 0 is one per CPU
+PASSWORD_HASHING_WORKERS = int(os.environ.get('PASSWORD_HASHING_WORKERS', 0))
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
 
@@ -137,5 +309,28 @@ AUTH_USER_MODEL = 'core.User'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    # orjson backed renderer/parser, they fall back to the stdlib json
+    # implementation when orjson is not installed
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'core.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
+
+# Obtaining a token updates last_login, which tells warm_cashback_cache
+# the revendedores recently active
+SIMPLE_JWT = {
+    'UPDATE_LAST_LOGIN': True,
+}
+
+# API workers answer JSON only, the browsable API needs the static files
+if DJANGO_PROFILE == 'api':
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = (
+        'core.renderers.ORJSONRenderer',
+    )
@@ -1,24 +1,32 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 from rest_framework_simplejwt.views import (TokenObtainPairView,
                                             TokenRefreshView)
 
-urlpatterns = [
-    path(
+urlpatterns = []
+
+# The 'api' profile has no admin, the 'admin' profile only the admin, see
+# DJANGO_PROFILE
+if settings.DJANGO_PROFILE != 'api':
+    urlpatterns.append(path(
         'admin/',
-        admin.site.urls),
-    path(
-        'api/user/',
-        include('user.urls')),
-    path(
-        'api/cashback/',
-        include('cashback.urls')),
-    path(
-        'api/token/',
-        TokenObtainPairView.as_view(),
-        name='token_obtain_pair'),
-    path(
-        'api/token/refresh/',
-        TokenRefreshView.as_view(),
-        name='token_refresh'),
-]
+        admin.site.urls))
+
+if settings.DJANGO_PROFILE != 'admin':
+    urlpatterns += [
+        path(
+            'api/user/',
+            include('user.urls')),
+        path(
+            'api/cashback/',
+            include('cashback.urls')),
+        path(
+            'api/token/',
+            TokenObtainPairView.as_view(),
+            name='token_obtain_pair'),
+        path(
+            'api/token/refresh/',
+            TokenRefreshView.as_view(),
+            name='token_refresh'),
+    ]
@@ -0,0 +1,86 @@
+"""
+Filtering and ordering of the purchases list
+
+The list is always scoped to one revendedor, and every filter is backed
+by a composite index starting with it:
+
+    ?date_min=&date_max=&status=    (revendedor, status, date)
+                                    (revendedor, date) without status
+    ?value_min=&value_max=          (revendedor, value_cents)
+    ?code_min=&code_max=            (revendedor, code)
+
+A request filters by range and orders (?ordering=, - for descending) on
+a single one of those columns, and status only combines with date.
+Other combinations are rejected with a 400 instead of running a query
+that no index covers.
+"""
+from core.models import Compra, to_cents
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+def parse_day(value):
+    day = parse_date(value)
+    if day is None:
+        raise ValueError(value)
+    return day
+
+
+# Range filters: query parameter prefix -> (column, parser)
+RANGES = {
+    'date': ('date', parse_day),
+    'value': ('value_cents', to_cents),
+    'code': ('code', int),
+}
+
+DEFAULT_ORDERING = 'date'
+
+
+def parse_statuses(value):
+    """Returns the status codes of a comma separated list"""
+    statuses = [int(status) for status in value.split(',')]
+    if not set(statuses) <= set(Compra.Status.values):
+        raise ValueError(value)
+    return statuses
+
+
+class CompraFilterBackend(BaseFilterBackend):
+    """Range, status and ordering filters of the purchases list"""
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        filters = {}
+        columns = set()
+        try:
+            for name, (column, parse) in RANGES.items():
+                for suffix, lookup in (('min', 'gte'), ('max', 'lte')):
+                    value = params.get('%s_%s' % (name, suffix))
+                    if value:
+                        filters['%s__%s' % (column, lookup)] = parse(value)
+                        columns.add(name)
+            if params.get('status'):
+                filters['status__in'] = parse_statuses(params['status'])
+        except (ValueError, ArithmeticError):
+            raise ValidationError({'filters': 'Invalid filter value.'})
+
+        ordering = params.get('ordering')
+        if ordering:
+            if ordering.lstrip('-') not in RANGES:
+                raise ValidationError({
+                    'ordering': 'Order by one of: %s.' % ', '.join(RANGES)})
+            columns.add(ordering.lstrip('-'))
+        if 'status__in' in filters:
+            columns.add('date')
+
+        if len(columns) > 1:
+            raise ValidationError({
+                'filters': 'Filter and order on a single one of %s; status '
+                           'only combines with date.' % ', '.join(RANGES)})
+        if not filters and not ordering:
+            return queryset
+
+        name = columns.pop() if columns else DEFAULT_ORDERING
+        direction = '-' if ordering and ordering.startswith('-') else ''
+        return queryset.filter(**filters).order_by(
+            direction + RANGES[name][0], direction + 'id')
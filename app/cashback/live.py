@@ -0,0 +1,239 @@
+"""
+Live cashback events over Server-Sent Events
+
+An ASGI endpoint, routed in app/asgi.py, streaming the purchase_created,
+status_changed and tier_crossed events of the authenticated Revendedor,
+so dashboards do not poll list_purchases.
+
+The events are the outbox events NOTIFYed by PostgreSQL when their
+transaction commits. Each process holds one LISTEN connection, read from
+the event loop, and fans the events out to bounded per-stream queues:
+an open stream costs a queue and a coroutine, not a thread nor a
+database connection. A stream too slow to keep up misses events, its
+client can reload the list. A stream ends when its access token expires.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+import psycopg2
+from core import outbox
+from django.conf import settings
+from django.db import connection
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+logger = logging.getLogger(__name__)
+
+LIVE_PATH = '/api/cashback/events/'
+
+EVENT_NAMES = {
+    ('compra', 'created'): 'purchase_created',
+    ('compra', 'status_changed'): 'status_changed',
+    ('cashback', 'tier_crossed'): 'tier_crossed',
+}
+
+
+class Broker:
+    """Fans the events of the shared LISTEN connection out to the streams"""
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.listener = None
+        self.loop = None
+        self.lock = None
+
+    async def subscribe(self, revendedor):
+        """Returns the queue receiving the events of revendedor"""
+        await self.start()
+        queue = asyncio.Queue(maxsize=settings.LIVE_EVENTS_QUEUE_SIZE)
+        self.subscribers[revendedor].add(queue)
+        return queue
+
+    def unsubscribe(self, revendedor, queue):
+        self.subscribers[revendedor].discard(queue)
+        if not self.subscribers[revendedor]:
+            del self.subscribers[revendedor]
+
+    def publish(self, message):
+        """Queues an outbox event for the streams of its revendedor"""
+        name = EVENT_NAMES.get((message['topic'], message['event']))
+        if name is None:
+            return
+        revendedor = message['payload'].get('revendedor')
+        for queue in self.subscribers.get(revendedor, ()):
+            try:
+                queue.put_nowait((message['id'], name, message['payload']))
+            except asyncio.QueueFull:
+                logger.warning('Live stream of %s is lagging', revendedor)
+
+    async def start(self):
+        """
+        Opens the LISTEN connection on first use, PostgreSQL only
+
+        Streams arriving together wait on a lock for the first one to
+        connect, so the process still holds a single connection.
+        """
+        if connection.vendor != 'postgresql':
+            return
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # The lock and the reader belong to the loop they started on
+            if self.listener is not None:
+                self.listener.close()
+                self.listener = None
+            self.loop = loop
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if self.listener is not None:
+                return
+            self.listener = await loop.run_in_executor(None, self.connect)
+            loop.add_reader(self.listener.fileno(), self.read)
+
+    def connect(self):
+        listener = psycopg2.connect(**connection.get_connection_params())
+        listener.set_session(autocommit=True)
+        with listener.cursor() as cursor:
+            cursor.execute('LISTEN %s' % outbox.CHANNEL)
+        return listener
+
+    def read(self):
+        """Publishes the pending notifications of the LISTEN connection"""
+        try:
+            self.listener.poll()
+        except psycopg2.Error:
+            logger.exception('Live events connection lost')
+            self.stop()
+            # Reconnect for the streams still open
+            if self.subscribers:
+                asyncio.get_running_loop().call_later(
+                    5, lambda: asyncio.ensure_future(self.start()))
+            return
+        while self.listener.notifies:
+            notify = self.listener.notifies.pop(0)
+            if notify.payload:
+                self.publish(json.loads(notify.payload))
+
+    def stop(self):
+        if self.listener is None:
+            return
+        asyncio.get_running_loop().remove_reader(self.listener.fileno())
+        self.listener.close()
+        self.listener = None
+
+
+broker = Broker()
+
+
+def authenticate(scope):
+    """
+    Returns (Revendedor pk, expiry timestamp) of the request access token
+
+    EventSource can not send headers, so the token is also accepted as
+    the `token` query parameter. Only the signature is checked: no
+    query runs for the stream, which is closed when the token expires.
+    """
+    raw = None
+    for name, value in scope.get('headers', ()):
+        if name == b'authorization':
+            parts = value.decode('latin1').split()
+            if len(parts) == 2 and parts[0] in api_settings.AUTH_HEADER_TYPES:
+                raw = parts[1]
+    if raw is None:
+        query = parse_qs(scope.get('query_string', b'').decode('latin1'))
+        raw = query.get('token', [None])[0]
+    if not raw:
+        return None
+    try:
+        token = AccessToken(raw)
+    except TokenError:
+        return None
+    return token.get(api_settings.USER_ID_CLAIM), token['exp']
+
+
+def format_event(event_id, name, data):
+    """Returns an event in the text/event-stream format"""
+    return ('id: %s\nevent: %s\ndata: %s\n\n' % (
+        event_id, name, json.dumps(data))).encode()
+
+
+async def respond(send, status, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def live_events(scope, receive, send):
+    """ASGI application streaming the events of the Revendedor"""
+    if scope['method'] != 'GET':
+        await respond(send, 405, b'{"detail":"Method not allowed."}')
+        return
+    credentials = authenticate(scope)
+    if credentials is None:
+        await respond(
+            send, 401,
+            b'{"detail":"Authentication credentials were not provided."}')
+        return
+    revendedor, expires_at = credentials
+
+    queue = await broker.subscribe(revendedor)
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    get = None
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b': connected\n\n',
+            'more_body': True,
+        })
+        while not disconnected.done():
+            remaining = expires_at - time.time()
+            if remaining <= 0:
+                # The client reconnects with a new access token
+                await send({
+                    'type': 'http.response.body',
+                    'body': b': token expired\n\n',
+                })
+                break
+            get = asyncio.ensure_future(queue.get())
+            await asyncio.wait(
+                {get, disconnected},
+                timeout=min(settings.LIVE_EVENTS_KEEPALIVE, remaining),
+                return_when=asyncio.FIRST_COMPLETED)
+            if get.done():
+                body = format_event(*get.result())
+            else:
+                get.cancel()
+                body = b': keepalive\n\n'
+            if not disconnected.done():
+                await send({
+                    'type': 'http.response.body',
+                    'body': body,
+                    'more_body': True,
+                })
+    finally:
+        # A client gone while waiting leaves both tasks pending
+        if get is not None:
+            get.cancel()
+        disconnected.cancel()
+        broker.unsubscribe(revendedor, queue)
@@ -0,0 +1,48 @@
+from collections import Counter
+
+from cashback import mirror
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Django command to sync the provider balances into the local mirror
+
+    Usage: python manage.py sync_cashback_balances (--file FILE | --url URL)
+
+    The dump is a CSV with a cpf column, or NDJSON (.ndjson or .jsonl)
+    with one {"cpf": ..., ...} object per line; the other columns are the
+    balance, as the provider answers it.
+    """
+    help = 'Upserts the provider balances into ExternalCashbackBalance'
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--file', help='Provider dump, CSV or NDJSON')
+        source.add_argument('--url', help='Provider balances API URL')
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Balances upserted per statement batch')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] <= 0:
+            raise CommandError('--chunk-size must be greater than 0')
+        stats = Counter()
+        if options['file']:
+            path = options['file']
+            with open(path, newline='', encoding='utf-8') as f:
+                mirror.sync(
+                    mirror.read_dump(f, path, stats), stats,
+                    options['chunk_size'])
+        else:
+            mirror.sync(
+                mirror.fetch_pages(options['url'], stats), stats,
+                options['chunk_size'])
+
+        if stats['invalid']:
+            self.stdout.write(self.style.WARNING(
+                '%d invalid balances skipped' % stats['invalid']))
+        self.stdout.write(self.style.SUCCESS(
+            '%d balances synced in %.1f s (%.0f balances/s)' % (
+                stats['synced'], stats['seconds'],
+                stats['synced'] / max(stats['seconds'], 1e-9))))
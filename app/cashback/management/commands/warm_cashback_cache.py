@@ -0,0 +1,91 @@
+import datetime
+import time
+
+from cashback import provider
+from core.models import Compra, Revendedor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+
+def active_cpfs(days):
+    """
+    Returns the normalized CPFs of the recently active revendedores
+
+    Active revendedores registered a purchase or obtained a token, which
+    updates their last_login, within the last `days` days.
+    """
+    since = timezone.now() - datetime.timedelta(days=days)
+    buyers = Compra.objects.filter(
+        date__gte=since.date()).order_by().values('revendedor')
+    cpfs = Revendedor.objects.filter(
+        Q(pk__in=buyers) | Q(user__last_login__gte=since)
+    ).values_list('cpf', flat=True).iterator()
+    return sorted({provider.normalize_cpf(cpf) for cpf in cpfs})
+
+
+class Command(BaseCommand):
+    """
+    Django command to keep the balances of active revendedores cached
+
+    Usage: python manage.py warm_cashback_cache [--loop]
+
+    Balances missing from the cache, or expiring within --ahead seconds,
+    are fetched from the provider in concurrent batches of --batch-size,
+    at most --rate calls per second. With --loop it runs every
+    --interval seconds, which should be less than --ahead.
+    """
+    help = 'Pre-fetches the cashback balances of the active revendedores'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=30,
+            help='Revendedores active within these days are warmed')
+        parser.add_argument(
+            '--ahead', type=int, default=None,
+            help='Refresh balances expiring within these seconds, '
+                 'defaults to half CASHBACK_BALANCE_TTL')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--rate', type=float, default=50,
+            help='Maximum provider calls per second')
+        parser.add_argument('--loop', action='store_true')
+        parser.add_argument(
+            '--interval', type=int, default=300,
+            help='Seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0 or options['rate'] <= 0:
+            raise CommandError('--batch-size and --rate must be positive')
+        if options['ahead'] is None:
+            options['ahead'] = settings.CASHBACK_BALANCE_TTL // 2
+        while True:
+            self.warm(options)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def warm(self, options):
+        start = time.perf_counter()
+        cpfs = active_cpfs(options['days'])
+        stale = provider.expiring(cpfs, options['ahead'])
+        refreshed = failed = 0
+        size = options['batch_size']
+        for first in range(0, len(stale), size):
+            batch_start = time.perf_counter()
+            batch = stale[first:first + size]
+            results, errors = provider.fetch_balances(batch, refresh=True)
+            refreshed += len(results)
+            failed += len(errors)
+            # Keep the provider under --rate calls per second
+            pause = len(batch) / options['rate'] - (
+                time.perf_counter() - batch_start)
+            if pause > 0 and first + size < len(stale):
+                time.sleep(pause)
+
+        self.stdout.write(
+            '%d active revendedores: %d balances refreshed, %d fresh, '
+            '%d failed in %.1f s' % (
+                len(cpfs), refreshed, len(cpfs) - len(stale), failed,
+                time.perf_counter() - start))
@@ -0,0 +1,183 @@
+"""
+Local mirror of the provider balances
+
+The provider dump (CSV or NDJSON) or its paginated balances API is synced
+into the ExternalCashbackBalance table by the sync_cashback_balances
+command, in chunks of upserts. With CASHBACK_BALANCE_SOURCE = 'mirror'
+the balances synced within CASHBACK_MIRROR_MAX_AGE seconds are answered
+from the table, by its unique index on the normalized CPF; the others
+still go to the provider (and its cache).
+"""
+import csv
+import datetime
+import json
+import math
+import time
+from collections import Counter
+from itertools import islice
+
+from cashback import provider
+from core.models import ExternalCashbackBalance
+from django.conf import settings
+from django.utils import timezone
+
+
+def parse_value(value):
+    """
+    Returns a CSV value as a number when it is one
+
+    Raises ValueError for NaN and infinity, which jsonb can not store.
+    Digits with underscores, that int() and float() accept, stay text.
+    """
+    if '_' in value:
+        return value
+    for parse in (int, float):
+        try:
+            number = parse(value)
+        except ValueError:
+            continue
+        if not math.isfinite(number):
+            raise ValueError('Not a finite number: %r' % value)
+        return number
+    return value
+
+
+def reject_constant(name):
+    """Fails json.loads on NaN and Infinity, which jsonb can not store"""
+    raise ValueError('Not a finite number: %s' % name)
+
+
+def is_finite(value):
+    """Returns False when a JSON value holds NaN or infinity"""
+    if isinstance(value, float):
+        return math.isfinite(value)
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, list):
+        return True
+    return all(is_finite(item) for item in value)
+
+
+def parse_balances(records, stats):
+    """
+    Yields the valid (cpf, body) pairs of records, counting the others
+
+    The body is the record without its cpf, the same as the provider
+    answer for that CPF.
+    """
+    for record in records:
+        try:
+            body = dict(record)
+            cpf = provider.normalize_cpf(body.pop('cpf'))
+        except (KeyError, TypeError, ValueError):
+            cpf = None
+        if not cpf or len(cpf) != 11 or not body or not is_finite(body):
+            stats['invalid'] += 1
+            continue
+        yield cpf, body
+
+
+def read_csv(f, stats):
+    """Yields the balances of a CSV dump with a cpf column"""
+    def rows():
+        for row in csv.DictReader(f):
+            try:
+                yield {
+                    key: value if key == 'cpf' else parse_value(value)
+                    for key, value in row.items()}
+            except (TypeError, ValueError):
+                # Non finite values, or cells missing from a short row
+                stats['invalid'] += 1
+    return parse_balances(rows(), stats)
+
+
+def read_ndjson(f, stats):
+    """Yields the balances of a dump with one JSON object per line"""
+    def records():
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line, parse_constant=reject_constant)
+            except ValueError:
+                stats['invalid'] += 1
+    return parse_balances(records(), stats)
+
+
+def read_dump(f, path, stats):
+    """Yields the balances of a dump, NDJSON by extension, else CSV"""
+    if path.endswith(('.ndjson', '.jsonl')):
+        return read_ndjson(f, stats)
+    return read_csv(f, stats)
+
+
+def fetch_pages(url, stats, timeout=30):
+    """
+    Yields the balances of the provider balances API
+
+    The API answers {"balances": [{"cpf": ..., ...}], "next": url or
+    null}, pages are fetched while there is a next one.
+    """
+    import requests
+
+    with requests.Session() as session:
+        session.headers['token'] = settings.CASHBACK_PROVIDER_TOKEN
+        while url:
+            res = session.get(url, timeout=timeout)
+            res.raise_for_status()
+            page = res.json()
+            yield from parse_balances(page.get('balances', ()), stats)
+            url = page.get('next')
+
+
+def sync(balances, stats=None, chunk_size=5000):
+    """
+    Upserts (cpf, body) balances chunk by chunk
+
+    Every balance of a run gets the same synced_at. Returns the stats:
+    balances synced, invalid ones and the elapsed seconds. CPFs repeated
+    in a chunk keep their last balance.
+    """
+    stats = Counter() if stats is None else stats
+    start = time.perf_counter()
+    synced_at = timezone.now()
+    balances = iter(balances)
+    while True:
+        chunk = dict(islice(balances, chunk_size))
+        if not chunk:
+            break
+        stats['synced'] += ExternalCashbackBalance.objects.upsert(
+            chunk, synced_at)
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def lookup(cpfs):
+    """Returns {cpf: balance} of the normalized CPFs mirrored fresh"""
+    if settings.CASHBACK_BALANCE_SOURCE != 'mirror':
+        return {}
+    fresh = timezone.now() - datetime.timedelta(
+        seconds=settings.CASHBACK_MIRROR_MAX_AGE)
+    return dict(ExternalCashbackBalance.objects.filter(
+        cpf__in=cpfs, synced_at__gte=fresh).values_list('cpf', 'body'))
+
+
+def fetch_balance(cpf):
+    """Returns the balance of a normalized CPF, mirrored or provided"""
+    mirrored = lookup([cpf])
+    if cpf in mirrored:
+        return mirrored[cpf]
+    return provider.fetch_balance(cpf)
+
+
+def fetch_balances(cpfs):
+    """
+    Returns the balances of normalized CPFs, as provider.fetch_balances
+
+    Only the CPFs missing from the mirror are asked to the provider.
+    """
+    mirrored = lookup(cpfs)
+    results, errors = provider.fetch_balances(
+        [cpf for cpf in cpfs if cpf not in mirrored])
+    results.update(mirrored)
+    return results, errors
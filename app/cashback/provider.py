@@ -0,0 +1,221 @@
+"""
+Client of the external cashback provider
+
+Every call goes through one requests.Session, so connections to the
+provider are kept alive and reused, and batches of CPFs are fetched
+concurrently by a shared thread pool: at most
+CASHBACK_PROVIDER_CONCURRENCY calls are in flight per process, whatever
+the number of requests asking.
+
+Balances are cached for CASHBACK_BALANCE_TTL seconds, and kept warm for
+the active resellers by the warm_cashback_cache command. Concurrent
+lookups of a CPF missing from the cache are coalesced into one provider
+call: within a process by a SingleFlight, and across workers by a short
+lock in the cache, whose holder caches the answer for the others. The
+cross-worker half needs a cache shared by the workers (CACHES), as does
+the CASHBACK_PROVIDER_RATE limit of the calls of every worker.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from core import throttling
+from core.singleflight import SingleFlight
+from django.conf import settings
+from django.core.cache import cache
+
+MISSING = object()
+LOCK_POLL_INTERVAL = 0.05
+
+flights = SingleFlight()
+
+_session = None
+_executor = None
+_lock = threading.Lock()
+
+
+class ProviderError(Exception):
+    """
+    A failed provider call
+
+    `status` is the provider response status, None when it could not be
+    reached.
+    """
+
+    def __init__(self, detail, status=None):
+        super().__init__(detail)
+        self.detail = detail
+        self.status = status
+
+
+def normalize_cpf(cpf):
+    """Returns the digits of a CPF"""
+    return ''.join(c for c in str(cpf) if c.isdigit())
+
+
+def get_session():
+    """Returns the provider session, sized for the concurrent calls"""
+    global _session
+    with _lock:
+        if _session is None:
+            # Imported on the first call, not by every worker booting
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            _session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_maxsize=settings.CASHBACK_PROVIDER_CONCURRENCY)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+            _session.headers['token'] = settings.CASHBACK_PROVIDER_TOKEN
+    return _session
+
+
+def get_executor():
+    """Returns the pool running the concurrent provider calls"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.CASHBACK_PROVIDER_CONCURRENCY,
+                thread_name_prefix='cashback-provider')
+    return _executor
+
+
+def wait_turn():
+    """
+    Waits until a call fits CASHBACK_PROVIDER_RATE
+
+    Raises a ProviderError 429 when the wait would be longer than
+    CASHBACK_PROVIDER_TIMEOUT.
+    """
+    rate = settings.CASHBACK_PROVIDER_RATE
+    if not rate:
+        return
+    deadline = time.monotonic() + settings.CASHBACK_PROVIDER_TIMEOUT
+    while True:
+        wait = throttling.take([('provider', rate)])
+        if not wait:
+            return
+        if time.monotonic() + wait > deadline:
+            raise ProviderError('Provider rate limit exceeded', 429)
+        time.sleep(wait)
+
+
+def call_provider(cpf):
+    """Asks the provider the accumulated cashback of a normalized CPF"""
+    import requests
+
+    wait_turn()
+    try:
+        res = get_session().get(
+            settings.CASHBACK_PROVIDER_URL,
+            params={'cpf': cpf},
+            timeout=settings.CASHBACK_PROVIDER_TIMEOUT)
+    except requests.RequestException as error:
+        raise ProviderError('Provider unavailable: %s' % error)
+    if res.status_code != 200:
+        raise ProviderError(
+            'Provider answered %d' % res.status_code, res.status_code)
+    try:
+        return res.json().get('body')
+    except (ValueError, AttributeError):
+        # Not JSON, or not the {"body": ...} object
+        raise ProviderError('Invalid provider answer', res.status_code)
+
+
+def balance_key(cpf):
+    return 'cashback:balance:%s' % cpf
+
+
+def store_balance(cpf, balance):
+    """Caches a provider answer for CASHBACK_BALANCE_TTL seconds"""
+    ttl = settings.CASHBACK_BALANCE_TTL
+    cache.set(balance_key(cpf), {
+        'balance': balance,
+        'expires_at': time.time() + ttl,
+    }, ttl)
+    return balance
+
+
+def expiring(cpfs, ahead):
+    """Returns the CPFs not cached or whose balance expires within ahead"""
+    keys = {balance_key(cpf): cpf for cpf in cpfs}
+    cached = cache.get_many(keys)
+    limit = time.time() + ahead
+    return [
+        cpf for key, cpf in keys.items()
+        if key not in cached or cached[key]['expires_at'] <= limit
+    ]
+
+
+def lock_timeout():
+    """
+    Returns the seconds a provider call may take, waiting for its turn
+    in CASHBACK_PROVIDER_RATE included
+    """
+    return 2 * settings.CASHBACK_PROVIDER_TIMEOUT + 1
+
+
+def release(lock, token):
+    """Deletes lock unless it expired and another worker took it"""
+    if cache.get(lock) == token:
+        cache.delete(lock)
+
+
+def shared_balance(cpf):
+    """
+    Returns the cached balance, or calls the provider unless another
+    worker is already calling it
+
+    The worker adding the lock key calls the provider and caches the
+    answer. The others wait for that answer, and call the provider
+    themselves if it does not come before the lock expires: errors are
+    not cached.
+    """
+    key = balance_key(cpf)
+    lock = '%s:lock' % key
+    token = uuid.uuid4().hex
+    timeout = lock_timeout()
+    deadline = time.monotonic() + timeout
+    while True:
+        cached = cache.get(key, MISSING)
+        if cached is not MISSING:
+            return cached['balance']
+        if cache.add(lock, token, timeout):
+            try:
+                return store_balance(cpf, call_provider(cpf))
+            finally:
+                release(lock, token)
+        if time.monotonic() >= deadline:
+            return call_provider(cpf)
+        time.sleep(LOCK_POLL_INTERVAL)
+
+
+def fetch_balance(cpf):
+    """Returns the accumulated cashback of a normalized CPF"""
+    return flights.do(cpf, shared_balance, cpf)
+
+
+def refresh_balance(cpf):
+    """Calls the provider for a CPF and caches its answer"""
+    return store_balance(cpf, call_provider(cpf))
+
+
+def fetch_balances(cpfs, refresh=False):
+    """
+    Fetches the balances of normalized CPFs concurrently
+
+    Returns ({cpf: balance}, {cpf: ProviderError}): a failed call does
+    not fail the others. With `refresh` the cached balances are ignored.
+    """
+    fetch = refresh_balance if refresh else fetch_balance
+    futures = {cpf: get_executor().submit(fetch, cpf) for cpf in cpfs}
+    results, errors = {}, {}
+    for cpf, future in futures.items():
+        try:
+            results[cpf] = future.result()
+        except ProviderError as error:
+            errors[cpf] = error
+    return results, errors
@@ -1,11 +1,73 @@
-from core.models import Compra
+import math
+from collections import defaultdict
+
+from core import jobs, outbox
+from core.models import (STATUS_STR, ArchivedMonth, Compra, Revendedor,
+                         cashback_cents, cashback_percent, to_cents)
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BigIntegerField, Value
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.validators import UniqueValidator
+
+
+def lock_month_totals(revendedor):
+    """
+    Locks a revendedor until the end of the transaction
+
+    Changes of its purchases then run one at a time, and each one sees
+    the month totals of the previous ones when it tells whether it
+    crossed a tier. FOR NO KEY UPDATE does not wait for the key share
+    locks of the purchase inserts, only for another change.
+    """
+    list(Revendedor.objects.select_for_update(no_key=True).filter(
+        pk=revendedor).values_list('pk'))
+
+
+def record_tier_crossing(revendedor, month, total, change):
+    """
+    Writes a tier_crossed event when a change of `change` cents moved
+    the month `total` of a revendedor to another tier
+    """
+    percent = cashback_percent(total)
+    previous = cashback_percent(total - change)
+    if percent != previous:
+        outbox.record('tier_crossed', [{
+            'revendedor': revendedor,
+            'month': month.replace(day=1).isoformat(),
+            'month_total': total / 100,
+            'cashback_percent': percent,
+            'previous_cashback_percent': previous,
+        }], topic='cashback', key='revendedor')
+
+
+def record_tier_changes(revendedor, changes):
+    """
+    Writes the tier_crossed events of updated or deleted purchases
+
+    `changes` are the (date, cents) added to the months of a revendedor,
+    negative for the values removed. Runs after lock_month_totals, in
+    the transaction of the changes.
+    """
+    deltas = defaultdict(int)
+    for date, cents in changes:
+        deltas[date.replace(day=1)] += cents
+    deltas = {month: delta for month, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    totals = Compra.objects.month_totals(
+        [revendedor], min(deltas), max(deltas))
+    for month in sorted(deltas):
+        record_tier_crossing(
+            revendedor, month, totals.get((revendedor, month), 0),
+            deltas[month])
 
 
 class CompraSerializer(serializers.ModelSerializer):
     """Serializer for purchases"""
+    value = serializers.FloatField()
 
     class Meta:
         model = Compra
@@ -21,14 +83,53 @@ class CompraSerializer(serializers.ModelSerializer):
             'status_str')
         read_only_fields = ('id',)
 
+    def __init__(self, *args, **kwargs):
+        """Accepts a `fields` argument to serialize only those fields"""
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def get_fields(self):
+        """
+        Drops the UniqueValidator of code when creating a purchase
+
+        Uniqueness of code is then enforced by the INSERT in create, the
+        validator would run a SELECT first. Updates keep it.
+        """
+        fields = super().get_fields()
+        if self.instance is None and 'code' in fields:
+            fields['code'].validators = [
+                validator for validator in fields['code'].validators
+                if not isinstance(validator, UniqueValidator)]
+        return fields
+
+    def validate_value(self, value):
+        """Rejects NaN and infinity, which have no amount in cents"""
+        if not math.isfinite(value):
+            raise serializers.ValidationError(
+                _('A valid number is required.'), code='invalid')
+        return value
+
     def validate(self, attrs):
         """Validate Compra object"""
-        if attrs.get('value') <= 0:
+        # The amount stored is in cents: 0.004 is not greater than 0
+        if 'value' in attrs and to_cents(attrs['value']) <= 0:
             message = _(
                 'Purchase value must be greater than 0!'
             )
             raise serializers.ValidationError(message, code='purchase')
-        if attrs.get('revendedor').user != self.context.get('request').user:
+        # A partial update may leave the date as it is
+        if 'date' in attrs and ArchivedMonth.objects.filter(
+                month=attrs['date'].replace(day=1)).exists():
+            message = _(
+                'Purchases of archived months can not be registered!'
+            )
+            raise serializers.ValidationError(message, code='date')
+        # The Revendedor primary key is its user, comparing the keys
+        # avoids loading the user
+        if attrs.get('revendedor').pk != self.context.get('request').user.pk:
             raise PermissionDenied()
         cpf = attrs.get('revendedor').cpf
         if ''.join(c for c in cpf if c.isdigit()) == '15350946056':
@@ -36,3 +137,157 @@ class CompraSerializer(serializers.ModelSerializer):
         else:
             attrs['status'] = 1
         return attrs
+
+    def create(self, validated_data):
+        """
+        Creates the purchase, or returns it when the request is a retry
+
+        A retry has the same Idempotency-Key, or the same code with the
+        same revendedor, value and date. `created` tells both apart.
+        """
+        key = self.context.get('idempotency_key')
+        with transaction.atomic():
+            lock_month_totals(validated_data['revendedor'].pk)
+            compra, self.created = Compra.objects.create_or_get(
+                code=validated_data['code'],
+                value_cents=to_cents(validated_data['value']),
+                date=validated_data['date'],
+                revendedor_id=validated_data['revendedor'].pk,
+                status=validated_data['status'],
+                idempotency_key=key)
+            if self.created:
+                outbox.record('created', [outbox.purchase_payload(compra)])
+                record_tier_crossing(
+                    compra.revendedor_id, compra.date,
+                    compra.month_total_cents, compra.value_cents)
+                if (settings.STATUS_DECISION_URL and
+                        compra.status == Compra.Status.EM_VALIDACAO):
+                    jobs.enqueue(
+                        'cashback.check_purchase_status',
+                        {'code': compra.code})
+        if self.created:
+            return compra
+
+        same = compra is not None and (
+            compra.code,
+            compra.value_cents,
+            compra.date,
+            compra.revendedor_id
+        ) == (
+            validated_data['code'],
+            to_cents(validated_data['value']),
+            validated_data['date'],
+            validated_data['revendedor'].pk)
+        if same:
+            return compra
+        if key and compra is not None and compra.idempotency_key == key:
+            message = _(
+                'Idempotency-Key already used for another purchase!'
+            )
+            raise serializers.ValidationError(
+                {'idempotency_key': [message]}, code='idempotency_key')
+        message = _('compra with this code already exists.')
+        raise serializers.ValidationError({'code': [message]}, code='unique')
+
+
+class CompraReadSerializer:
+    """
+    Read-only serializer for purchase lists
+
+    Works straight from `values_list` rows plus the monthly totals of a
+    single GROUP BY query, so no Compra instance is built and no DRF
+    field runs per row. The output is the same as CompraSerializer.
+
+    When `fields` is given only those fields are returned, and the
+    monthly totals are not queried unless a cashback field is requested.
+    """
+    columns = (
+        'id',
+        'code',
+        'value_cents',
+        'date',
+        'revendedor_id',
+        'status')
+
+    cashback_fields = ('cashback_percent', 'cashback_value')
+
+    def __init__(self, queryset, fields=None):
+        self.queryset = queryset
+        if fields is None:
+            fields = CompraSerializer.Meta.fields
+        self.fields = fields
+        self.pruned = len(self.fields) < len(CompraSerializer.Meta.fields)
+        self.with_cashback = any(
+            name in self.fields for name in self.cashback_fields)
+
+    def to_representation(self, row, month_total=None):
+        """Converts a values_list row into the CompraSerializer format"""
+        pk, code, value_cents, date, revendedor, status = row
+        data = {
+            'id': pk,
+            'code': code,
+            'value': value_cents / 100,
+            'date': date.isoformat(),
+            'revendedor': revendedor,
+            'status': status,
+        }
+        if month_total is not None:
+            percent = cashback_percent(month_total)
+            data['cashback_percent'] = percent
+            data['cashback_value'] = cashback_cents(
+                value_cents, percent) / 100
+        data['status_str'] = STATUS_STR.get(status, STATUS_STR[3])
+        if self.pruned:
+            return {name: data[name] for name in self.fields}
+        return data
+
+    @property
+    def data(self):
+        rows = list(self.queryset.values_list(*self.columns))
+        if not rows:
+            return []
+        if not self.with_cashback:
+            return [self.to_representation(row) for row in rows]
+        dates = [row[3] for row in rows]
+        totals = self.queryset.model.objects.month_totals(
+            {row[4] for row in rows}, min(dates), max(dates))
+        return [
+            self.to_representation(
+                row, totals[(row[4], row[3].replace(day=1))])
+            for row in rows
+        ]
+
+
+class CompraMonthsSerializer(CompraReadSerializer):
+    """
+    Read-only serializer of purchases grouped by month
+
+    `rows()` adds the month total of every purchase to the values_list
+    columns, computed by a window in the same query, so the tiers of a
+    whole range of months need no other query. `group()` converts a
+    page of those rows, ordered by date, into months of purchases.
+    """
+
+    def rows(self, queryset):
+        """Returns the values_list rows of queryset with the month total"""
+        if self.with_cashback:
+            queryset = queryset.with_month_totals()
+        else:
+            queryset = queryset.annotate(month_total_cents=Value(
+                None, output_field=BigIntegerField()))
+        return queryset.values_list(*self.columns, 'month_total_cents')
+
+    def group(self, rows):
+        months = []
+        for row in rows:
+            month = row[3].strftime('%Y-%m')
+            if not months or months[-1]['month'] != month:
+                months.append({'month': month})
+                if self.with_cashback:
+                    months[-1]['total'] = row[6] / 100
+                    months[-1]['cashback_percent'] = cashback_percent(
+                        row[6])
+                months[-1]['purchases'] = []
+            months[-1]['purchases'].append(
+                self.to_representation(row[:6], row[6]))
+        return months
@@ -0,0 +1,96 @@
+"""
+Monthly summary of the last months of a revendedor
+
+Purchase count, total, tier, cashback and status breakdown of each of
+the last SUMMARY_MONTHS months: one GROUP BY over Compra, plus the
+MonthlySummary rollups when some of the months are archived. Summaries
+are cached per revendedor for CASHBACK_SUMMARY_TTL seconds and dropped
+when the API changes a purchase; status changes made elsewhere (jobs,
+reconciliation) show up once the cached summary expires.
+"""
+import datetime
+
+from core.archive import archive_cutoff
+from core.models import Compra, MonthlySummary, cashback_percent, next_month
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+SUMMARY_MONTHS = 12
+
+EMPTY_MONTH = {
+    'purchase_count': 0,
+    'total_cents': 0,
+    'cashback_percent': cashback_percent(0),
+    'cashback_cents': 0,
+    'em_validacao_count': 0,
+    'aprovado_count': 0,
+    'nao_aprovado_count': 0,
+}
+
+
+def summary_months(today=None):
+    """Returns the first day of the last SUMMARY_MONTHS months, oldest first"""
+    today = today or datetime.date.today()
+    last = today.year * 12 + today.month - 1
+    return [
+        datetime.date(months // 12, months % 12 + 1, 1)
+        for months in range(last - SUMMARY_MONTHS + 1, last + 1)
+    ]
+
+
+def summary_key(revendedor):
+    return 'cashback:summary:%s' % revendedor
+
+
+def build_summary(revendedor, months):
+    """Returns the summary of the months of a revendedor"""
+    rows = {
+        row['month']: row
+        for row in Compra.objects.filter(
+            revendedor=revendedor
+        ).in_months(months[0], months[-1]).monthly_summaries()
+    }
+    if months[0] < archive_cutoff():
+        rows.update({
+            row['month']: row
+            for row in MonthlySummary.objects.filter(
+                revendedor=revendedor,
+                month__gte=months[0],
+                month__lt=next_month(months[-1])
+            ).values()
+        })
+
+    summary = []
+    for month in months:
+        row = rows.get(month, EMPTY_MONTH)
+        summary.append({
+            'month': month.strftime('%Y-%m'),
+            'purchase_count': row['purchase_count'],
+            'total': row['total_cents'] / 100,
+            'cashback_percent': row['cashback_percent'],
+            'cashback_value': row['cashback_cents'] / 100,
+            'em_validacao_count': row['em_validacao_count'],
+            'aprovado_count': row['aprovado_count'],
+            'nao_aprovado_count': row['nao_aprovado_count'],
+        })
+    return summary
+
+
+def get_summary(revendedor, today=None):
+    """Returns the cached summary of a revendedor, building it if needed"""
+    months = summary_months(today)
+    key = summary_key(revendedor)
+    cached = cache.get(key)
+    # A summary cached last month is not the summary of these months
+    if cached is not None and cached[-1]['month'] == (
+            months[-1].strftime('%Y-%m')):
+        return cached
+    summary = build_summary(revendedor, months)
+    cache.set(key, summary, settings.CASHBACK_SUMMARY_TTL)
+    return summary
+
+
+def invalidate(revendedor):
+    """Drops the cached summary of a revendedor once the change commits"""
+    transaction.on_commit(lambda: cache.delete(summary_key(revendedor)))
@@ -0,0 +1,16 @@
+from core import jobs, reconciliation
+from django.conf import settings
+
+
+@jobs.task('cashback.check_purchase_status')
+def check_purchase_status(code):
+    """Applies the status decision service answer to a new purchase"""
+    import requests
+
+    res = requests.get(
+        settings.STATUS_DECISION_URL, params={'code': code}, timeout=10)
+    res.raise_for_status()
+    decision = res.json().get('status')
+    if decision is not None:
+        reconciliation.apply_decisions(
+            [(code, reconciliation.parse_status(decision))])
@@ -1,10 +1,14 @@
 from datetime import date, datetime
 from enum import Enum
+from unittest.mock import patch
 
-from cashback.serializers import CompraSerializer
-from core.models import Compra, Revendedor
+from cashback.serializers import CompraReadSerializer, CompraSerializer
+from core import jobs
+from core.archive import archive_month
+from core.models import Compra, Job, Revendedor
+from core.renderers import ORJSONRenderer
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -528,6 +532,41 @@ class PrivateCashbackApiTests(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_compra_value_under_a_cent(self):
+        """Test a value rounding to 0 cents is not greater than 0"""
+        payload = {
+            'code': 1,
+            'value': 0.004,
+            'date': datetime.now().date(),
+            'revendedor': self.revendedor.pk
+        }
+        res = self.client.post(CASHBACK_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Compra.objects.exists())
+
+    def test_compra_value_not_finite(self):
+        """Test NaN and infinite values are rejected on create and update"""
+        compra = sample_compra(revendedor=self.revendedor, code=1)
+        url = reverse('cashback:compra-detail', args=[compra.id])
+        for value in ('nan', 'inf', '-inf'):
+            payload = {
+                'code': 2,
+                'value': value,
+                'date': datetime.now().date(),
+                'revendedor': self.revendedor.pk
+            }
+            res = self.client.post(CASHBACK_URL, payload)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('value', res.data)
+
+            res = self.client.patch(url, {
+                'value': value, 'revendedor': self.revendedor.pk})
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        compra.refresh_from_db()
+        self.assertEqual(compra.value_cents, 199)
+
     def test_compra_same_code_fails(self):
         """Test that code is unique"""
         sample_compra(revendedor=self.revendedor, code=1)
@@ -625,3 +664,354 @@ class PrivateCashbackApiTests(TestCase):
         res = self.client.get(LIST_PURCHASES_URL)
 
         self.assertEqual(res.data[0].get('status'), Status.EM_VALIDACAO.value)
+
+    def test_read_serializer_same_output(self):
+        """
+        Test the read serializer renders the same JSON as CompraSerializer
+        across months and cashback tiers
+        """
+        sample_compra(
+            revendedor=self.revendedor, code=1, value=999.99,
+            date=date(2021, 1, 10))
+        sample_compra(
+            revendedor=self.revendedor, code=2, value=600.0,
+            date=date(2021, 2, 10))
+        sample_compra(
+            revendedor=self.revendedor, code=3, value=1000.0,
+            date=date(2021, 2, 11))
+        sample_compra(
+            revendedor=self.revendedor, code=4, value=1200.5,
+            date=date(2021, 3, 1))
+        queryset = Compra.objects.order_by('code')
+
+        renderer = ORJSONRenderer()
+        self.assertEqual(
+            renderer.render(CompraReadSerializer(queryset).data),
+            renderer.render(CompraSerializer(queryset, many=True).data))
+
+    def test_list_purchases_number_of_queries(self):
+        """Test listing purchases does not run one query per purchase"""
+        for code in range(1, 11):
+            sample_compra(
+                revendedor=self.revendedor, code=code,
+                date=date(2021, 8, code))
+
+        with self.assertNumQueries(3):
+            res = self.client.get(
+                LIST_PURCHASES_URL, {'year': 2021, 'month': 8})
+
+        self.assertEqual(len(res.data), 10)
+
+    def test_list_purchases_sparse_fields(self):
+        """Test ?fields= returns only the requested fields"""
+        sample_compra(revendedor=self.revendedor, code=1)
+
+        res = self.client.get(CASHBACK_URL, {'fields': 'code,date'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(res.data[0].keys()), ['code', 'date'])
+
+    def test_list_purchases_omit_cashback_skips_totals(self):
+        """Test omitting the cashback fields skips the monthly totals"""
+        for code in range(1, 4):
+            sample_compra(
+                revendedor=self.revendedor, code=code, date=date(2021, 8, 1))
+
+        with self.assertNumQueries(2):
+            res = self.client.get(LIST_PURCHASES_URL, {
+                'year': 2021,
+                'month': 8,
+                'omit': 'cashback_percent,cashback_value'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('cashback_value', res.data[0])
+        self.assertIn('status_str', res.data[0])
+
+    def test_retrieve_purchase_sparse_fields(self):
+        """Test ?fields= also applies to a single purchase"""
+        compra = sample_compra(revendedor=self.revendedor, code=1)
+
+        res = self.client.get(
+            reverse('cashback:compra-detail', args=[compra.id]),
+            {'fields': 'code,cashback_percent'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'code': 1, 'cashback_percent': 10})
+
+    def test_sparse_fields_unknown_field(self):
+        """Test asking for an unknown field fails"""
+        res = self.client.get(CASHBACK_URL, {'fields': 'code,password'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_tier1_cashback_limit_exact_sum(self):
+        """
+        Test a month totalling exactly 1.000 stays in tier 1, even when
+        summing the values as floats would go over the limit
+        """
+        for code in range(1, 10):
+            sample_compra(
+                revendedor=self.revendedor, code=code, value=6.59,
+                date=date(2021, 4, 1))
+        sample_compra(
+            revendedor=self.revendedor, code=10, value=940.69,
+            date=date(2021, 4, 2))
+
+        res = self.client.get(LIST_PURCHASES_URL, {'year': 2021, 'month': 4})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {purchase['cashback_percent'] for purchase in res.data}, {10})
+        self.assertEqual(res.data[-1]['cashback_value'], 94.07)
+
+    def test_create_purchase_in_archived_month_fails(self):
+        """Test purchases of an archived month are rejected"""
+        archive_month(date(2015, 1, 1))
+        payload = {
+            'code': 1,
+            'value': 10.0,
+            'date': date(2015, 1, 20),
+            'revendedor': self.revendedor.pk
+        }
+        res = self.client.post(CASHBACK_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Compra.objects.exists())
+
+    def test_create_old_purchase_not_archived(self):
+        """Test purchases of old months not archived are accepted"""
+        payload = {
+            'code': 1,
+            'value': 10.0,
+            'date': date(2015, 1, 20),
+            'revendedor': self.revendedor.pk
+        }
+        res = self.client.post(CASHBACK_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_partial_update_without_date(self):
+        """Test a partial update leaving the date keeps the purchase date"""
+        compra = sample_compra(revendedor=self.revendedor, code=1)
+        payload = {'value': 25.0, 'revendedor': self.revendedor.pk}
+        res = self.client.patch(
+            reverse('cashback:compra-detail', args=[compra.id]), payload)
+
+        compra.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(compra.value_cents, 2500)
+        self.assertEqual(compra.date, datetime.now().date())
+
+    def test_update_purchase_same_code_fails(self):
+        """Test updating a purchase to the code of another one fails"""
+        sample_compra(revendedor=self.revendedor, code=1)
+        compra = sample_compra(revendedor=self.revendedor, code=2)
+        url = reverse('cashback:compra-detail', args=[compra.id])
+        payload = {
+            'code': 1,
+            'value': 10.0,
+            'date': datetime.now().date(),
+            'revendedor': self.revendedor.pk
+        }
+        put = self.client.put(url, payload)
+        patch = self.client.patch(
+            url, {'code': 1, 'value': 10.0, 'revendedor': self.revendedor.pk})
+
+        compra.refresh_from_db()
+        self.assertEqual(put.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(patch.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('code', patch.data)
+        self.assertEqual(compra.code, 2)
+
+    def test_create_purchase_retry_is_idempotent(self):
+        """Test retrying the same create returns the existing purchase"""
+        payload = {
+            'code': 1,
+            'value': 135.9,
+            'date': datetime.now().date(),
+            'revendedor': self.revendedor.pk
+        }
+        first = self.client.post(CASHBACK_URL, payload)
+        retry = self.client.post(CASHBACK_URL, payload)
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(Compra.objects.count(), 1)
+
+    def test_create_purchase_same_code_other_payload_fails(self):
+        """Test reusing a code for another purchase reports the code"""
+        sample_compra(revendedor=self.revendedor, code=1, value=10.0)
+        payload = {
+            'code': 1,
+            'value': 20.0,
+            'date': datetime.now().date(),
+            'revendedor': self.revendedor.pk
+        }
+        res = self.client.post(CASHBACK_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('code', res.data)
+
+    def test_create_purchase_idempotency_key(self):
+        """Test an Idempotency-Key can not be reused for another purchase"""
+        payload = {
+            'code': 1,
+            'value': 10.0,
+            'date': datetime.now().date(),
+            'revendedor': self.revendedor.pk
+        }
+        first = self.client.post(
+            CASHBACK_URL, payload, HTTP_IDEMPOTENCY_KEY='abc')
+        retry = self.client.post(
+            CASHBACK_URL, payload, HTTP_IDEMPOTENCY_KEY='abc')
+        payload['code'] = 2
+        reused = self.client.post(
+            CASHBACK_URL, payload, HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(reused.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('idempotency_key', reused.data)
+        self.assertEqual(Compra.objects.count(), 1)
+
+    def test_create_purchase_idempotency_key_before_code(self):
+        """
+        Test a retry finds its purchase by Idempotency-Key even when the
+        code matches another purchase
+        """
+        payload = {
+            'code': 1,
+            'value': 10.0,
+            'date': datetime.now().date(),
+            'revendedor': self.revendedor.pk
+        }
+        sample_compra(revendedor=self.revendedor, code=2, value=10.0)
+        first = self.client.post(
+            CASHBACK_URL, payload, HTTP_IDEMPOTENCY_KEY='abc')
+        payload['code'] = 2
+        reused = self.client.post(
+            CASHBACK_URL, payload, HTTP_IDEMPOTENCY_KEY='abc')
+        other = self.client.post(
+            CASHBACK_URL, dict(payload, value=20.0),
+            HTTP_IDEMPOTENCY_KEY='def')
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(reused.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('idempotency_key', reused.data)
+        self.assertEqual(other.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('code', other.data)
+
+    def test_create_purchase_number_of_queries(self):
+        """
+        Test creating a purchase only loads and locks the revendedor,
+        checks its month is not archived, inserts it with its outbox
+        event and reads the month total for the response
+        """
+        payload = {
+            'code': 1,
+            'value': 10.0,
+            'date': datetime.now().date(),
+            'revendedor': self.revendedor.pk
+        }
+        # the inserts run in a savepoint
+        with self.assertNumQueries(8):
+            res = self.client.post(CASHBACK_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    @override_settings(STATUS_DECISION_URL='http://decisions.local/')
+    @patch('requests.get')
+    def test_create_purchase_checks_status_in_background(self, get):
+        """Test a new purchase gets its status from a background job"""
+        get.return_value.json.return_value = {'status': 'APROVADO'}
+        payload = {
+            'code': 1,
+            'value': 10.0,
+            'date': datetime.now().date(),
+            'revendedor': self.revendedor.pk
+        }
+        res = self.client.post(CASHBACK_URL, payload)
+
+        self.assertEqual(res.data['status'], Status.EM_VALIDACAO.value)
+        self.assertFalse(get.called)
+        self.assertEqual(Job.objects.get().payload, {'code': 1})
+
+        jobs.autodiscover()
+        self.assertIsNotNone(jobs.run_next())
+
+        self.assertEqual(
+            Compra.objects.get(code=1).status, Status.APROVADO.value)
+        self.assertFalse(Job.objects.exists())
+
+    def test_list_purchases_range_by_month(self):
+        """Test a range of months is listed by month with their tiers"""
+        sample_compra(
+            revendedor=self.revendedor, code=1, value=900.0,
+            date=date(2021, 1, 10))
+        sample_compra(
+            revendedor=self.revendedor, code=2, value=600.0,
+            date=date(2021, 1, 20))
+        sample_compra(
+            revendedor=self.revendedor, code=3, value=100.0,
+            date=date(2021, 3, 1))
+        sample_compra(
+            revendedor=self.revendedor, code=4, value=100.0,
+            date=date(2021, 4, 1))
+
+        with self.assertNumQueries(3):
+            res = self.client.get(
+                LIST_PURCHASES_URL, {'start': '2021-01', 'end': '2021-03'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 3)
+        months = res.data['results']
+        self.assertEqual([m['month'] for m in months], ['2021-01', '2021-03'])
+        self.assertEqual(months[0]['total'], 1500.0)
+        self.assertEqual(months[0]['cashback_percent'], 15)
+        self.assertEqual(
+            [p['cashback_value'] for p in months[0]['purchases']],
+            [135.0, 90.0])
+        self.assertEqual(months[1]['cashback_percent'], 10)
+
+    def test_list_purchases_range_pages(self):
+        """Test a month split across pages keeps its whole month tier"""
+        for code in range(1, 4):
+            sample_compra(
+                revendedor=self.revendedor, code=code, value=600.0,
+                date=date(2021, 1, code))
+
+        res = self.client.get(LIST_PURCHASES_URL, {
+            'start': '2021-01', 'end': '2021-01', 'page_size': 2,
+            'page': 2})
+
+        self.assertIsNone(res.data['next'])
+        month = res.data['results'][0]
+        self.assertEqual(month['total'], 1800.0)
+        self.assertEqual(month['cashback_percent'], 20)
+        self.assertEqual(
+            [p['code'] for p in month['purchases']], [3])
+
+    def test_list_purchases_range_reads_archive(self):
+        """Test archived months of a range come from the archive"""
+        old = date(2019, 3, 1)
+        sample_compra(
+            revendedor=self.revendedor, code=1, value=1200.0, date=old)
+        sample_compra(revendedor=self.revendedor, code=2)
+        archive_month(old)
+
+        res = self.client.get(LIST_PURCHASES_URL, {'start': '2019-03'})
+
+        months = res.data['results']
+        self.assertEqual(len(months), 2)
+        self.assertEqual(months[0]['month'], '2019-03')
+        self.assertEqual(months[0]['cashback_percent'], 15)
+        self.assertEqual(months[1]['purchases'][0]['code'], 2)
+
+    def test_list_purchases_invalid_range(self):
+        """Test invalid or reversed ranges are rejected"""
+        for params in ({'start': '2021-13'},
+                       {'start': '2021-05', 'end': '2021-04'}):
+            res = self.client.get(LIST_PURCHASES_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
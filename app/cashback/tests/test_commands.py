@@ -0,0 +1,89 @@
+import datetime
+from io import StringIO
+from unittest.mock import patch
+
+from cashback import provider
+from core.models import Compra, Revendedor
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+TOKEN_URL = reverse('token_obtain_pair')
+
+
+def sample_revendedor(email, cpf, password=None):
+    user = get_user_model().objects.create_user(
+        email=email, password=password)
+    return Revendedor.objects.create(user=user, cpf=cpf, name=email)
+
+
+class WarmCashbackCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        today = datetime.date.today()
+        buyer = sample_revendedor('buyer@grupoboticario.com.br',
+                                  '945.086.080-78')
+        Compra.objects.create(
+            code=1, value=10.0, date=today, revendedor=buyer)
+        idle = sample_revendedor('idle@grupoboticario.com.br',
+                                 '865.550.330-45')
+        Compra.objects.create(
+            code=2, value=10.0, date=today - datetime.timedelta(days=90),
+            revendedor=idle)
+        sample_revendedor('visitor@grupoboticario.com.br',
+                          '077.282.440-19', password='pass1234')
+        res = APIClient().post(TOKEN_URL, {
+            'email': 'visitor@grupoboticario.com.br',
+            'password': 'pass1234',
+        })
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def warm(self, **options):
+        out = StringIO()
+        call_command('warm_cashback_cache', stdout=out, **options)
+        return out.getvalue()
+
+    @patch.object(provider, 'call_provider')
+    def test_warm_active_revendedores(self, call_provider):
+        """Test balances of buyers and recently issued tokens are cached"""
+        call_provider.side_effect = lambda cpf: {'credit': int(cpf[:3])}
+
+        out = self.warm()
+
+        self.assertEqual(
+            sorted(call.args[0] for call in call_provider.call_args_list),
+            ['07728244019', '94508608078'])
+        self.assertIn('2 balances refreshed', out)
+        call_provider.reset_mock()
+        self.assertEqual(
+            provider.fetch_balance('94508608078'), {'credit': 945})
+        self.assertFalse(call_provider.called)
+
+    @patch.object(provider, 'call_provider')
+    def test_warm_only_expiring_balances(self, call_provider):
+        """Test balances far from expiring are not fetched again"""
+        call_provider.return_value = {'credit': 1}
+        self.warm()
+        call_provider.reset_mock()
+
+        out = self.warm()
+        self.assertFalse(call_provider.called)
+        self.assertIn('2 fresh', out)
+
+        self.warm(ahead=10 ** 6)
+        self.assertEqual(call_provider.call_count, 2)
+
+    @patch.object(provider, 'call_provider')
+    def test_warm_reports_failures(self, call_provider):
+        """Test provider failures are counted and not cached"""
+        call_provider.side_effect = provider.ProviderError('down', 503)
+
+        out = self.warm()
+
+        self.assertIn('2 failed', out)
+        self.assertEqual(len(provider.expiring(['94508608078'], 0)), 1)
@@ -0,0 +1,72 @@
+from datetime import date
+
+from core.models import Compra, Revendedor
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+CASHBACK_URL = reverse('cashback:compra-list')
+
+
+class CompraFilterTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            email='filters@grupoboticario.com.br', password='pass1234')
+        revendedor = Revendedor.objects.create(
+            user=user, cpf='870.091.100-34', name='filters')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        purchases = (
+            (1, 10.0, date(2021, 1, 5), 1),
+            (2, 250.0, date(2021, 2, 5), 2),
+            (3, 99.9, date(2021, 3, 5), 2),
+            (4, 500.0, date(2021, 4, 5), 3),
+        )
+        for code, value, day, status_code in purchases:
+            Compra.objects.create(
+                code=code, value=value, date=day, status=status_code,
+                revendedor=revendedor)
+
+    def codes(self, params):
+        res = self.client.get(CASHBACK_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [purchase['code'] for purchase in res.data]
+
+    def test_filter_date_range_and_status(self):
+        """Test status combines with a date range, ordered by date"""
+        codes = self.codes({
+            'date_min': '2021-02-01', 'date_max': '2021-04-30',
+            'status': '2,3', 'ordering': '-date'})
+
+        self.assertEqual(codes, [4, 3, 2])
+
+    def test_filter_value_range(self):
+        """Test the value range is given in reais"""
+        codes = self.codes({
+            'value_min': '99.90', 'value_max': 250, 'ordering': 'value'})
+
+        self.assertEqual(codes, [3, 2])
+
+    def test_filter_code_range(self):
+        """Test filtering by a range of codes"""
+        self.assertEqual(self.codes({'code_min': 2, 'code_max': 3}), [2, 3])
+
+    def test_unindexed_combination_rejected(self):
+        """Test filters no single index covers are rejected"""
+        for params in ({'value_min': 10, 'ordering': 'date'},
+                       {'status': 2, 'code_min': 1},
+                       {'date_min': '2021-01-01', 'value_max': 100}):
+            res = self.client.get(CASHBACK_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_filter_values(self):
+        """Test invalid values and orderings are rejected"""
+        for params in ({'date_min': '2021-13-01'}, {'value_max': 'abc'},
+                       {'status': 9}, {'ordering': 'revendedor'}):
+            res = self.client.get(CASHBACK_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
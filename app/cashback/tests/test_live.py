@@ -0,0 +1,256 @@
+import asyncio
+import datetime
+import os
+import time
+from unittest.mock import Mock, patch
+
+from app.asgi import application
+from cashback import live
+from core.models import OutboxEvent, Revendedor
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+CASHBACK_URL = reverse('cashback:compra-list')
+
+
+def run_stream(scope, messages, timeout=1.0):
+    """
+    Runs the ASGI app on scope, publishing messages once subscribed
+
+    Returns the ASGI messages sent by the app.
+    """
+    sent = []
+
+    async def main():
+        disconnect = asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        task = asyncio.ensure_future(application(scope, receive, send))
+        for _ in range(100):
+            if live.broker.subscribers or task.done():
+                break
+            await asyncio.sleep(0.01)
+        for message in messages:
+            live.broker.publish(message)
+        await asyncio.sleep(0.05)
+        disconnect.set()
+        await asyncio.wait_for(task, timeout)
+
+    asyncio.run(main())
+    return sent
+
+
+def body(sent):
+    return b''.join(
+        message.get('body', b'') for message in sent
+        if message['type'] == 'http.response.body')
+
+
+class LiveEventsTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='live@grupoboticario.com.br', password='pass1234')
+        self.revendedor = Revendedor.objects.create(
+            user=self.user, cpf='870.091.100-34', name='live')
+        self.token = str(AccessToken.for_user(self.user))
+
+    def tearDown(self):
+        # The streams leave the LISTEN connection of their loop open
+        if live.broker.listener is not None:
+            live.broker.listener.close()
+            live.broker.listener = None
+
+    def scope(self, headers=(), query_string=b''):
+        return {
+            'type': 'http',
+            'method': 'GET',
+            'path': live.LIVE_PATH,
+            'headers': list(headers),
+            'query_string': query_string,
+        }
+
+    def test_authentication_required(self):
+        """Test the stream needs a valid access token"""
+        for scope in (self.scope(), self.scope(query_string=b'token=bad')):
+            sent = run_stream(scope, [])
+
+            self.assertEqual(sent[0]['status'], 401)
+
+    def test_authenticate_header_or_query(self):
+        """Test the token is read from the header or the query string"""
+        header = self.scope(
+            headers=[(b'authorization', b'Bearer ' + self.token.encode())])
+        query = self.scope(query_string=b'token=' + self.token.encode())
+
+        expected = (self.user.pk, AccessToken(self.token)['exp'])
+        self.assertEqual(live.authenticate(header), expected)
+        self.assertEqual(live.authenticate(query), expected)
+
+    def test_stream_closed_when_token_expires(self):
+        """Test a stream ends with its access token"""
+        token = AccessToken.for_user(self.user)
+        token.set_exp(lifetime=datetime.timedelta(seconds=1))
+        sent = []
+
+        async def receive():
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(asyncio.wait_for(application(
+            self.scope(query_string=b'token=' + str(token).encode()),
+            receive, send), 3))
+
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertTrue(body(sent).endswith(b': token expired\n\n'))
+        self.assertFalse(sent[-1].get('more_body'))
+        self.assertFalse(live.broker.subscribers)
+
+    def test_stream_events_of_revendedor(self):
+        """Test the stream only sends the events of its revendedor"""
+        payload = {'revendedor': self.revendedor.pk, 'code': 1}
+        messages = [
+            {'id': 1, 'topic': 'compra', 'event': 'created',
+             'payload': payload},
+            {'id': 2, 'topic': 'compra', 'event': 'created',
+             'payload': {'revendedor': 999, 'code': 2}},
+            {'id': 3, 'topic': 'compra', 'event': 'deleted',
+             'payload': payload},
+            {'id': 4, 'topic': 'cashback', 'event': 'tier_crossed',
+             'payload': {'revendedor': self.revendedor.pk}},
+        ]
+
+        sent = run_stream(
+            self.scope(query_string=b'token=' + self.token.encode()),
+            messages)
+
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn(
+            (b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertEqual(body(sent), (
+            b': connected\n\n'
+            b'id: 1\nevent: purchase_created\n'
+            b'data: {"revendedor": %d, "code": 1}\n\n'
+            b'id: 4\nevent: tier_crossed\n'
+            b'data: {"revendedor": %d}\n\n' % (
+                self.revendedor.pk, self.revendedor.pk)))
+        self.assertFalse(live.broker.subscribers)
+
+    @override_settings(LIVE_EVENTS_KEEPALIVE=0.01)
+    def test_stream_keepalive(self):
+        """Test idle streams send keepalive comments"""
+        sent = run_stream(
+            self.scope(query_string=b'token=' + self.token.encode()), [])
+
+        self.assertIn(b': keepalive\n\n', body(sent))
+
+    def test_tier_crossed_event(self):
+        """Test a purchase moving the month to another tier writes it"""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for code, value in ((1, 900.0), (2, 200.0), (3, 10.0)):
+            client.post(CASHBACK_URL, {
+                'code': code,
+                'value': value,
+                'date': datetime.date.today(),
+                'revendedor': self.revendedor.pk,
+            })
+
+        event = OutboxEvent.objects.get(event='tier_crossed')
+        self.assertEqual(event.payload, {
+            'revendedor': self.revendedor.pk,
+            'month': datetime.date.today().replace(day=1).isoformat(),
+            'month_total': 1100.0,
+            'cashback_percent': 15,
+            'previous_cashback_percent': 10,
+        })
+
+    def test_tier_crossed_on_update_and_delete(self):
+        """Test updates and deletes moving the month tier write it"""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        today = datetime.date.today()
+        for code, value in ((1, 900.0), (2, 50.0)):
+            res = client.post(CASHBACK_URL, {
+                'code': code,
+                'value': value,
+                'date': today,
+                'revendedor': self.revendedor.pk,
+            })
+        url = reverse('cashback:compra-detail', args=[res.data['id']])
+
+        client.patch(url, {'value': 150.0, 'revendedor': self.revendedor.pk})
+        client.patch(url, {'value': 160.0, 'revendedor': self.revendedor.pk})
+        client.delete(url)
+
+        events = OutboxEvent.objects.filter(
+            event='tier_crossed').order_by('id')
+        self.assertEqual([
+            (event.payload['month_total'],
+             event.payload['previous_cashback_percent'],
+             event.payload['cashback_percent'])
+            for event in events
+        ], [(1050.0, 10, 15), (900.0, 15, 10)])
+
+    def test_broker_connects_once(self):
+        """Test streams subscribing together share one LISTEN connection"""
+        read, write = os.pipe()
+        self.addCleanup(os.close, read)
+        self.addCleanup(os.close, write)
+        listener = Mock()
+        listener.fileno.return_value = read
+        connections = []
+
+        def connect():
+            time.sleep(0.05)
+            connections.append(listener)
+            return listener
+
+        broker = live.Broker()
+
+        async def main():
+            await asyncio.gather(broker.subscribe(1), broker.subscribe(2))
+            broker.stop()
+
+        with patch.object(broker, 'connect', connect), \
+                patch('cashback.live.connection', Mock(vendor='postgresql')):
+            asyncio.run(main())
+
+        self.assertEqual(len(connections), 1)
+
+    def test_cancelled_stream_leaves_no_task(self):
+        """Test a stream cancelled while waiting cancels its tasks"""
+        scope = self.scope(query_string=b'token=' + self.token.encode())
+
+        async def main():
+            async def receive():
+                await asyncio.Event().wait()
+
+            async def send(message):
+                pass
+
+            task = asyncio.ensure_future(application(scope, receive, send))
+            for _ in range(100):
+                if live.broker.subscribers:
+                    break
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await asyncio.sleep(0)
+            return [
+                other for other in asyncio.all_tasks()
+                if other is not asyncio.current_task()]
+
+        self.assertEqual(asyncio.run(main()), [])
+        self.assertFalse(live.broker.subscribers)
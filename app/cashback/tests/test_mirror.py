@@ -0,0 +1,164 @@
+import datetime
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import MagicMock, patch
+
+from cashback import mirror
+from core.models import ExternalCashbackBalance
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+EXTERNAL_URL = reverse('cashback:compra-accumulated-cashback')
+BATCH_URL = reverse('cashback:compra-accumulated-cashback-batch')
+
+
+def provider_response(credit):
+    res = MagicMock(status_code=200)
+    res.json.return_value = {'body': {'credit': credit}}
+    return res
+
+
+class SyncTests(TestCase):
+
+    def sync_file(self, content, suffix):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        out = StringIO()
+        call_command('sync_cashback_balances', file=path, stdout=out)
+        return out.getvalue()
+
+    def test_sync_csv_dump(self):
+        """Test a CSV dump is upserted with numeric balances"""
+        out = self.sync_file(
+            'cpf,credit\n945.086.080-78,2500\n86555033045,10.5\n'
+            'invalid,1\n', '.csv')
+
+        self.assertIn('2 balances synced', out)
+        self.assertIn('1 invalid balances skipped', out)
+        balances = dict(ExternalCashbackBalance.objects.values_list(
+            'cpf', 'body'))
+        self.assertEqual(balances, {
+            '94508608078': {'credit': 2500},
+            '86555033045': {'credit': 10.5},
+        })
+
+    def test_sync_skips_non_finite_values(self):
+        """Test NaN and infinite balances are counted as invalid"""
+        out = self.sync_file(
+            'cpf,credit\n945.086.080-78,nan\n86555033045,inf\n'
+            '07728244019,1_000\n', '.csv')
+        self.assertIn('1 balances synced', out)
+        self.assertIn('2 invalid balances skipped', out)
+
+        out = self.sync_file(
+            '{"cpf": "94508608078", "credit": NaN}\n'
+            '{"cpf": "86555033045", "credit": [-Infinity]}\n'
+            '{"cpf": "07728244019", "credit": 1}\n', '.ndjson')
+        self.assertIn('1 balances synced', out)
+        self.assertIn('2 invalid balances skipped', out)
+
+        balances = dict(ExternalCashbackBalance.objects.values_list(
+            'cpf', 'body'))
+        self.assertEqual(balances, {'07728244019': {'credit': 1}})
+
+    def test_sync_ndjson_updates_existing(self):
+        """Test a later dump updates the mirrored balances"""
+        self.sync_file('{"cpf": "94508608078", "credit": 1}\n', '.ndjson')
+        first = ExternalCashbackBalance.objects.get().synced_at
+
+        self.sync_file(
+            '{"cpf": "945.086.080-78", "credit": 2}\n\n'
+            '{"cpf": "86555033045", "credit": 3}\n', '.ndjson')
+
+        self.assertEqual(ExternalCashbackBalance.objects.count(), 2)
+        balance = ExternalCashbackBalance.objects.get(cpf='94508608078')
+        self.assertEqual(balance.body, {'credit': 2})
+        self.assertGreater(balance.synced_at, first)
+
+    def test_sync_in_chunks(self):
+        """Test balances are upserted chunk by chunk"""
+        balances = [('%011d' % i, {'credit': i}) for i in range(25)]
+
+        stats = mirror.sync(balances, chunk_size=10)
+
+        self.assertEqual(stats['synced'], 25)
+        self.assertEqual(ExternalCashbackBalance.objects.count(), 25)
+
+    @patch('requests.Session.get')
+    def test_sync_paginated_api(self, get):
+        """Test every page of the balances API is synced"""
+        first, last = MagicMock(), MagicMock()
+        first.json.return_value = {
+            'balances': [{'cpf': '94508608078', 'credit': 1}],
+            'next': 'http://provider/balances?page=2',
+        }
+        last.json.return_value = {
+            'balances': [{'cpf': '86555033045', 'credit': 2}],
+            'next': None,
+        }
+        get.side_effect = [first, last]
+
+        call_command(
+            'sync_cashback_balances', url='http://provider/balances',
+            stdout=StringIO())
+
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(ExternalCashbackBalance.objects.count(), 2)
+
+
+@override_settings(CASHBACK_BALANCE_SOURCE='mirror')
+class MirrorApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = get_user_model().objects.create_superuser(
+            email='admin@grupoboticario.com.br', password='pass1234')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        mirror.sync([('94508608078', {'credit': 2500})])
+
+    @patch('requests.Session.get')
+    def test_accumulated_cashback_from_mirror(self, get):
+        """Test a fresh mirrored balance is answered without the provider"""
+        with self.assertNumQueries(1):
+            res = self.client.get(EXTERNAL_URL, {'cpf': '945.086.080-78'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'credit': 2500})
+        get.assert_not_called()
+
+    @patch('requests.Session.get')
+    def test_stale_balance_asks_provider(self, get):
+        """Test balances older than the max age are asked to the provider"""
+        ExternalCashbackBalance.objects.update(
+            synced_at=timezone.now() - datetime.timedelta(days=2))
+        get.return_value = provider_response(100)
+
+        res = self.client.get(EXTERNAL_URL, {'cpf': '945.086.080-78'})
+
+        self.assertEqual(res.data, {'credit': 100})
+        get.assert_called_once()
+
+    @patch('requests.Session.get')
+    def test_batch_asks_provider_for_missing(self, get):
+        """Test the batch only asks the provider the unmirrored CPFs"""
+        get.return_value = provider_response(100)
+
+        res = self.client.post(BATCH_URL, {
+            'cpfs': ['945.086.080-78', '865.550.330-45'],
+        }, format='json')
+
+        self.assertEqual(res.data['results'], {
+            '94508608078': {'credit': 2500},
+            '86555033045': {'credit': 100},
+        })
+        self.assertEqual(get.call_args[1]['params'], {'cpf': '86555033045'})
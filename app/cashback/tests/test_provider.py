@@ -0,0 +1,224 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import requests
+from cashback import provider
+from core import throttling
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+EXTERNAL_URL = reverse('cashback:compra-accumulated-cashback')
+BATCH_URL = reverse('cashback:compra-accumulated-cashback-batch')
+CPFS = ['945.086.080-78', '865.550.330-45', '077.282.440-19']
+
+
+def provider_response(status_code=200, credit=100):
+    res = MagicMock(status_code=status_code)
+    res.json.return_value = {'body': {'credit': credit}}
+    return res
+
+
+class ProviderApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = get_user_model().objects.create_superuser(
+            email='admin@grupoboticario.com.br', password='pass1234')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    @patch('requests.Session.get')
+    def test_accumulated_cashback(self, get):
+        """Test the balance of a CPF is read from the provider"""
+        get.return_value = provider_response(credit=2500)
+
+        res = self.client.get(EXTERNAL_URL, {'cpf': CPFS[0]})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'credit': 2500})
+        self.assertEqual(get.call_args[1]['params'], {'cpf': '94508608078'})
+
+    @patch('requests.Session.get')
+    def test_batch_partial_failures(self, get):
+        """Test the batch reports failed and invalid CPFs separately"""
+        def answer(url, params, timeout):
+            if params['cpf'] == '86555033045':
+                return provider_response(status_code=404)
+            if params['cpf'] == '07728244019':
+                raise requests.ConnectionError('refused')
+            return provider_response()
+        get.side_effect = answer
+
+        res = self.client.post(BATCH_URL, {
+            'cpfs': CPFS + ['94508608078', '111.111.111-11'],
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], {'94508608078': {'credit': 100}})
+        errors = res.data['errors']
+        self.assertEqual(errors['86555033045']['status'], 404)
+        self.assertIsNone(errors['07728244019']['status'])
+        self.assertEqual(errors['111.111.111-11'], {'detail': 'Invalid CPF.'})
+        self.assertEqual(get.call_count, 3)
+
+    @patch('requests.Session.get')
+    def test_batch_invalid_answer(self, get):
+        """Test a provider answer that is not JSON fails only its CPF"""
+        def answer(url, params, timeout):
+            if params['cpf'] == '86555033045':
+                res = provider_response()
+                res.json.side_effect = ValueError('Expecting value')
+                return res
+            if params['cpf'] == '07728244019':
+                res = provider_response()
+                res.json.return_value = ['unexpected']
+                return res
+            return provider_response()
+        get.side_effect = answer
+
+        res = self.client.post(BATCH_URL, {'cpfs': CPFS}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], {'94508608078': {'credit': 100}})
+        errors = res.data['errors']
+        self.assertEqual(
+            errors['86555033045'],
+            {'detail': 'Invalid provider answer', 'status': 200})
+        self.assertEqual(errors['07728244019']['status'], 200)
+
+    @patch('requests.Session.get')
+    def test_batch_calls_provider_concurrently(self, get):
+        """Test the batch takes about as long as the slowest call"""
+        threads = set()
+
+        def answer(url, params, timeout):
+            threads.add(threading.current_thread().name)
+            time.sleep(0.2)
+            return provider_response()
+        get.side_effect = answer
+
+        start = time.perf_counter()
+        res = self.client.post(BATCH_URL, {'cpfs': CPFS}, format='json')
+
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual(len(res.data['results']), 3)
+        self.assertEqual(len(threads), 3)
+
+    def test_batch_validation(self):
+        """Test the batch needs a bounded list of CPFs"""
+        for cpfs in (None, [], '945.086.080-78', CPFS * 200):
+            res = self.client.post(BATCH_URL, {'cpfs': cpfs}, format='json')
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_admin_only(self):
+        """Test resellers can not call the batch endpoint"""
+        user = get_user_model().objects.create_user(
+            email='user@grupoboticario.com.br', password='pass1234')
+        self.client.force_authenticate(user)
+
+        res = self.client.post(BATCH_URL, {'cpfs': CPFS}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_normalize_cpf(self):
+        """Test CPFs are reduced to their digits"""
+        self.assertEqual(provider.normalize_cpf('945.086.080-78'),
+                         '94508608078')
+
+    @patch('requests.Session.get')
+    def test_concurrent_lookups_coalesced(self, get):
+        """Test concurrent lookups of a CPF share one provider call"""
+        def answer(url, params, timeout):
+            time.sleep(0.2)
+            return provider_response(credit=7)
+        get.side_effect = answer
+        results = []
+
+        def lookup():
+            results.append(provider.fetch_balance('94508608078'))
+        threads = [threading.Thread(target=lookup) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [{'credit': 7}] * 10)
+        self.assertEqual(get.call_count, 1)
+
+    @patch('requests.Session.get')
+    def test_lookup_waits_for_other_worker(self, get):
+        """Test a lookup uses the answer of the worker holding the lock"""
+        cache.add('cashback:balance:94508608078:lock', True)
+
+        def other_worker():
+            time.sleep(0.1)
+            provider.store_balance('94508608078', {'credit': 9})
+            cache.delete('cashback:balance:94508608078:lock')
+        threading.Thread(target=other_worker).start()
+
+        self.assertEqual(
+            provider.fetch_balance('94508608078'), {'credit': 9})
+        self.assertFalse(get.called)
+
+    @patch('requests.Session.get')
+    def test_lock_of_other_worker_kept(self, get):
+        """Test a slow worker does not release a lock taken after it"""
+        lock = 'cashback:balance:94508608078:lock'
+
+        def answer(url, params, timeout):
+            # The lock expired and another worker took it
+            cache.set(lock, 'other')
+            return provider_response()
+        get.side_effect = answer
+
+        provider.fetch_balance('94508608078')
+
+        self.assertEqual(cache.get(lock), 'other')
+
+    @patch('requests.Session.get')
+    def test_failed_lookup_not_shared(self, get):
+        """Test a failed provider call is not kept for the next lookup"""
+        get.side_effect = [
+            provider_response(status_code=503), provider_response()]
+
+        with self.assertRaises(provider.ProviderError):
+            provider.fetch_balance('94508608078')
+        self.assertEqual(
+            provider.fetch_balance('94508608078'), {'credit': 100})
+
+    @override_settings(CASHBACK_PROVIDER_RATE='1/m')
+    @patch.object(throttling.time, 'time', return_value=0)
+    @patch('requests.Session.get')
+    def test_provider_rate_limit(self, get, now):
+        """Test calls over the provider rate fail instead of waiting long"""
+        get.return_value = provider_response()
+        provider.call_provider('94508608078')
+
+        with self.assertRaises(provider.ProviderError) as raised:
+            provider.call_provider('86555033045')
+
+        self.assertEqual(raised.exception.status, 429)
+        self.assertEqual(get.call_count, 1)
+
+    @override_settings(CASHBACK_PROVIDER_RATE='20/s')
+    @patch('time.sleep')
+    @patch('requests.Session.get')
+    def test_provider_rate_waits_turn(self, get, sleep):
+        """Test a call over the provider rate waits for its turn"""
+        get.return_value = provider_response()
+        now = time.time()
+        # The current and next windows are full until the wait is over
+        for second in (now, now + 1):
+            cache.set(throttling.window_key('provider', 1, second), 20)
+        sleep.side_effect = lambda seconds: cache.clear()
+
+        provider.call_provider('94508608078')
+
+        self.assertTrue(sleep.called)
+        self.assertEqual(get.call_count, 1)
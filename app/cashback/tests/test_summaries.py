@@ -0,0 +1,95 @@
+import datetime
+
+from cashback import summaries
+from core.archive import archive_month
+from core.models import Compra, Revendedor
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+SUMMARY_URL = reverse('cashback:compra-summary')
+CASHBACK_URL = reverse('cashback:compra-list')
+
+
+class SummaryTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = get_user_model().objects.create_user(
+            email='summary@grupoboticario.com.br', password='pass1234')
+        self.revendedor = Revendedor.objects.create(
+            user=user, cpf='870.091.100-34', name='summary')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.months = summaries.summary_months()
+        purchases = (
+            (1, 900.0, self.months[-1], 1),
+            (2, 600.0, self.months[-1], 2),
+            (3, 50.0, self.months[0], 3),
+            (4, 70.0, self.months[0] - datetime.timedelta(days=1), 2),
+        )
+        for code, value, date, status_code in purchases:
+            Compra.objects.create(
+                code=code, value=value, date=date, status=status_code,
+                revendedor=self.revendedor)
+
+    def test_summary_months(self):
+        """Test the summary covers the last 12 months, oldest first"""
+        months = summaries.summary_months(datetime.date(2021, 3, 15))
+
+        self.assertEqual(len(months), 12)
+        self.assertEqual(months[0], datetime.date(2020, 4, 1))
+        self.assertEqual(months[-1], datetime.date(2021, 3, 1))
+
+    def test_summary(self):
+        """Test the aggregates of every month come from one query"""
+        with self.assertNumQueries(1):
+            res = self.client.get(SUMMARY_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 12)
+        self.assertEqual(res.data[-1], {
+            'month': self.months[-1].strftime('%Y-%m'),
+            'purchase_count': 2,
+            'total': 1500.0,
+            'cashback_percent': 15,
+            'cashback_value': 225.0,
+            'em_validacao_count': 1,
+            'aprovado_count': 1,
+            'nao_aprovado_count': 0,
+        })
+        self.assertEqual(res.data[0]['nao_aprovado_count'], 1)
+        self.assertEqual(res.data[1]['purchase_count'], 0)
+        self.assertEqual(res.data[1]['cashback_percent'], 10)
+
+    def test_summary_cached(self):
+        """Test the summary is cached until a purchase changes"""
+        self.client.get(SUMMARY_URL)
+
+        with self.assertNumQueries(0):
+            self.client.get(SUMMARY_URL)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(CASHBACK_URL, {
+                'code': 5,
+                'value': 10.0,
+                'date': self.months[-1],
+                'revendedor': self.revendedor.pk,
+            })
+        res = self.client.get(SUMMARY_URL)
+
+        self.assertEqual(res.data[-1]['purchase_count'], 3)
+
+    def test_summary_reads_rollups(self):
+        """Test archived months are read from their monthly summaries"""
+        with self.settings(COMPRA_ARCHIVE_RETENTION_MONTHS=6):
+            archive_month(self.months[0])
+
+            res = self.client.get(SUMMARY_URL)
+
+        self.assertEqual(res.data[0]['purchase_count'], 1)
+        self.assertEqual(res.data[0]['total'], 50.0)
+        self.assertEqual(res.data[0]['nao_aprovado_count'], 1)
@@ -1,12 +1,46 @@
-import requests
-from cashback.serializers import CompraSerializer
-from core.models import Compra, Revendedor
+from datetime import date, datetime
+
+from cashback import mirror, provider, summaries
+from cashback.filters import CompraFilterBackend
+from cashback.provider import ProviderError
+from cashback.serializers import (CompraMonthsSerializer,
+                                  CompraReadSerializer, CompraSerializer,
+                                  lock_month_totals, record_tier_changes)
+from core import outbox, rankings
+from core.archive import archive_cutoff
+from core.models import Compra, CompraArchive, Revendedor
+from django.conf import settings
+from django.db import transaction
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 from rest_framework_simplejwt import authentication
+from user.validators import is_valid_cpf
+
+
+def parse_month(value):
+    """Returns the first day of a YYYY-MM month"""
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+def ranking_data(ranking):
+    """Returns the leaderboard entry of a MonthlyRanking"""
+    return {
+        'rank': ranking.rank,
+        'revendedor': ranking.revendedor_id,
+        'name': ranking.revendedor.name,
+        'total': ranking.total_cents / 100,
+        'purchase_count': ranking.purchase_count,
+    }
+
 
-EXT_URL = 'https://mdaqk8ek5j.execute-api.us-east-1.amazonaws.com/v1/cashback'
+class MonthRangePagination(PageNumberPagination):
+    """Pages of the purchases listed by start and end months"""
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
 
 
 class CompraViewSet(viewsets.ModelViewSet):
@@ -15,6 +49,8 @@ class CompraViewSet(viewsets.ModelViewSet):
     serializer_class = CompraSerializer
     authentication_classes = (authentication.JWTAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
+    filter_backends = (CompraFilterBackend,)
+    read_actions = ('list', 'retrieve', 'list_purchases')
 
     def get_revendedor(self):
         """Return Revendedor object based on logged user"""
@@ -28,18 +64,217 @@ class CompraViewSet(viewsets.ModelViewSet):
             revendedor=self.get_revendedor()
         )
 
-    @action(methods=['GET'], detail=False, url_path='list-purchases')
+    def get_fields(self):
+        """
+        Return the fields selected with ?fields= and ?omit=
+
+        Both take a comma separated list of CompraSerializer fields.
+        Returns None when every field must be serialized.
+        """
+        fields = self.request.query_params.get('fields')
+        omit = self.request.query_params.get('omit')
+        if not fields and not omit:
+            return None
+        available = CompraSerializer.Meta.fields
+        selected = set(available)
+        omitted = set()
+        if fields:
+            selected = {f.strip() for f in fields.split(',') if f.strip()}
+        if omit:
+            omitted = {f.strip() for f in omit.split(',') if f.strip()}
+        unknown = (selected | omitted) - set(available)
+        if unknown:
+            raise ValidationError({
+                'fields': 'Unknown fields: %s' % ', '.join(sorted(unknown))
+            })
+        return tuple(
+            f for f in available if f in selected and f not in omitted)
+
+    def get_serializer(self, *args, **kwargs):
+        """Return the serializer limited to the requested fields"""
+        if self.action in self.read_actions:
+            kwargs.setdefault('fields', self.get_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_serializer_context(self):
+        """Adds the optional Idempotency-Key header of create requests"""
+        context = super().get_serializer_context()
+        context['idempotency_key'] = self.request.headers.get(
+            'Idempotency-Key') or None
+        return context
+
+    def create(self, request, *args, **kwargs):
+        """
+        Create a purchase
+
+        Retrying a create returns the purchase already created with
+        200 OK instead of a duplicated code error.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(
+            serializer.data,
+            status=(
+                status.HTTP_201_CREATED if serializer.created
+                else status.HTTP_200_OK),
+            headers=headers)
+
+    def perform_create(self, serializer):
+        serializer.save()
+        summaries.invalidate(serializer.instance.revendedor_id)
+
+    def perform_update(self, serializer):
+        """Saves the purchase and its outbox events together"""
+        instance = serializer.instance
+        with transaction.atomic():
+            lock_month_totals(instance.revendedor_id)
+            removed = (instance.date, -instance.value_cents)
+            serializer.save()
+            outbox.record('updated', [outbox.purchase_payload(instance)])
+            record_tier_changes(instance.revendedor_id, [
+                removed, (instance.date, instance.value_cents)])
+            summaries.invalidate(instance.revendedor_id)
+
+    def perform_destroy(self, instance):
+        """Deletes the purchase and writes its outbox events together"""
+        with transaction.atomic():
+            lock_month_totals(instance.revendedor_id)
+            outbox.record('deleted', [outbox.purchase_payload(instance)])
+            instance.delete()
+            record_tier_changes(instance.revendedor_id, [
+                (instance.date, -instance.value_cents)])
+            summaries.invalidate(instance.revendedor_id)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = CompraReadSerializer(queryset, fields=self.get_fields())
+        return Response(serializer.data)
+
+    @action(
+        methods=['GET'], detail=False, url_path='list-purchases',
+        pagination_class=MonthRangePagination)
     def list_purchases(self, request):
+        """
+        Purchases of a month, given by year and month (default current)
+
+        With start and end months (YYYY-MM, end defaults to the current
+        month) the purchases of the range are listed by month, in pages.
+        """
+        if self.request.query_params.get('start'):
+            return self.list_months(
+                self.request.query_params.get('start'),
+                self.request.query_params.get('end'))
+
         year = self.request.query_params.get('year')
         month = self.request.query_params.get('month')
-        queryset = self.get_queryset()
-        if year and month:
-            queryset = queryset.filter(date__year=year, date__month=month)
-        else:
-            queryset = queryset.filter(date__year=2021, date__month=8)
+        today = date.today()
+        try:
+            if year and month:
+                year, month = int(year), int(month)
+            else:
+                year, month = today.year, today.month
+            queryset = self.get_queryset().in_month(year, month)
+        except ValueError:
+            return Response(
+                data='You must inform a valid year and month!',
+                status=status.HTTP_400_BAD_REQUEST)
+
+        data = CompraReadSerializer(queryset, fields=self.get_fields()).data
+        if not data and (year, month) < (today.year, today.month):
+            # Closed months may have been moved to the archive, the
+            # Revendedor primary key is its user
+            archived = CompraArchive.objects.filter(
+                revendedor=self.request.user.pk
+            ).in_month(year, month)
+            data = CompraReadSerializer(
+                archived, fields=self.get_fields()).data
+        return Response(data=data, status=status.HTTP_200_OK)
+
+    def list_months(self, start, end):
+        """
+        Pages of the purchases from the start to the end month
+
+        Purchases and the totals of their months come from one query
+        (plus the page count); archived months are read from the
+        archive in the same query.
+        """
+        try:
+            first = parse_month(start)
+            last = parse_month(end) if end else date.today().replace(day=1)
+        except ValueError:
+            return Response(
+                data='You must inform valid start and end months (YYYY-MM)!',
+                status=status.HTTP_400_BAD_REQUEST)
+        if first > last:
+            return Response(
+                data='The start month must not be after the end month!',
+                status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.get_queryset().in_months(first, last)
+        serializer = CompraMonthsSerializer(
+            queryset, fields=self.get_fields())
+        rows = serializer.rows(queryset)
+        if first < archive_cutoff():
+            # Months are archived whole, so each month is in one table
+            rows = rows.union(serializer.rows(
+                CompraArchive.objects.filter(
+                    revendedor=self.request.user.pk
+                ).in_months(first, last)), all=True)
+        page = self.paginate_queryset(rows.order_by('date', 'id'))
+        return self.get_paginated_response(serializer.group(page))
+
+    @action(
+        methods=['GET'], detail=False,
+        permission_classes=(permissions.IsAdminUser,))
+    def leaderboard(self, request):
+        """
+        Top revendedores by purchases total in a month, for marketing
+
+        Reads the rankings of the refresh_rankings command: ?month=
+        (YYYY-MM, the current one by default), ?size= of the top and
+        ?revendedor= to also get the rank of a revendedor.
+        """
+        month = self.request.query_params.get('month')
+        size = self.request.query_params.get('size', 10)
+        revendedor = self.request.query_params.get('revendedor')
+        try:
+            month = parse_month(month) if month else date.today().replace(
+                day=1)
+            size = int(size)
+            revendedor = int(revendedor) if revendedor else None
+        except ValueError:
+            return Response(
+                data='You must inform a valid month, size and revendedor!',
+                status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < size <= settings.LEADERBOARD_MAX_SIZE:
+            return Response(
+                data='The size must be between 1 and %d!' % (
+                    settings.LEADERBOARD_MAX_SIZE),
+                status=status.HTTP_400_BAD_REQUEST)
+
+        top = rankings.top(month, size)
+        data = {
+            'month': month.strftime('%Y-%m'),
+            'refreshed_at': top[0].refreshed_at if top else None,
+            'top': [ranking_data(ranking) for ranking in top],
+        }
+        if revendedor is not None:
+            ranking = rankings.rank_of(month, revendedor)
+            data['revendedor'] = ranking and ranking_data(ranking)
+        return Response(data=data, status=status.HTTP_200_OK)
 
-        serializer = CompraSerializer(queryset, many=True)
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+    @action(methods=['GET'], detail=False)
+    def summary(self, request):
+        """
+        Purchase count, total, tier, cashback and status breakdown of
+        each of the last 12 months, oldest first
+        """
+        # The Revendedor primary key is its user
+        return Response(
+            data=summaries.get_summary(self.request.user.pk),
+            status=status.HTTP_200_OK)
 
     @action(methods=['GET'], detail=False, url_path='accumulated-cashback')
     def accumulated_cashback(self, request):
@@ -48,18 +283,49 @@ class CompraViewSet(viewsets.ModelViewSet):
             return Response(
                 data='You must inform the CPF!',
                 status=status.HTTP_400_BAD_REQUEST)
-        cpf = ''.join(c for c in cpf if c.isdigit())
-        payload = {'cpf': cpf}
-        headers = {'token': 'ZXPURQOARHiMc6Y0flhRC1LVlZQVFRnm'}
         try:
-            res = requests.get(
-                EXT_URL,
-                params=payload,
-                headers=headers)
-            if res.status_code == status.HTTP_200_OK:
-                return Response(
-                    data=res.json().get('body'),
-                    status=status.HTTP_200_OK)
-            return Response(status=res.status_code)
-        except Exception:
+            return Response(
+                data=mirror.fetch_balance(provider.normalize_cpf(cpf)),
+                status=status.HTTP_200_OK)
+        except ProviderError as error:
+            if error.status is not None:
+                return Response(status=error.status)
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(
+        methods=['POST'], detail=False,
+        url_path='accumulated-cashback/batch',
+        permission_classes=(permissions.IsAdminUser,))
+    def accumulated_cashback_batch(self, request):
+        """
+        Accumulated cashback of a list of CPFs, for the back office
+
+        The CPFs are normalized and deduplicated, and the provider is
+        called concurrently for those missing from the mirror. Failed
+        CPFs are reported in `errors` without failing the others.
+        """
+        cpfs = request.data.get('cpfs')
+        if not isinstance(cpfs, list) or not cpfs:
+            return Response(
+                data='You must inform a list of CPFs!',
+                status=status.HTTP_400_BAD_REQUEST)
+        if len(cpfs) > settings.CASHBACK_BATCH_MAX_CPFS:
+            return Response(
+                data='You can inform at most %d CPFs!' % (
+                    settings.CASHBACK_BATCH_MAX_CPFS),
+                status=status.HTTP_400_BAD_REQUEST)
+
+        valid, errors = [], {}
+        for cpf in cpfs:
+            normalized = provider.normalize_cpf(cpf)
+            if not is_valid_cpf(normalized):
+                errors[str(cpf)] = {'detail': 'Invalid CPF.'}
+            elif normalized not in valid:
+                valid.append(normalized)
+
+        results, failed = mirror.fetch_balances(valid)
+        for cpf, error in failed.items():
+            errors[cpf] = {'detail': error.detail, 'status': error.status}
+        return Response(
+            data={'results': results, 'errors': errors},
+            status=status.HTTP_200_OK)
@@ -1,6 +1,23 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_migrate
+
+
+def create_compra_partitions(sender, **kwargs):
+    """Creates the next months partitions when partitioning is enabled"""
+    from core import partitioning
+
+    if partitioning.is_supported() and partitioning.is_partitioned():
+        partitioning.ensure_future_partitions(
+            settings.COMPRA_PARTITIONS_AHEAD)
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from core import checks  # noqa: F401
+
+        if settings.COMPRA_PARTITIONING:
+            post_migrate.connect(create_compra_partitions, sender=self)
@@ -0,0 +1,74 @@
+"""
+Archival of closed months
+
+Purchases of months older than COMPRA_ARCHIVE_RETENTION_MONTHS are moved
+from Compra to CompraArchive, and a MonthlySummary is stored for every
+revendedor of the month, so the hot table and its indexes stay small.
+"""
+import datetime
+
+from core.models import (ArchivedMonth, Compra, CompraArchive, MonthlySummary,
+                         next_month)
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.functions import TruncMonth
+
+ARCHIVE_SQL = '''
+INSERT INTO {archive} (id, code, value_cents, date, revendedor_id, status)
+SELECT id, code, value_cents, date, revendedor_id, status FROM {compra}
+WHERE date >= %s AND date < %s
+'''
+
+
+def archive_cutoff(retention=None, today=None):
+    """Returns the first month kept in Compra, older ones are archived"""
+    if retention is None:
+        retention = settings.COMPRA_ARCHIVE_RETENTION_MONTHS
+    today = today or datetime.date.today()
+    months = today.year * 12 + today.month - 1 - retention
+    return datetime.date(months // 12, months % 12 + 1, 1)
+
+
+def months_to_archive(retention=None):
+    """Returns the months older than the retention with purchases in Compra"""
+    return list(Compra.objects.filter(
+        date__lt=archive_cutoff(retention)
+    ).annotate(
+        month=TruncMonth('date')
+    ).order_by('month').values_list('month', flat=True).distinct())
+
+
+def refresh_summaries(month, revendedores=None):
+    """Recomputes the MonthlySummary rows of an archived month"""
+    archived = CompraArchive.objects.in_month(month.year, month.month)
+    summaries = MonthlySummary.objects.filter(month=month)
+    if revendedores is not None:
+        archived = archived.filter(revendedor__in=revendedores)
+        summaries = summaries.filter(revendedor__in=revendedores)
+    summaries.delete()
+    MonthlySummary.objects.bulk_create([
+        MonthlySummary(revendedor_id=row.pop('revendedor'), **row)
+        for row in archived.monthly_summaries()
+    ])
+
+
+def archive_month(month):
+    """
+    Moves the purchases of a month to the archive
+
+    Runs in a single transaction: the rows are copied with one
+    INSERT ... SELECT, summarized, then deleted from Compra.
+    Returns the number of purchases archived.
+    """
+    first = month.replace(day=1)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(ARCHIVE_SQL.format(
+                archive=CompraArchive._meta.db_table,
+                compra=Compra._meta.db_table
+            ), [first, next_month(first)])
+            archived = cursor.rowcount
+        refresh_summaries(first)
+        Compra.objects.in_month(first.year, first.month).delete()
+        ArchivedMonth.objects.update_or_create(month=first)
+    return archived
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core import checks
+
+PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Warns when the rate limits are kept in a per process cache"""
+    limited = settings.THROTTLE_ENABLED or settings.CASHBACK_PROVIDER_RATE
+    if limited and settings.CACHES['default']['BACKEND'] in PROCESS_CACHES:
+        return [checks.Warning(
+            'The rate limits are kept in a per process cache.',
+            hint='Set CACHE_BACKEND and CACHE_LOCATION to a cache shared '
+                 'by the workers, such as memcached, so THROTTLE_RATES '
+                 'and CASHBACK_PROVIDER_RATE apply across them.',
+            id='core.W001')]
+    return []
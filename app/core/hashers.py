@@ -0,0 +1,81 @@
+"""
+Password hashing off the request threads
+
+Hashing is CPU bound and dominates signup and login. The tuned hashers
+read their cost from the settings, and make_password / check_password run
+them in a bounded thread pool: hashlib and argon2 release the GIL, so at
+most PASSWORD_HASHING_WORKERS cores hash at once and the other endpoints
+keep the rest.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.auth.hashers import (Argon2PasswordHasher,
+                                         PBKDF2PasswordHasher)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2 hasher with the iterations of PASSWORD_PBKDF2_ITERATIONS"""
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2 hasher with the costs of the PASSWORD_ARGON2_* settings"""
+
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM
+
+
+def workers():
+    """Returns the size of the password hashing pool"""
+    return settings.PASSWORD_HASHING_WORKERS or os.cpu_count() or 1
+
+
+def get_executor():
+    """Returns the password hashing pool, starting it on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=workers(),
+                thread_name_prefix='password-hashing')
+    return _executor
+
+
+def make_password(password):
+    """Hashes password with the preferred hasher in the hashing pool"""
+    return get_executor().submit(hashers.make_password, password).result()
+
+
+def check_password(password, encoded, setter=None):
+    """
+    Checks password against encoded in the hashing pool
+
+    Like django.contrib.auth.hashers.check_password, setter is called
+    with the password when it is correct but hashed with an outdated
+    hasher or cost. It runs on the calling thread, as it hashes again.
+    """
+    outdated = []
+    is_correct = get_executor().submit(
+        hashers.check_password, password, encoded, outdated.append).result()
+    if outdated and setter:
+        setter(password)
+    return is_correct
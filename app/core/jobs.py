@@ -0,0 +1,125 @@
+"""
+Lightweight job queue backed by the database
+
+Work that does not need to happen in the request is stored as a Job row
+and run by the run_workers command. Workers claim jobs with
+SELECT ... FOR UPDATE SKIP LOCKED, so any number of them can poll the
+table without blocking each other. The claim is a short transaction
+marking the job RUNNING for JOB_LEASE seconds, and the task runs outside
+of it: a task waiting on a remote service holds no transaction open. A
+worker dying mid-job leaves it to be claimed again once its lease
+expires. Failed jobs are retried with exponential backoff and kept as
+FAILED after JOB_MAX_ATTEMPTS.
+
+Tasks are plain functions registered with @task in the `tasks` module
+of an app, and are called with the job payload as keyword arguments.
+"""
+import datetime
+import logging
+
+from core.models import Job
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+def task(name):
+    """Registers the decorated function as the task `name`"""
+    def decorator(func):
+        registry[name] = func
+        return func
+    return decorator
+
+
+def autodiscover():
+    """Imports the tasks module of every installed app"""
+    autodiscover_modules('tasks')
+
+
+def enqueue(name, payload=None, run_at=None):
+    """Queues a job, it is run once its transaction commits"""
+    return Job.objects.create(
+        name=name,
+        payload=payload or {},
+        run_at=run_at or timezone.now())
+
+
+def retry_delay(attempts):
+    """Returns how long to wait before the next attempt of a job"""
+    return datetime.timedelta(
+        seconds=settings.JOB_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def claim():
+    """
+    Marks the next due job RUNNING until its lease expires
+
+    Returns the job, or None when no job is due. Jobs whose lease
+    expired are due again.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True).filter(
+            status__in=[Job.Status.QUEUED, Job.Status.RUNNING],
+            run_at__lte=now
+        ).order_by('run_at').first()
+        if job is None:
+            return None
+        job.status = Job.Status.RUNNING
+        job.attempts += 1
+        job.run_at = now + datetime.timedelta(seconds=settings.JOB_LEASE)
+        job.save(update_fields=['status', 'attempts', 'run_at'])
+    return job
+
+
+def run_next():
+    """
+    Claims and runs the next due job
+
+    Returns the job, or None when no job is due. The job is deleted when
+    it succeeds and rescheduled, or marked FAILED, when it raises.
+    """
+    job = claim()
+    if job is None:
+        return None
+
+    # Once the lease expired another worker may have claimed the job,
+    # the attempts tell whose claim it is
+    claimed = Job.objects.filter(pk=job.pk, attempts=job.attempts)
+    try:
+        registry[job.name](**job.payload)
+    except Exception as error:
+        logger.exception('Job %s failed', job)
+        job.last_error = repr(error)
+        if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+            job.status = Job.Status.FAILED
+        else:
+            job.status = Job.Status.QUEUED
+            job.run_at = timezone.now() + retry_delay(job.attempts)
+        claimed.update(
+            last_error=job.last_error, status=job.status, run_at=job.run_at)
+    else:
+        claimed.delete()
+    return job
+
+
+def work(stop, poll_interval=1.0, burst=False):
+    """
+    Runs due jobs until `stop` (a threading.Event) is set
+
+    Waits `poll_interval` seconds when the queue is empty, or returns
+    when `burst` is set.
+    """
+    try:
+        while not stop.is_set():
+            if run_next() is None:
+                if burst:
+                    return
+                stop.wait(poll_interval)
+    finally:
+        connection.close()
@@ -0,0 +1,38 @@
+from core import archive
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    """
+    Django command to move closed months to the purchases archive
+
+    Every month older than the retention window is moved from Compra to
+    CompraArchive, one transaction per month.
+    """
+    help = 'Archives the purchases of months older than the retention'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention', type=int,
+            default=settings.COMPRA_ARCHIVE_RETENTION_MONTHS,
+            help='Number of months kept in the Compra table')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only list the months that would be archived')
+
+    def handle(self, *args, **options):
+        months = archive.months_to_archive(options['retention'])
+        if not months:
+            self.stdout.write('Nothing to archive')
+            return
+        for month in months:
+            label = month.strftime('%Y-%m')
+            if options['dry_run']:
+                self.stdout.write('Would archive %s' % label)
+                continue
+            count = archive.archive_month(month)
+            self.stdout.write('Archived %s (%d purchases)' % (label, count))
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                '%d months archived' % len(months)))
@@ -0,0 +1,327 @@
+import datetime
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from cashback.serializers import CompraReadSerializer, CompraSerializer
+from core import hashers, rankings
+from core.models import Compra, Revendedor
+from core.parsers import ORJSONParser
+from core.renderers import ORJSONRenderer, orjson
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Sum
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+# Measures a settings profile in a fresh process: the worker memory once
+# the first request is served, then the time of a request going through
+# every middleware (an unauthenticated list, answered 401 without query)
+PROFILE_SCRIPT = '''
+import json, sys, timeit
+import django
+from django.conf import settings
+django.setup()
+from django.test import Client
+from django.test.utils import setup_test_environment
+setup_test_environment()
+client = Client()
+client.get('/api/cashback/cashback/')
+# Current RSS (Linux): ru_maxrss would include the parent process peak
+with open('/proc/self/status') as status:
+    rss = int(status.read().split('VmRSS:')[1].split()[0]) * 1024
+size, repeat = int(sys.argv[1]), int(sys.argv[2])
+seconds = min(timeit.repeat(
+    lambda: client.get('/api/cashback/cashback/'), number=size,
+    repeat=repeat)) / size
+print(json.dumps({
+    'seconds': seconds, 'rss': rss, 'apps': len(settings.INSTALLED_APPS),
+    'middleware': len(settings.MIDDLEWARE)}))
+'''
+
+
+def best_of(repeat, func, *args):
+    """Runs func `repeat` times and returns the best time in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def sample_purchases(size):
+    """Returns `size` purchases shaped like the list_purchases response"""
+    day = datetime.date(2021, 8, 1)
+    purchases = []
+    for code in range(1, size + 1):
+        value = round(random.uniform(1, 500), 2)
+        purchases.append(OrderedDict((
+            ('id', code),
+            ('code', code),
+            ('value', value),
+            ('date', (day + datetime.timedelta(days=code % 31)).isoformat()),
+            ('revendedor', 1),
+            ('status', 1),
+            ('cashback_percent', 20),
+            ('cashback_value', round(value * 0.2, 2)),
+            ('status_str', 'Em validação'),
+        )))
+    return purchases
+
+
+def peak_memory(func):
+    """Runs func once and returns its peak traced memory in bytes"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@contextmanager
+def rolled_back():
+    """Runs the block in a transaction that is always rolled back"""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def sample_revendedor(label='benchmark'):
+    """Creates a revendedor to own the benchmark data"""
+    user = get_user_model().objects.create_user(
+        email='%s-%d@benchmark.local' % (label, random.getrandbits(32)))
+    return Revendedor.objects.create(
+        user=user,
+        cpf=str(random.randrange(10 ** 10, 10 ** 11)),
+        name=label)
+
+
+def create_purchases(revendedor, size, date=datetime.date(2021, 8, 1)):
+    """Bulk creates `size` purchases for revendedor in the month of date"""
+    first = (Compra.objects.aggregate(code=Max('code'))['code'] or 0) + 1
+    Compra.objects.bulk_create([
+        Compra(
+            code=code,
+            value=round(random.uniform(1, 500), 2),
+            date=date.replace(day=1 + code % 28),
+            revendedor=revendedor)
+        for code in range(first, first + size)
+    ], batch_size=1000)
+
+
+class Command(BaseCommand):
+    """
+    Django command to run the performance benchmarks
+
+    Usage: python manage.py benchmark <name> [--size N] [--repeat N]
+    """
+    help = 'Runs a performance benchmark and prints its timings'
+    benchmarks = (
+        'hashing', 'profiles', 'rankings', 'renderers', 'serializers')
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=self.benchmarks)
+        parser.add_argument('--size', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if options['size'] <= 0 or options['repeat'] <= 0:
+            raise CommandError('--size and --repeat must be greater than 0')
+        getattr(self, 'bench_%s' % options['name'])(
+            options['size'], options['repeat'])
+
+    def report(self, label, seconds, baseline=None, memory=None):
+        line = '%-28s %10.2f ms' % (label, seconds * 1000)
+        if memory is not None:
+            line += ' %10.2f MiB' % (memory / 2 ** 20)
+        if baseline:
+            line += '  (%.1fx)' % (baseline / seconds)
+        self.stdout.write(line)
+
+    def bench_hashing(self, size, repeat):
+        """
+        Logins per second of each password hasher
+
+        A login verifies one password; `size` logins go through the
+        hashing pool to measure its throughput.
+        """
+        candidates = [
+            ('PBKDF2 (Django default)', PBKDF2PasswordHasher()),
+            ('PBKDF2 (tuned)', hashers.TunedPBKDF2PasswordHasher()),
+            ('Argon2 (tuned)', hashers.TunedArgon2PasswordHasher()),
+        ]
+        password = 'benchmark-password'
+        self.stdout.write('Verifying a password (best of %d)' % repeat)
+        for label, hasher in candidates:
+            try:
+                encoded = hasher.encode(password, hasher.salt())
+            except ValueError as error:
+                self.stdout.write(self.style.WARNING(
+                    '%s skipped: %s' % (label, error)))
+                continue
+            seconds = best_of(repeat, hasher.verify, password, encoded)
+            self.report(label, seconds)
+            self.stdout.write('%-28s %10.1f logins/s per core' % (
+                '', 1 / seconds))
+
+        encoded = hashers.make_password(password)
+        self.stdout.write('%d logins through the hashing pool (%d workers)' % (
+            size, hashers.workers()))
+
+        def logins():
+            futures = [
+                hashers.get_executor().submit(
+                    check_password, password, encoded)
+                for _ in range(size)
+            ]
+            for future in futures:
+                future.result()
+
+        seconds = best_of(repeat, logins)
+        self.report('Hashing pool', seconds)
+        self.stdout.write('%-28s %10.1f logins/s, %.1f per worker' % (
+            '', size / seconds, size / seconds / hashers.workers()))
+
+    def bench_profiles(self, size, repeat):
+        """Per request overhead and worker memory of the API profiles"""
+        self.stdout.write(
+            'Unauthenticated request, %d per run (best of %d)' % (
+                size, repeat))
+        env = dict(os.environ, THROTTLE_ENABLED='0')
+        baseline = None
+        for profile in ('full', 'api'):
+            env['DJANGO_PROFILE'] = profile
+            out = subprocess.run(
+                [sys.executable, '-c', PROFILE_SCRIPT, str(size),
+                 str(repeat)],
+                env=env, cwd=settings.BASE_DIR, check=True,
+                stdout=subprocess.PIPE).stdout
+            result = json.loads(out.decode().splitlines()[-1])
+            self.report(
+                '%s (%d apps, %d middleware)' % (
+                    profile, result['apps'], result['middleware']),
+                result['seconds'], baseline, memory=result['rss'])
+            baseline = baseline or result['seconds']
+
+    def bench_rankings(self, size, repeat):
+        """
+        Leaderboard reads with `size` revendedores ranked in a month
+
+        Compares a GROUP BY per request with the reads of the rankings
+        kept by refresh_rankings.
+        """
+        month = datetime.date(2021, 8, 1)
+        with rolled_back():
+            self.stdout.write(
+                'Creating %d revendedores with 3 purchases each' % size)
+            label = random.getrandbits(32)
+            users = get_user_model().objects.bulk_create([
+                get_user_model()(
+                    email='ranking-%d-%d@benchmark.local' % (label, i),
+                    password='!')
+                for i in range(size)
+            ], batch_size=1000)
+            if users[0].pk is None:
+                users = get_user_model().objects.filter(
+                    email__startswith='ranking-%d-' % label)
+            first_cpf = random.randrange(10 ** 10, 9 * 10 ** 10)
+            revendedores = Revendedor.objects.bulk_create([
+                Revendedor(user=user, cpf=str(first_cpf + i), name='ranking')
+                for i, user in enumerate(users)
+            ], batch_size=1000)
+            first = (Compra.objects.aggregate(
+                code=Max('code'))['code'] or 0) + 1
+            Compra.objects.bulk_create([
+                Compra(
+                    code=first + i,
+                    value=round(random.uniform(1, 500), 2),
+                    date=month.replace(day=1 + i % 28),
+                    revendedor=revendedores[i % size])
+                for i in range(size * 3)
+            ], batch_size=1000)
+
+            def group_by():
+                return list(Compra.objects.in_month(
+                    month.year, month.month
+                ).values('revendedor').annotate(
+                    total=Sum('value_cents')
+                ).order_by('-total')[:10])
+
+            start = time.perf_counter()
+            rankings.refresh_month(month)
+            self.report('refresh_rankings', time.perf_counter() - start)
+
+            self.stdout.write('Leaderboard reads (best of %d)' % repeat)
+            baseline = best_of(repeat, group_by)
+            self.report('GROUP BY top 10', baseline)
+            self.report(
+                'Ranking top 10',
+                best_of(repeat, rankings.top, month, 10), baseline)
+            self.report(
+                'Rank of a revendedor',
+                best_of(
+                    repeat, rankings.rank_of, month,
+                    random.choice(revendedores).pk),
+                baseline)
+
+    def bench_renderers(self, size, repeat):
+        """Encode and decode time of a list_purchases response"""
+        if orjson is None:
+            self.stdout.write(self.style.WARNING(
+                'orjson is not installed, ORJSONRenderer falls back to json'))
+        data = sample_purchases(size)
+        self.stdout.write('Encoding %d purchases (best of %d)' % (
+            size, repeat))
+        baseline = best_of(repeat, JSONRenderer().render, data)
+        self.report('JSONRenderer', baseline)
+        self.report(
+            'ORJSONRenderer',
+            best_of(repeat, ORJSONRenderer().render, data),
+            baseline)
+
+        body = JSONRenderer().render(data)
+        self.stdout.write('Decoding %d purchases (best of %d)' % (
+            size, repeat))
+        baseline = best_of(
+            repeat, lambda: JSONParser().parse(io.BytesIO(body)))
+        self.report('JSONParser', baseline)
+        self.report(
+            'ORJSONParser',
+            best_of(repeat, lambda: ORJSONParser().parse(io.BytesIO(body))),
+            baseline)
+
+    def bench_serializers(self, size, repeat):
+        """CPU and memory to serialize a month with `size` purchases"""
+        with rolled_back():
+            revendedor = sample_revendedor()
+            create_purchases(revendedor, size)
+            queryset = Compra.objects.filter(revendedor=revendedor)
+
+            self.stdout.write(
+                'Serializing a month with %d purchases (best of %d)' % (
+                    size, repeat))
+
+            def slow():
+                return CompraSerializer(queryset, many=True).data
+
+            def fast():
+                return CompraReadSerializer(queryset).data
+
+            baseline = best_of(repeat, slow)
+            self.report(
+                'CompraSerializer', baseline, memory=peak_memory(slow))
+            self.report(
+                'CompraReadSerializer', best_of(repeat, fast), baseline,
+                memory=peak_memory(fast))
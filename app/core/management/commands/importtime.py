@@ -0,0 +1,81 @@
+import subprocess
+import sys
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Boots like a worker serving its first request: the entry point runs
+# django.setup(), then the first request loads the URLconf and the views
+BOOT_SCRIPT = '''
+import {module}
+from django.urls import get_resolver
+get_resolver().url_patterns
+'''
+
+
+def parse_importtime(output):
+    """
+    Returns (module, self us, cumulative us) of every import in the
+    output of python -X importtime
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(own), int(cumulative)))
+    return imports
+
+
+class Command(BaseCommand):
+    """
+    Django command to report what a worker spends its boot importing
+
+    Usage: python manage.py importtime [--module app.wsgi] [--budget MS]
+
+    Boots the entry point in a fresh `python -X importtime` process, up
+    to the first request, and prints the import time of each top level
+    package and the slowest modules. Fails when the total is over
+    --budget milliseconds.
+    """
+    help = 'Reports the import time of the worker boot by package'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--module', default='app.wsgi', choices=('app.wsgi', 'app.asgi'))
+        parser.add_argument('--top', type=int, default=15)
+        parser.add_argument(
+            '--budget', type=float, default=None,
+            help='Fails when the imports take longer, in milliseconds')
+
+    def handle(self, *args, **options):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             BOOT_SCRIPT.format(module=options['module'])],
+            cwd=settings.BASE_DIR, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode:
+            raise CommandError(
+                'Booting %s failed:\n%s' % (options['module'], result.stderr))
+        imports = parse_importtime(result.stderr)
+        total = sum(own for _, own, _ in imports) / 1000
+
+        packages = Counter()
+        for name, own, _ in imports:
+            packages[name.split('.')[0]] += own
+        self.stdout.write('Import time by package (self, ms)')
+        for name, own in packages.most_common(options['top']):
+            self.stdout.write('%-50s %8.1f' % (name, own / 1000))
+
+        self.stdout.write('Slowest modules (self, ms)')
+        slowest = sorted(imports, key=lambda item: item[1], reverse=True)
+        for name, own, _ in slowest[:options['top']]:
+            self.stdout.write('%-50s %8.1f' % (name, own / 1000))
+
+        self.stdout.write('%d modules imported in %.1f ms' % (
+            len(imports), total))
+        if options['budget'] is not None and total > options['budget']:
+            raise CommandError(
+                'Imports took %.1f ms, the budget is %.1f ms' % (
+                    total, options['budget']))
@@ -0,0 +1,70 @@
+import datetime
+
+from core import partitioning
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def parse_month(value):
+    """Parses a YYYY-MM argument into the first day of that month"""
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise CommandError('Months must be informed as YYYY-MM')
+
+
+class Command(BaseCommand):
+    """
+    Django command to manage the monthly partitions of the Compra table
+
+    convert: turns core_compra into a partitioned table (run once)
+    create:  creates the partitions of the next months (run periodically)
+    detach:  detaches the partition of an old month
+    """
+    help = 'Manages the monthly partitions of the Compra table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('convert', 'create', 'detach'))
+        parser.add_argument(
+            '--ahead', type=int, default=settings.COMPRA_PARTITIONS_AHEAD,
+            help='Number of future months to create partitions for')
+        parser.add_argument(
+            '--month', type=parse_month,
+            help='Month (YYYY-MM) of the partition to detach')
+        parser.add_argument(
+            '--keep-old', action='store_true',
+            help='Keep the unpartitioned table after converting')
+
+    def handle(self, *args, **options):
+        if not partitioning.is_supported():
+            raise CommandError(
+                'Partitioning requires PostgreSQL %d or newer' % (
+                    partitioning.MIN_SERVER_VERSION // 10000))
+        partitioned = partitioning.is_partitioned()
+        action = options['action']
+
+        if action == 'convert':
+            if partitioned:
+                raise CommandError('Compra table is already partitioned')
+            created = partitioning.convert(
+                options['ahead'], keep_old=options['keep_old'])
+            self.stdout.write(self.style.SUCCESS(
+                'Compra table partitioned (%d partitions)' % len(created)))
+            return
+
+        if not partitioned:
+            raise CommandError(
+                'Compra table is not partitioned, run convert first')
+        if action == 'create':
+            created = partitioning.ensure_future_partitions(options['ahead'])
+            for name in created:
+                self.stdout.write('Created %s' % name)
+            self.stdout.write(self.style.SUCCESS(
+                '%d partitions created' % len(created)))
+        else:
+            if not options['month']:
+                raise CommandError('You must inform the --month to detach')
+            name = partitioning.detach_partition(options['month'])
+            if name is None:
+                raise CommandError('There is no partition for this month')
+            self.stdout.write(self.style.SUCCESS('Detached %s' % name))
@@ -0,0 +1,48 @@
+from collections import Counter
+
+from core import reconciliation
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Django command to apply purchase status decisions in batch
+
+    Usage: python manage.py reconcile_statuses (--file FILE | --url URL)
+
+    The decisions file is a CSV with code and status columns, the status
+    given by value (2) or by name (APROVADO).
+    """
+    help = 'Applies purchase status decisions in chunked batch updates'
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--file', help='CSV file of decisions')
+        source.add_argument('--url', help='Status decision service URL')
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Decisions applied per transaction')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] <= 0:
+            raise CommandError('--chunk-size must be greater than 0')
+        stats = Counter()
+        if options['file']:
+            with open(options['file'], newline='', encoding='utf-8') as f:
+                reconciliation.apply_decisions(
+                    reconciliation.read_decisions(f, stats), stats,
+                    options['chunk_size'])
+        else:
+            reconciliation.apply_decisions(
+                reconciliation.fetch_decisions(options['url'], stats), stats,
+                options['chunk_size'])
+
+        if stats['invalid']:
+            self.stdout.write(self.style.WARNING(
+                '%d invalid decisions skipped' % stats['invalid']))
+        self.stdout.write(self.style.SUCCESS(
+            '%d decisions applied in %.1f s (%.0f decisions/s): '
+            '%d purchases and %d archived purchases updated' % (
+                stats['decisions'], stats['seconds'],
+                stats['decisions'] / max(stats['seconds'], 1e-9),
+                stats['updated'], stats['archived'])))
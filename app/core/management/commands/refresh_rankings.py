@@ -0,0 +1,56 @@
+import datetime
+import time
+
+from core import rankings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def previous_month(month):
+    """Returns the first day of the month before date"""
+    return (month.replace(day=1) - datetime.timedelta(days=1)).replace(day=1)
+
+
+class Command(BaseCommand):
+    """
+    Django command to refresh the monthly leaderboard
+
+    Usage: python manage.py refresh_rankings [--month YYYY-MM] [--loop]
+
+    Ranks the current month and the --months - 1 before it, or the given
+    --month. With --loop it runs every --interval seconds.
+    """
+    help = 'Recomputes the monthly rankings of the revendedores'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='Month to rank, as YYYY-MM')
+        parser.add_argument(
+            '--months', type=int, default=1,
+            help='Months ranked, counting back from the current one')
+        parser.add_argument('--loop', action='store_true')
+        parser.add_argument(
+            '--interval', type=int, default=60,
+            help='Seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        if options['months'] <= 0:
+            raise CommandError('--months must be greater than 0')
+        if options['month']:
+            try:
+                months = [datetime.datetime.strptime(
+                    options['month'], '%Y-%m').date()]
+            except ValueError:
+                raise CommandError('--month must be a YYYY-MM month')
+        while True:
+            if not options['month']:
+                months = [datetime.date.today().replace(day=1)]
+                while len(months) < options['months']:
+                    months.append(previous_month(months[-1]))
+            for month in months:
+                start = time.perf_counter()
+                size = rankings.refresh_month(month)
+                self.stdout.write('%s: %d revendedores ranked in %.2f s' % (
+                    month.strftime('%Y-%m'), size,
+                    time.perf_counter() - start))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,60 @@
+import time
+
+from core import outbox
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Django command to push the purchase changes feed to a consumer
+
+    Usage: python manage.py relay_outbox <consumer> <sink> [--follow]
+
+    The sink is stdout, file:PATH or an http(s) URL receiving POSTs of
+    {"events": [...]}. Each consumer keeps its own position in the feed.
+    """
+    help = 'Relays the purchase outbox events to a sink'
+
+    def add_arguments(self, parser):
+        parser.add_argument('consumer', help='Name of the consumer')
+        parser.add_argument('sink', help='stdout, file:PATH or a URL')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--follow', action='store_true',
+            help='Keep relaying new events, woken by NOTIFY on PostgreSQL')
+        parser.add_argument(
+            '--poll-interval', type=float, default=5.0,
+            help='Seconds between checks for new events when following')
+        parser.add_argument(
+            '--prune', action='store_true',
+            help='Delete the events every consumer received')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be greater than 0')
+        try:
+            sink = outbox.get_sink(options['sink'])
+        except ValueError as error:
+            raise CommandError(error)
+        listening = options['follow'] and outbox.listen()
+
+        relayed = 0
+        start = time.perf_counter()
+        try:
+            while True:
+                sent = outbox.relay_batch(
+                    options['consumer'], sink, options['batch_size'])
+                relayed += sent
+                if sent == options['batch_size']:
+                    continue
+                if options['prune']:
+                    outbox.prune()
+                if not options['follow']:
+                    break
+                outbox.wait(options['poll_interval'], listening)
+        except KeyboardInterrupt:
+            pass
+
+        seconds = time.perf_counter() - start
+        self.stderr.write('%d events relayed in %.1f s (%.0f events/s)' % (
+            relayed, seconds, relayed / max(seconds, 1e-9)))
@@ -0,0 +1,52 @@
+import threading
+
+from core import jobs
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Django command to run the background job workers
+
+    Usage: python manage.py run_workers [--workers N] [--burst]
+
+    Every worker is a thread with its own database connection.
+    """
+    help = 'Runs the background job workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of concurrent workers')
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to wait when the queue is empty')
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Exit once there are no due jobs')
+
+    def handle(self, *args, **options):
+        if options['workers'] <= 0:
+            raise CommandError('--workers must be greater than 0')
+        jobs.autodiscover()
+        stop = threading.Event()
+        workers = [
+            threading.Thread(
+                target=jobs.work,
+                args=(stop, options['poll_interval'], options['burst']),
+                name='job-worker-%d' % number)
+            for number in range(options['workers'])
+        ]
+        self.stdout.write('Starting %d workers' % len(workers))
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(0.5)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping workers')
+            stop.set()
+            for worker in workers:
+                worker.join()
+        self.stdout.write(self.style.SUCCESS('Workers stopped'))
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_alter_revendedor_cpf'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compra',
+            name='value_cents',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+from core.models import to_cents
+from django.db import migrations, transaction
+from django.db.models import Max
+
+# Rows updated per transaction, so the backfill never holds locks on the
+# whole table
+BATCH_SIZE = 10000
+
+# Rows per UPDATE statement of the bulk update
+UPDATE_BATCH_SIZE = 1000
+
+
+def backfill_value_cents(apps, schema_editor):
+    """
+    Copies value (float reais) into value_cents, one id range at a time
+
+    Values go through to_cents like new writes, so backfilled and new rows
+    round half cents the same way.
+    """
+    Compra = apps.get_model('core', 'Compra')
+    last = Compra.objects.aggregate(last=Max('id'))['last'] or 0
+    for start in range(0, last, BATCH_SIZE):
+        with transaction.atomic():
+            compras = list(Compra.objects.filter(
+                id__gt=start,
+                id__lte=start + BATCH_SIZE,
+                value_cents__isnull=True
+            ).only('id', 'value'))
+            for compra in compras:
+                compra.value_cents = to_cents(compra.value)
+            Compra.objects.bulk_update(
+                compras, ['value_cents'], batch_size=UPDATE_BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('core', '0010_compra_value_cents'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_value_cents, migrations.RunPython.noop),
+    ]
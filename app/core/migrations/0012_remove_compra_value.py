@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_backfill_compra_value_cents'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='compra',
+            name='value',
+        ),
+        migrations.AlterField(
+            model_name='compra',
+            name='value_cents',
+            field=models.BigIntegerField(),
+        ),
+    ]
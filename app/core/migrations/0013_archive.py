@@ -0,0 +1,56 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_remove_compra_value'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True)),
+                ('archived_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('purchase_count', models.IntegerField()),
+                ('total_cents', models.BigIntegerField()),
+                ('cashback_percent', models.IntegerField()),
+                ('cashback_cents', models.BigIntegerField()),
+                ('em_validacao_count', models.IntegerField(default=0)),
+                ('aprovado_count', models.IntegerField(default=0)),
+                ('nao_aprovado_count', models.IntegerField(default=0)),
+                ('revendedor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.revendedor')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CompraArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('code', models.IntegerField(unique=True)),
+                ('value_cents', models.BigIntegerField()),
+                ('date', models.DateField()),
+                ('status', models.IntegerField(choices=[(1, 'Em Validacao'), (2, 'Aprovado'), (3, 'Nao Aprovado')])),
+                ('revendedor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_purchases', to='core.revendedor')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='monthlysummary',
+            constraint=models.UniqueConstraint(fields=('revendedor', 'month'), name='unique_monthly_summary'),
+        ),
+        migrations.AddIndex(
+            model_name='compraarchive',
+            index=models.Index(fields=['revendedor', 'date'], name='core_compra_revende_53f454_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:43
+
+from core import partitioning
+from django.db import migrations, models
+
+CONSTRAINT = models.UniqueConstraint(
+    fields=('revendedor', 'idempotency_key'),
+    name='unique_compra_idempotency_key')
+
+
+def add_idempotency_constraint(apps, schema_editor):
+    """
+    Adds the unique idempotency key constraint
+
+    A partitioned table only takes unique indexes including the partition
+    key, so it gets the index of partitioning.convert() instead.
+    """
+    if partitioning.is_partitioned():
+        schema_editor.execute(partitioning.IDEMPOTENCY_INDEX_SQL)
+    else:
+        schema_editor.add_constraint(
+            apps.get_model('core', 'Compra'), CONSTRAINT)
+
+
+def remove_idempotency_constraint(apps, schema_editor):
+    if partitioning.is_partitioned():
+        schema_editor.execute(
+            'DROP INDEX %s' % partitioning.IDEMPOTENCY_INDEX)
+    else:
+        schema_editor.remove_constraint(
+            apps.get_model('core', 'Compra'), CONSTRAINT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compra',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='compra',
+                    constraint=CONSTRAINT,
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(
+                    add_idempotency_constraint,
+                    remove_idempotency_constraint),
+            ],
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:53
+
+from django.db import migrations, models
+
+# Wakes the relay_outbox consumers LISTENing on the channel once the
+# transaction writing events commits, PostgreSQL only
+NOTIFY_SQL = '''
+CREATE FUNCTION core_outboxevent_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('core_outboxevent', '');
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER core_outboxevent_notify
+    AFTER INSERT ON core_outboxevent
+    FOR EACH STATEMENT EXECUTE PROCEDURE core_outboxevent_notify();
+'''
+
+DROP_NOTIFY_SQL = '''
+DROP TRIGGER IF EXISTS core_outboxevent_notify ON core_outboxevent;
+DROP FUNCTION IF EXISTS core_outboxevent_notify();
+'''
+
+
+def create_notify_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(NOTIFY_SQL)
+
+
+def drop_notify_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_NOTIFY_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=50)),
+                ('event', models.CharField(max_length=20)),
+                ('key', models.CharField(max_length=100)),
+                ('payload', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OutboxOffset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('consumer', models.CharField(max_length=100, unique=True)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_notify_trigger, drop_notify_trigger),
+    ]
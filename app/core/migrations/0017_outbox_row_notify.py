@@ -0,0 +1,53 @@
+from django.db import migrations
+
+# NOTIFY every event with its content, for the live feed listeners
+ROW_NOTIFY_SQL = '''
+CREATE OR REPLACE FUNCTION core_outboxevent_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('core_outboxevent', json_build_object(
+        'id', NEW.id,
+        'topic', NEW.topic,
+        'event', NEW.event,
+        'payload', NEW.payload)::text);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+DROP TRIGGER core_outboxevent_notify ON core_outboxevent;
+CREATE TRIGGER core_outboxevent_notify
+    AFTER INSERT ON core_outboxevent
+    FOR EACH ROW EXECUTE PROCEDURE core_outboxevent_notify();
+'''
+
+STATEMENT_NOTIFY_SQL = '''
+CREATE OR REPLACE FUNCTION core_outboxevent_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('core_outboxevent', '');
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+DROP TRIGGER core_outboxevent_notify ON core_outboxevent;
+CREATE TRIGGER core_outboxevent_notify
+    AFTER INSERT ON core_outboxevent
+    FOR EACH STATEMENT EXECUTE PROCEDURE core_outboxevent_notify();
+'''
+
+
+def notify_rows(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(ROW_NOTIFY_SQL)
+
+
+def notify_statements(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(STATEMENT_NOTIFY_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_outbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(notify_rows, notify_statements),
+    ]
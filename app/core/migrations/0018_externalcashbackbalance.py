@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-19 10:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_outbox_row_notify'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExternalCashbackBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cpf', models.CharField(max_length=11, unique=True)),
+                ('body', models.JSONField()),
+                ('synced_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 3.2.25 on 2026-10-19 10:10
+
+from core import partitioning
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class AddCompraIndexConcurrently(AddIndexConcurrently):
+    """
+    Builds a Compra index without blocking writes
+
+    A partitioned core_compra builds it on each partition instead, see
+    partitioning.create_index_concurrently().
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if not partitioning.is_partitioned():
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        partitioning.create_index_concurrently(self.index.name, [
+            model._meta.get_field(name).column
+            for name in self.index.fields])
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if not partitioning.is_partitioned():
+            return super().database_backwards(
+                app_label, schema_editor, from_state, to_state)
+        # Dropping the index of the parent drops those of the partitions
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % self.index.name)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('core', '0018_externalcashbackbalance'),
+    ]
+
+    operations = [
+        AddCompraIndexConcurrently(
+            model_name='compra',
+            index=models.Index(fields=['revendedor', 'date'], name='core_compra_rev_date_idx'),
+        ),
+        AddCompraIndexConcurrently(
+            model_name='compra',
+            index=models.Index(fields=['revendedor', 'status', 'date'], name='core_compra_rev_status_idx'),
+        ),
+        AddCompraIndexConcurrently(
+            model_name='compra',
+            index=models.Index(fields=['revendedor', 'value_cents'], name='core_compra_rev_value_idx'),
+        ),
+        AddCompraIndexConcurrently(
+            model_name='compra',
+            index=models.Index(fields=['revendedor', 'code'], name='core_compra_rev_code_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-19 10:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_compra_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRanking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('rank', models.IntegerField()),
+                ('total_cents', models.BigIntegerField()),
+                ('purchase_count', models.IntegerField()),
+                ('refreshed_at', models.DateTimeField()),
+                ('revendedor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.revendedor')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='monthlyranking',
+            index=models.Index(fields=['month', 'rank', 'revendedor'], name='core_ranking_top_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyranking',
+            constraint=models.UniqueConstraint(fields=('month', 'revendedor'), name='unique_monthly_ranking'),
+        ),
+    ]
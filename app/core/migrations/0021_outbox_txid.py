@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-19 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_monthlyranking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxevent',
+            name='txid',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='outboxoffset',
+            name='txid',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(fields=['txid', 'id'], name='core_outbox_position_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_outbox_txid'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='job',
+            name='core_job_queued_idx',
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='status',
+            field=models.IntegerField(choices=[(1, 'Queued'), (2, 'Failed'), (3, 'Running')], default=1),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(condition=models.Q(('status__in', [1, 3])), fields=['run_at'], name='core_job_due_idx'),
+        ),
+    ]
@@ -1,6 +1,17 @@
+import datetime
+import json
+from decimal import ROUND_HALF_UP, Decimal
+
+from core import hashers
 from django.contrib.auth.models import (AbstractBaseUser, BaseUserManager,
                                         PermissionsMixin)
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import (BigIntegerField, Count, ExpressionWrapper, F,
+                              Q, Sum, Window)
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from django.utils.functional import cached_property
 
 
 class UserManager(BaseUserManager):
@@ -18,14 +29,11 @@ class UserManager(BaseUserManager):
 
         return user
 
-    def create_superuser(self, email, password):
+    def create_superuser(self, email, password, **extra_fields):
         """Creates and saves a new superuser"""
-        user = self.create_user(email, password)
-        user.is_staff = True
-        user.is_superuser = True
-        user.save(using=self._db)
-
-        return user
+        extra_fields.setdefault('is_staff', True)
+        extra_fields.setdefault('is_superuser', True)
+        return self.create_user(email, password, **extra_fields)
 
 
 class User(AbstractBaseUser, PermissionsMixin):
@@ -38,6 +46,25 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     USERNAME_FIELD = 'email'
 
+    def set_password(self, raw_password):
+        """Hashes the password in the password hashing pool"""
+        self.password = hashers.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """
+        Checks the password in the password hashing pool
+
+        Passwords hashed with an outdated hasher are hashed again with the
+        preferred one and saved.
+        """
+        def setter(raw_password):
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=['password'])
+
+        return hashers.check_password(raw_password, self.password, setter)
+
 
 class Revendedor(models.Model):
     """Extends user to add cpf"""
@@ -53,6 +80,195 @@ class Revendedor(models.Model):
         return self.name
 
 
+STATUS_STR = {
+    1: 'Em validação',
+    2: 'Aprovado',
+    3: 'Não aprovado',
+}
+
+
+# Raises duplicated codes when the Compra table is partitioned, see
+# core/partitioning.py
+PARTITIONED_CODE_CONSTRAINT = 'core_compra_code_pkey'
+
+
+def violated_constraint(error):
+    """Returns the name of the constraint an IntegrityError violated"""
+    diag = getattr(error.__cause__, 'diag', None)
+    return getattr(diag, 'constraint_name', None)
+
+
+def to_cents(value):
+    """Converts a money value (reais) to integer cents, rounding half up"""
+    cents = (Decimal(str(value)) * 100).quantize(
+        Decimal(1), rounding=ROUND_HALF_UP)
+    return int(cents)
+
+
+def cashback_percent(month_total_cents):
+    """Returns the cashback tier (%) for a monthly total in cents"""
+    if month_total_cents > 150000:
+        return 20
+    elif month_total_cents > 100000:
+        return 15
+    else:
+        return 10
+
+
+CASHBACK_TIERS = (10, 15, 20)
+
+
+def cashback_cents(value_cents, percent):
+    """Returns the cashback in cents of a purchase, rounding half up"""
+    return (value_cents * percent + 50) // 100
+
+
+def next_month(date):
+    """Returns the first day of the month after date"""
+    if date.month == 12:
+        return date.replace(year=date.year + 1, month=1, day=1)
+    return date.replace(month=date.month + 1, day=1)
+
+
+class CompraQuerySet(models.QuerySet):
+
+    def in_month(self, year, month):
+        """
+        Filters the purchases of a month
+
+        Uses a plain date range, which can use the (revendedor, date)
+        index and lets PostgreSQL prune the monthly partitions.
+        """
+        first = datetime.date(year, month, 1)
+        return self.in_months(first, first)
+
+    def in_months(self, first, last):
+        """Filters the purchases of the months from `first` to `last`"""
+        return self.filter(
+            date__gte=first.replace(day=1), date__lt=next_month(last))
+
+    def with_month_totals(self):
+        """
+        Annotates month_total_cents, the monthly total of the revendedor
+
+        A window over the filtered rows, so filter whole months. The
+        totals come with the rows, in the same query.
+        """
+        return self.annotate(month_total_cents=Window(
+            Sum('value_cents'),
+            partition_by=[F('revendedor'), TruncMonth('date')]))
+
+    def month_totals(self, revendedores, first, last):
+        """
+        Returns the monthly purchases total of each revendedor
+
+        Covers every month from `first` to `last` (dates) with a single
+        GROUP BY query, as {(revendedor pk, first day of month): total}.
+        Totals are exact integer cents.
+        """
+        totals = self.model.objects.filter(
+            revendedor__in=revendedores,
+            date__gte=first.replace(day=1),
+            date__lt=next_month(last)
+        ).annotate(
+            month=TruncMonth('date')
+        ).order_by().values_list('revendedor', 'month').annotate(
+            total=Sum('value_cents')
+        )
+        return {(rev, month): total for rev, month, total in totals}
+
+    def monthly_summaries(self):
+        """
+        Returns the aggregates of each revendedor month in this queryset
+
+        A single GROUP BY computes the purchase count, total, status
+        breakdown and the cashback of every tier; the tier of the month
+        then picks its cashback, rounded per purchase like the listing.
+        """
+        cashback = {
+            'cashback_%d' % percent: Sum(ExpressionWrapper(
+                (F('value_cents') * percent + 50) / 100,
+                output_field=BigIntegerField()))
+            for percent in CASHBACK_TIERS
+        }
+        rows = self.annotate(
+            month=TruncMonth('date')
+        ).order_by().values('revendedor', 'month').annotate(
+            purchase_count=Count('id'),
+            total_cents=Sum('value_cents'),
+            em_validacao_count=Count('id', filter=Q(status=1)),
+            aprovado_count=Count('id', filter=Q(status=2)),
+            nao_aprovado_count=Count('id', filter=Q(status=3)),
+            **cashback
+        )
+        for row in rows:
+            percent = cashback_percent(row['total_cents'])
+            row['cashback_percent'] = percent
+            row['cashback_cents'] = row['cashback_%d' % percent]
+            for name in cashback:
+                del row[name]
+            yield row
+
+    def create_or_get(self, **values):
+        """
+        Creates a purchase unless its code or idempotency key exists
+
+        The insert is a single INSERT ... ON CONFLICT DO NOTHING, so the
+        unique constraints do the checking instead of a SELECT first.
+        Returns (purchase, created); when nothing was inserted the
+        purchase with the idempotency key, or else the one with the code,
+        is returned instead.
+
+        A partitioned table checks codes in a trigger, which ON CONFLICT
+        does not see: the insert then runs in a savepoint and the
+        trigger's unique violation is a conflict too.
+        """
+        columns = list(values)
+        sql = (
+            'INSERT INTO %s (%s) VALUES (%s) '
+            'ON CONFLICT DO NOTHING RETURNING id' % (
+                self.model._meta.db_table,
+                ', '.join(columns),
+                ', '.join(['%s'] * len(columns))))
+        with connections[self.db].cursor() as cursor:
+            try:
+                with transaction.atomic(
+                        using=self.db, savepoint=settings.COMPRA_PARTITIONING):
+                    cursor.execute(sql, [values[column] for column in columns])
+                    row = cursor.fetchone()
+            except IntegrityError as error:
+                if (not settings.COMPRA_PARTITIONING or
+                        violated_constraint(error) !=
+                        PARTITIONED_CODE_CONSTRAINT):
+                    raise
+                row = None
+        if row is not None:
+            purchase = self.model(id=row[0], **values)
+            purchase._state.adding = False
+            purchase._state.db = self.db
+            return purchase, True
+
+        if values.get('idempotency_key'):
+            purchase = self.filter(
+                revendedor=values['revendedor_id'],
+                idempotency_key=values['idempotency_key']).first()
+            if purchase is not None:
+                return purchase, False
+        return self.filter(code=values['code']).first(), False
+
+
+class CompraArchiveQuerySet(CompraQuerySet):
+
+    def month_totals(self, revendedores, first, last):
+        """Returns the totals of archived months from their summaries"""
+        totals = MonthlySummary.objects.filter(
+            revendedor__in=revendedores,
+            month__gte=first.replace(day=1),
+            month__lte=last
+        ).values_list('revendedor', 'month', 'total_cents')
+        return {(rev, month): total for rev, month, total in totals}
+
+
 class Compra(models.Model):
     """Compra model that stores purchases informations"""
 
@@ -62,40 +278,267 @@ class Compra(models.Model):
         NAO_APROVADO = 3
 
     code = models.IntegerField(unique=True)
-    value = models.FloatField(blank=False)
+    # Money is stored as integer cents so sums and tiers are exact,
+    # `value` exposes it in reais
+    value_cents = models.BigIntegerField(blank=False)
     date = models.DateField(blank=False)
     revendedor = models.ForeignKey(Revendedor, on_delete=models.CASCADE)
     status = models.IntegerField(choices=Status.choices, default=1)
+    # Optional client supplied key that makes create requests retryable
+    idempotency_key = models.CharField(
+        max_length=255, null=True, blank=True, editable=False)
+
+    objects = CompraQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['revendedor', 'idempotency_key'],
+                name='unique_compra_idempotency_key'),
+        ]
+        # One index per filter of the purchases list, see
+        # cashback/filters.py
+        indexes = [
+            models.Index(
+                fields=['revendedor', 'date'],
+                name='core_compra_rev_date_idx'),
+            models.Index(
+                fields=['revendedor', 'status', 'date'],
+                name='core_compra_rev_status_idx'),
+            models.Index(
+                fields=['revendedor', 'value_cents'],
+                name='core_compra_rev_value_idx'),
+            models.Index(
+                fields=['revendedor', 'code'],
+                name='core_compra_rev_code_idx'),
+        ]
+
+    @property
+    def value(self):
+        if self.value_cents is None:
+            return None
+        return self.value_cents / 100
+
+    @value.setter
+    def value(self, value):
+        self.value_cents = None if value is None else to_cents(value)
+
+    @cached_property
+    def month_total_cents(self):
+        return Compra.objects.filter(
+            revendedor=self.revendedor_id
+        ).in_month(
+            self.date.year, self.date.month
+        ).aggregate(total=Sum('value_cents'))['total'] or 0
 
     @property
     def month_total(self):
-        return sum([c.value for c in Compra.objects.filter(
-            revendedor=self.revendedor,
-            date__year=self.date.year,
-            date__month=self.date.month
-        )])
+        return self.month_total_cents / 100
 
     @property
     def cashback_percent(self):
-        if self.month_total > 1500:
-            return 20
-        elif self.month_total > 1000:
-            return 15
-        else:
-            return 10
+        return cashback_percent(self.month_total_cents)
 
     @property
     def cashback_value(self):
-        return round(self.value * (self.cashback_percent / 100), 2)
+        return cashback_cents(self.value_cents, self.cashback_percent) / 100
 
     @property
     def status_str(self):
-        if self.status == 1:
-            return 'Em validação'
-        elif self.status == 2:
-            return 'Aprovado'
-        else:
-            return 'Não aprovado'
+        return STATUS_STR.get(self.status, STATUS_STR[3])
+
+    def __str__(self) -> str:
+        return str(self.code)
+
+
+class CompraArchive(models.Model):
+    """Purchases of closed months, moved out of Compra when archived"""
+    id = models.BigIntegerField(primary_key=True)
+    code = models.IntegerField(unique=True)
+    value_cents = models.BigIntegerField()
+    date = models.DateField()
+    revendedor = models.ForeignKey(
+        Revendedor,
+        on_delete=models.CASCADE,
+        related_name='archived_purchases'
+    )
+    status = models.IntegerField(choices=Compra.Status.choices)
+
+    objects = CompraArchiveQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['revendedor', 'date'])]
 
     def __str__(self) -> str:
         return str(self.code)
+
+
+class ArchivedMonth(models.Model):
+    """Months whose purchases were moved to CompraArchive"""
+    month = models.DateField(unique=True)
+    archived_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return self.month.strftime('%Y-%m')
+
+
+class MonthlySummary(models.Model):
+    """Precomputed purchases aggregates of a revendedor archived month"""
+    revendedor = models.ForeignKey(Revendedor, on_delete=models.CASCADE)
+    month = models.DateField()
+    purchase_count = models.IntegerField()
+    total_cents = models.BigIntegerField()
+    cashback_percent = models.IntegerField()
+    cashback_cents = models.BigIntegerField()
+    em_validacao_count = models.IntegerField(default=0)
+    aprovado_count = models.IntegerField(default=0)
+    nao_aprovado_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['revendedor', 'month'],
+                name='unique_monthly_summary'),
+        ]
+
+    def __str__(self) -> str:
+        return '%s %s' % (self.revendedor_id, self.month.strftime('%Y-%m'))
+
+
+class MonthlyRanking(models.Model):
+    """
+    Rank of a revendedor by purchases total in a month
+
+    Refreshed by the refresh_rankings command, see core/rankings.py.
+    """
+    month = models.DateField()
+    revendedor = models.ForeignKey(Revendedor, on_delete=models.CASCADE)
+    rank = models.IntegerField()
+    total_cents = models.BigIntegerField()
+    purchase_count = models.IntegerField()
+    refreshed_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['month', 'revendedor'],
+                name='unique_monthly_ranking'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['month', 'rank', 'revendedor'],
+                name='core_ranking_top_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return '%s #%d %s' % (
+            self.month.strftime('%Y-%m'), self.rank, self.revendedor_id)
+
+
+class Job(models.Model):
+    """Deferred work queued for the run_workers command, see core/jobs.py"""
+
+    class Status(models.IntegerChoices):
+        QUEUED = 1
+        FAILED = 2
+        RUNNING = 3
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.IntegerField(
+        choices=Status.choices, default=Status.QUEUED)
+    attempts = models.IntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['run_at'],
+                condition=Q(status__in=[1, 3]),
+                name='core_job_due_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return '%s #%s' % (self.name, self.pk)
+
+
+class OutboxEvent(models.Model):
+    """
+    Change of a purchase, written in the transaction of the change
+
+    The transaction id and then the id are the position of the event in
+    the feed, see core/outbox.py.
+    """
+    topic = models.CharField(max_length=50)
+    event = models.CharField(max_length=20)
+    key = models.CharField(max_length=100)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Id of the transaction that wrote the event
+    txid = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['txid', 'id'], name='core_outbox_position_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return '%s %s %s' % (self.topic, self.event, self.key)
+
+
+class OutboxOffset(models.Model):
+    """Last outbox event delivered to a consumer, by (txid, position)"""
+    consumer = models.CharField(max_length=100, unique=True)
+    txid = models.BigIntegerField(default=0)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return '%s@%d:%d' % (self.consumer, self.txid, self.position)
+
+
+class ExternalCashbackBalanceQuerySet(models.QuerySet):
+
+    def upsert(self, balances, synced_at):
+        """
+        Inserts or updates the balances of {cpf: body}
+
+        One INSERT ... ON CONFLICT (cpf) DO UPDATE per batch, sized for
+        the parameters limit of the database. Returns the rows written.
+        """
+        connection = connections[self.db]
+        synced_at = connection.ops.adapt_datetimefield_value(synced_at)
+        rows = [
+            (cpf, json.dumps(body), synced_at)
+            for cpf, body in balances.items()
+        ]
+        size = connection.ops.bulk_batch_size(
+            ['cpf', 'body', 'synced_at'], rows) or len(rows)
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), size):
+                batch = rows[start:start + size]
+                cursor.execute(
+                    'INSERT INTO %s (cpf, body, synced_at) VALUES %s '
+                    'ON CONFLICT (cpf) DO UPDATE SET body = excluded.body, '
+                    'synced_at = excluded.synced_at' % (
+                        self.model._meta.db_table,
+                        ', '.join(['(%s, %s, %s)'] * len(batch))),
+                    [param for row in batch for param in row])
+        return len(rows)
+
+
+class ExternalCashbackBalance(models.Model):
+    """Accumulated cashback of a CPF mirrored from the provider"""
+    # Digits only, see cashback.provider.normalize_cpf
+    cpf = models.CharField(max_length=11, unique=True)
+    # The provider answer, as returned by accumulated_cashback
+    body = models.JSONField()
+    synced_at = models.DateTimeField()
+
+    objects = ExternalCashbackBalanceQuerySet.as_manager()
+
+    def __str__(self) -> str:
+        return self.cpf
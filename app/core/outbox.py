@@ -0,0 +1,230 @@
+"""
+Transactional outbox of purchase changes
+
+Every create, update and delete of a purchase writes an OutboxEvent in
+the same transaction as the change, so the feed never misses a committed
+change nor shows a rolled back one. The relay_outbox command streams the
+events to a sink in id order and stores the position each consumer
+reached only after the sink accepted the batch: delivery is at least
+once, consumers must ignore events they already have (by id).
+
+Ids are taken when a transaction inserts, not when it commits, so a slow
+transaction can commit ids lower than events already relayed. The feed
+is therefore ordered by the id of the transaction writing each event,
+then by id, and only holds the events of transactions older than every
+transaction still running: later events always come after the position
+of a consumer.
+
+On PostgreSQL a trigger NOTIFYs every event on the core_outboxevent
+channel when its transaction commits, so a following relay wakes up right
+away instead of polling, and the live feed (cashback/live.py) pushes it
+to the dashboards.
+"""
+import json
+import select
+import sys
+
+from core.models import OutboxEvent, OutboxOffset
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, Func, Q, Value
+
+TOPIC = 'compra'
+CHANNEL = 'core_outboxevent'
+PURCHASE_COLUMNS = (
+    'id', 'code', 'value_cents', 'date', 'revendedor_id', 'status')
+
+
+def purchase_payload(purchase):
+    """Returns the event payload of a purchase, in the API format"""
+    return {
+        'id': purchase.id,
+        'code': purchase.code,
+        'value': purchase.value_cents / 100,
+        'date': purchase.date.isoformat(),
+        'revendedor': purchase.revendedor_id,
+        'status': purchase.status,
+    }
+
+
+def row_payload(row):
+    """Returns the event payload of a PURCHASE_COLUMNS values row"""
+    pk, code, value_cents, date, revendedor, status = row
+    return {
+        'id': pk,
+        'code': code,
+        'value': value_cents / 100,
+        'date': date.isoformat(),
+        'revendedor': revendedor,
+        'status': status,
+    }
+
+
+def transaction_id():
+    """Returns the expression of the id of the current transaction"""
+    if connection.vendor != 'postgresql':
+        # Other databases take one writing transaction at a time, so
+        # events commit in id order
+        return Value(0)
+    return Func(function='txid_current', output_field=BigIntegerField())
+
+
+def oldest_running_transaction():
+    """Returns the expression of the oldest transaction still running"""
+    return Func(
+        Func(function='txid_current_snapshot'),
+        function='txid_snapshot_xmin', output_field=BigIntegerField())
+
+
+def record(event, payloads, topic=TOPIC, key='code'):
+    """
+    Writes the events of changed purchases
+
+    Must run in the transaction changing them. `payloads` are
+    purchase_payload / row_payload dicts, keyed by their `key` item.
+    """
+    txid = transaction_id()
+    OutboxEvent.objects.bulk_create([
+        OutboxEvent(
+            topic=topic, event=event, key=str(payload[key]),
+            payload=payload, txid=txid)
+        for payload in payloads
+    ])
+
+
+def serialize(event):
+    """Returns the wire format of an event"""
+    return {
+        'id': event.id,
+        'topic': event.topic,
+        'event': event.event,
+        'key': event.key,
+        'payload': event.payload,
+        'created_at': event.created_at.isoformat(),
+    }
+
+
+def after(txid, position):
+    """Returns the filter of the events after a (txid, id) position"""
+    return Q(txid__gt=txid) | Q(txid=txid, id__gt=position)
+
+
+def pending(txid, position, batch_size):
+    """
+    Returns the next events after the (txid, id) position
+
+    Events of transactions that are still running, or that started after
+    the oldest one still running, are left for a later batch: an event
+    of that oldest transaction would come before them.
+    """
+    events = OutboxEvent.objects.filter(after(txid, position))
+    if connection.vendor == 'postgresql':
+        events = events.filter(txid__lt=oldest_running_transaction())
+    return list(events.order_by('txid', 'id')[:batch_size])
+
+
+def relay_batch(consumer, sink, batch_size=500):
+    """
+    Sends the next batch of events of consumer to sink
+
+    The offset row stays locked while the batch is sent, so two relays
+    of the same consumer never interleave. Returns the events sent.
+    """
+    with transaction.atomic():
+        offset, _ = OutboxOffset.objects.get_or_create(consumer=consumer)
+        offset = OutboxOffset.objects.select_for_update().get(pk=offset.pk)
+        events = pending(offset.txid, offset.position, batch_size)
+        if events:
+            sink.send([serialize(event) for event in events])
+            offset.txid = events[-1].txid
+            offset.position = events[-1].id
+            offset.save(update_fields=['txid', 'position', 'updated_at'])
+    return len(events)
+
+
+def prune():
+    """Deletes the events every consumer already received"""
+    offsets = OutboxOffset.objects.values_list('txid', 'position')
+    if not offsets:
+        return 0
+    txid, position = min(offsets)
+    return OutboxEvent.objects.exclude(
+        after(txid, position)).delete()[0]
+
+
+def listen():
+    """LISTENs for new events on PostgreSQL, returns False elsewhere"""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('LISTEN %s' % CHANNEL)
+    return True
+
+
+def wait(timeout, listening):
+    """
+    Waits for a NOTIFY of new events, or timeout seconds
+
+    Returns True when notified.
+    """
+    if not listening:
+        select.select([], [], [], timeout)
+        return False
+    pg = connection.connection
+    if not pg.notifies and select.select([pg], [], [], timeout)[0]:
+        pg.poll()
+    notified = bool(pg.notifies)
+    pg.notifies.clear()
+    return notified
+
+
+class FileSink:
+    """Appends the events to a file, one JSON document per line"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, events):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+            f.flush()
+
+
+class StreamSink:
+    """Writes the events to a stream, stdout by default"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def send(self, events):
+        for event in events:
+            self.stream.write(json.dumps(event) + '\n')
+        self.stream.flush()
+
+
+class HttpSink:
+    """POSTs each batch as {"events": [...]}, any error is retried"""
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+        # Imported by the relays using this sink only
+        import requests
+
+        self.session = requests.Session()
+
+    def send(self, events):
+        res = self.session.post(
+            self.url, json={'events': events}, timeout=self.timeout)
+        res.raise_for_status()
+
+
+def get_sink(spec):
+    """Returns the sink of spec: stdout, file:PATH or an http(s) URL"""
+    if spec == 'stdout':
+        return StreamSink()
+    if spec.startswith('file:'):
+        return FileSink(spec[len('file:'):])
+    if spec.startswith(('http://', 'https://')):
+        return HttpSink(spec)
+    raise ValueError('Unknown sink %r' % spec)
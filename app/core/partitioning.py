@@ -0,0 +1,280 @@
+"""
+Opt-in monthly range partitioning of the Compra table (PostgreSQL 11+)
+
+`convert()` swaps core_compra for a table partitioned by month on `date`.
+PostgreSQL can only enforce unique constraints that include the partition
+key, so the global uniqueness of `code` moves to the core_compra_code
+table, kept in sync by a trigger: a duplicate code still raises an
+IntegrityError on insert.
+
+Rows of months without a partition go to a DEFAULT partition, and move
+to their month partition when it is created.
+
+Queries filtering the month with a date range (CompraQuerySet.in_month)
+only touch that month partition, and old months can be detached with a
+metadata-only ALTER TABLE.
+"""
+import datetime
+
+from core.models import PARTITIONED_CODE_CONSTRAINT, Compra, next_month
+from django.db import connection, transaction
+
+TABLE = 'core_compra'
+CODES_TABLE = 'core_compra_code'
+DEFAULT_PARTITION = 'core_compra_default'
+MIN_SERVER_VERSION = 110000
+
+# Unique keys of a partitioned table must include the partition key: a
+# retried create carries the same date, so idempotency keys stay unique
+# for retries
+IDEMPOTENCY_INDEX = 'unique_compra_idempotency_key'
+IDEMPOTENCY_INDEX_SQL = (
+    'CREATE UNIQUE INDEX %s ON %s (revendedor_id, idempotency_key, date)' % (
+        IDEMPOTENCY_INDEX, TABLE))
+
+CODES_TRIGGER_SQL = '''
+CREATE TABLE {codes} (
+    code integer CONSTRAINT {constraint} PRIMARY KEY,
+    date date NOT NULL
+);
+CREATE FUNCTION {codes}_sync() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM {codes} WHERE code = OLD.code;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO {codes} (code, date) VALUES (NEW.code, NEW.date);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER {codes}_sync
+    AFTER INSERT OR UPDATE OF code OR DELETE ON {table}
+    FOR EACH ROW EXECUTE PROCEDURE {codes}_sync();
+'''
+
+
+def month_start(date):
+    """Returns the first day of the month of date"""
+    return date.replace(day=1)
+
+
+def months_between(first, last):
+    """Yields the first day of every month from first to last"""
+    month = month_start(first)
+    while month <= last:
+        yield month
+        month = next_month(month)
+
+
+def partition_name(month):
+    """Returns the name of the partition holding the month of date"""
+    return '%s_p%04d_%02d' % (TABLE, month.year, month.month)
+
+
+def partition_sql(month):
+    """Returns the DDL creating the partition of a month"""
+    first = month_start(month)
+    return (
+        "CREATE TABLE IF NOT EXISTS %s PARTITION OF %s "
+        "FOR VALUES FROM ('%s') TO ('%s')" % (
+            partition_name(first), TABLE, first.isoformat(),
+            next_month(first).isoformat()))
+
+
+def is_supported():
+    """Returns True when the database can partition the Compra table"""
+    return (
+        connection.vendor == 'postgresql' and
+        connection.pg_version >= MIN_SERVER_VERSION)
+
+
+def is_partitioned():
+    """Returns True when core_compra already is a partitioned table"""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relkind FROM pg_class "
+            "WHERE relname = %s AND relnamespace = 'public'::regnamespace",
+            [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def existing_partitions():
+    """Returns the names of the partitions attached to core_compra"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = %s",
+            [TABLE])
+        return {row[0] for row in cursor.fetchall()}
+
+
+def create_partition(cursor, month):
+    """
+    Creates the partition of a month
+
+    Rows of the month that landed in the DEFAULT partition, because
+    their partition did not exist yet, would make the CREATE fail: they
+    are moved out through a temporary table and back in once the
+    partition exists. Run in a transaction.
+    """
+    first = month_start(month)
+    bounds = [first, next_month(first)]
+    cursor.execute(
+        'LOCK TABLE %s IN ACCESS EXCLUSIVE MODE' % DEFAULT_PARTITION)
+    cursor.execute(
+        'SELECT 1 FROM %s WHERE date >= %%s AND date < %%s LIMIT 1' % (
+            DEFAULT_PARTITION), bounds)
+    if cursor.fetchone() is None:
+        cursor.execute(partition_sql(first))
+        return
+
+    moving = '%s_moving' % DEFAULT_PARTITION
+    cursor.execute(
+        'CREATE TEMPORARY TABLE %s (LIKE %s) ON COMMIT DROP' % (
+            moving, TABLE))
+    # The codes trigger releases the codes of the deleted rows and
+    # reserves them again when they are inserted back
+    cursor.execute(
+        'WITH moved AS (DELETE FROM %s WHERE date >= %%s AND date < %%s '
+        'RETURNING *) INSERT INTO %s SELECT * FROM moved' % (
+            DEFAULT_PARTITION, moving), bounds)
+    cursor.execute(partition_sql(first))
+    cursor.execute('INSERT INTO %s SELECT * FROM %s' % (TABLE, moving))
+    cursor.execute('DROP TABLE %s' % moving)
+
+
+def index_columns(index):
+    """Returns the core_compra columns of a Compra Meta index"""
+    return [Compra._meta.get_field(name).column for name in index.fields]
+
+
+def create_index_concurrently(name, columns):
+    """
+    Creates an index of the partitioned core_compra without blocking writes
+
+    A partitioned table can not build an index CONCURRENTLY: the index is
+    created on the parent only, then built CONCURRENTLY on each partition
+    and attached, which makes it valid once every partition has it. Runs
+    outside a transaction, new partitions take the index on creation.
+    """
+    columns = ', '.join(columns)
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE INDEX IF NOT EXISTS %s ON ONLY %s (%s)' % (
+            name, TABLE, columns))
+        # Partitions created after the index, or by an interrupted run,
+        # already have theirs
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_index ON pg_index.indexrelid = pg_inherits.inhrelid "
+            "JOIN pg_class child ON child.oid = pg_index.indrelid "
+            "WHERE pg_inherits.inhparent = %s::regclass", [name])
+        indexed = {row[0] for row in cursor.fetchall()}
+        for partition in sorted(existing_partitions() - indexed):
+            partition_index = '%s_%s' % (partition, name)
+            cursor.execute(
+                'CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s (%s)' % (
+                    partition_index, partition, columns))
+            cursor.execute('ALTER INDEX %s ATTACH PARTITION %s' % (
+                name, partition_index))
+
+
+def create_partitions(first, last):
+    """Creates the missing partitions from first to last, returns them"""
+    existing = existing_partitions()
+    created = []
+    with connection.cursor() as cursor:
+        for month in months_between(first, last):
+            if partition_name(month) not in existing:
+                with transaction.atomic():
+                    create_partition(cursor, month)
+                created.append(partition_name(month))
+    return created
+
+
+def ensure_future_partitions(months_ahead, today=None):
+    """Creates the partitions of the current and next `months_ahead`"""
+    first = month_start(today or datetime.date.today())
+    last = first
+    for _ in range(months_ahead):
+        last = next_month(last)
+    return create_partitions(first, last)
+
+
+def convert(months_ahead, keep_old=False):
+    """
+    Converts core_compra into a table partitioned by month
+
+    Runs in a single transaction holding an exclusive lock on the table,
+    so it should run in a maintenance window. Returns the partitions
+    created.
+    """
+    old = '%s_unpartitioned' % TABLE
+    index_names = [index.name for index in Compra._meta.indexes]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('LOCK TABLE %s IN ACCESS EXCLUSIVE MODE' % TABLE)
+        cursor.execute('SELECT min(date), max(date) FROM %s' % TABLE)
+        first, last = cursor.fetchone()
+        cursor.execute('ALTER TABLE %s RENAME TO %s' % (TABLE, old))
+        # The new table takes over the names of the indexes
+        for name in [IDEMPOTENCY_INDEX] + index_names:
+            cursor.execute(
+                'ALTER INDEX IF EXISTS %s RENAME TO %s_unpartitioned' % (
+                    name, name))
+        cursor.execute(
+            'CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) '
+            'PARTITION BY RANGE (date)' % (TABLE, old))
+        cursor.execute(
+            'ALTER SEQUENCE %s_id_seq OWNED BY %s.id' % (TABLE, TABLE))
+        cursor.execute(
+            'ALTER TABLE %s ADD CONSTRAINT %s_partitioned_pkey '
+            'PRIMARY KEY (id, date)' % (TABLE, TABLE))
+        cursor.execute(
+            'ALTER TABLE %s ADD CONSTRAINT %s_revendedor_fk '
+            'FOREIGN KEY (revendedor_id) REFERENCES core_revendedor (user_id) '
+            'DEFERRABLE INITIALLY DEFERRED' % (TABLE, TABLE))
+        cursor.execute(
+            'CREATE INDEX %s_code_idx ON %s (code)' % (TABLE, TABLE))
+        for index in Compra._meta.indexes:
+            cursor.execute('CREATE INDEX %s ON %s (%s)' % (
+                index.name, TABLE, ', '.join(index_columns(index))))
+        cursor.execute(IDEMPOTENCY_INDEX_SQL)
+        cursor.execute(CODES_TRIGGER_SQL.format(
+            codes=CODES_TABLE, table=TABLE,
+            constraint=PARTITIONED_CODE_CONSTRAINT))
+        cursor.execute('CREATE TABLE %s PARTITION OF %s DEFAULT' % (
+            DEFAULT_PARTITION, TABLE))
+
+        today = datetime.date.today()
+        created = []
+        if first is not None:
+            created += create_partitions(first, last)
+        created += ensure_future_partitions(months_ahead, today)
+
+        cursor.execute('INSERT INTO %s SELECT * FROM %s' % (TABLE, old))
+        if not keep_old:
+            # Rows written earlier in the transaction leave deferred
+            # foreign key checks that would block dropping the old table
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute('DROP TABLE %s' % old)
+    return created
+
+
+def detach_partition(month):
+    """
+    Detaches the partition of a month from core_compra
+
+    The partition becomes a standalone table that can be archived or
+    dropped. Its codes stay reserved in core_compra_code.
+    """
+    name = partition_name(month)
+    if name not in existing_partitions():
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE %s DETACH PARTITION %s' % (TABLE, name))
+    return name
@@ -0,0 +1,84 @@
+"""
+Monthly leaderboard of the revendedores
+
+MonthlyRanking holds the rank of every revendedor by purchases total in
+a month. refresh_month() recomputes a month with one GROUP BY and a
+RANK() window, written by INSERT ... SELECT in the transaction that
+drops the previous ranking, so readers see either ranking whole.
+Archived months are ranked from their MonthlySummary rows. Refreshes of
+a month run one at a time, under an advisory lock on PostgreSQL: two of
+them deleting the same ranking would then both insert it.
+
+Requests then read the top of a month from the (month, rank) index and
+the rank of a revendedor by its unique key: their cost does not depend
+on the number of revendedores or purchases.
+"""
+from core.models import (ArchivedMonth, Compra, MonthlyRanking,
+                         MonthlySummary, next_month)
+from django.db import connection, transaction
+from django.utils import timezone
+
+LIVE_SQL = '''
+INSERT INTO {ranking}
+    (month, revendedor_id, rank, total_cents, purchase_count, refreshed_at)
+SELECT %s, revendedor_id, RANK() OVER (ORDER BY SUM(value_cents) DESC),
+    SUM(value_cents), COUNT(*), %s
+FROM {compra}
+WHERE date >= %s AND date < %s
+GROUP BY revendedor_id
+'''
+
+ARCHIVED_SQL = '''
+INSERT INTO {ranking}
+    (month, revendedor_id, rank, total_cents, purchase_count, refreshed_at)
+SELECT month, revendedor_id, RANK() OVER (ORDER BY total_cents DESC),
+    total_cents, purchase_count, %s
+FROM {summary}
+WHERE month = %s
+'''
+
+# First key of the advisory locks of the months refreshed, the second is
+# the month
+REFRESH_LOCK = 48
+
+
+def lock_month(cursor, month):
+    """Waits for the refreshes of month running in other transactions"""
+    if connection.vendor == 'postgresql':
+        cursor.execute(
+            'SELECT pg_advisory_xact_lock(%s, %s)',
+            [REFRESH_LOCK, month.year * 12 + month.month - 1])
+
+
+def refresh_month(month):
+    """Recomputes the ranking of the month of date, returns its size"""
+    first = month.replace(day=1)
+    refreshed_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    with transaction.atomic(), connection.cursor() as cursor:
+        lock_month(cursor, first)
+        MonthlyRanking.objects.filter(month=first).delete()
+        if ArchivedMonth.objects.filter(month=first).exists():
+            cursor.execute(ARCHIVED_SQL.format(
+                ranking=MonthlyRanking._meta.db_table,
+                summary=MonthlySummary._meta.db_table
+            ), [refreshed_at, first])
+        else:
+            cursor.execute(LIVE_SQL.format(
+                ranking=MonthlyRanking._meta.db_table,
+                compra=Compra._meta.db_table
+            ), [first, refreshed_at, first, next_month(first)])
+        return cursor.rowcount
+
+
+def top(month, size):
+    """Returns the `size` first of the ranking of a month"""
+    return list(MonthlyRanking.objects.filter(
+        month=month.replace(day=1)
+    ).select_related('revendedor').order_by('rank', 'revendedor')[:size])
+
+
+def rank_of(month, revendedor):
+    """Returns the ranking of a revendedor in a month, None if unranked"""
+    return MonthlyRanking.objects.filter(
+        month=month.replace(day=1), revendedor=revendedor
+    ).select_related('revendedor').first()
@@ -0,0 +1,121 @@
+"""
+Batch reconciliation of purchase statuses
+
+Status decisions (purchase code, status) come from a CSV file or from the
+status decision service and are applied in chunks: one set-based UPDATE
+per status and chunk instead of a save() per purchase. Purchases already
+archived are updated too, and the summaries of their months recomputed.
+Applying the same decisions again only touches the rows still different.
+Every changed purchase gets an outbox event.
+"""
+import csv
+import time
+from collections import Counter, defaultdict
+from itertools import islice
+
+from core import outbox
+from core.archive import refresh_summaries
+from core.models import Compra, CompraArchive
+from django.db import transaction
+
+STATUS_NAMES = {status.name: status.value for status in Compra.Status}
+
+
+def parse_status(value):
+    """Returns the status code of a decision, by value or by name"""
+    value = str(value).strip()
+    if value.isdigit() and int(value) in Compra.Status.values:
+        return int(value)
+    if value.upper() in STATUS_NAMES:
+        return STATUS_NAMES[value.upper()]
+    raise ValueError('Unknown status %r' % value)
+
+
+def parse_decisions(rows, stats):
+    """Yields the valid (code, status) pairs of rows, counting the others"""
+    for row in rows:
+        try:
+            yield int(row['code']), parse_status(row['status'])
+        except (KeyError, TypeError, ValueError):
+            stats['invalid'] += 1
+
+
+def read_decisions(f, stats):
+    """Yields the decisions of a CSV file with code and status columns"""
+    return parse_decisions(csv.DictReader(f), stats)
+
+
+def fetch_decisions(url, stats, timeout=30):
+    """
+    Yields the decisions of the status decision service
+
+    The service answers {"decisions": [{"code": ..., "status": ...}],
+    "next": url or null}, pages are fetched while there is a next one.
+    """
+    import requests
+
+    with requests.Session() as session:
+        while url:
+            res = session.get(url, timeout=timeout)
+            res.raise_for_status()
+            page = res.json()
+            yield from parse_decisions(page.get('decisions', ()), stats)
+            url = page.get('next')
+
+
+def apply_chunk(decisions, stats):
+    """
+    Applies a chunk of {code: status} decisions in one transaction
+
+    The rows to change are read (and locked) first, to write their
+    outbox events along with the UPDATE.
+    """
+    codes_by_status = defaultdict(list)
+    for code, status in decisions.items():
+        codes_by_status[status].append(code)
+
+    events = []
+    stale = defaultdict(set)
+    with transaction.atomic():
+        for status, codes in codes_by_status.items():
+            for model, counter in ((Compra, 'updated'),
+                                   (CompraArchive, 'archived')):
+                changed = model.objects.filter(
+                    code__in=codes).exclude(status=status)
+                rows = list(changed.select_for_update().values_list(
+                    *outbox.PURCHASE_COLUMNS))
+                if not rows:
+                    continue
+                stats[counter] += changed.update(status=status)
+                events += [
+                    outbox.row_payload(row[:-1] + (status,))
+                    for row in rows
+                ]
+                if model is CompraArchive:
+                    for row in rows:
+                        stale[row[3].replace(day=1)].add(row[4])
+
+        outbox.record('status_changed', events)
+        for month, revendedores in stale.items():
+            refresh_summaries(month, revendedores)
+
+
+def apply_decisions(decisions, stats=None, chunk_size=10000):
+    """
+    Applies (code, status) decisions chunk by chunk
+
+    Returns the stats: decisions read, purchases and archived purchases
+    updated, invalid decisions and the elapsed seconds. Codes repeated in
+    a chunk keep their last decision.
+    """
+    stats = Counter() if stats is None else stats
+    start = time.perf_counter()
+    decisions = iter(decisions)
+    while True:
+        chunk = list(islice(decisions, chunk_size))
+        if not chunk:
+            break
+        stats['decisions'] += len(chunk)
+        apply_chunk(dict(chunk), stats)
+    stats['seconds'] = time.perf_counter() - start
+    return stats
@@ -0,0 +1,48 @@
+"""
+In-process request coalescing
+
+Concurrent calls of SingleFlight.do with the same key share the result of
+one call of the function: the first caller runs it, the others wait for
+it. Nothing is kept once the call returns, so this is not a cache.
+"""
+import threading
+
+
+class Call:
+    """A call in flight, waited on by the callers of the same key"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        """Returns func(*args), shared with the concurrent calls of key"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = func(*args)
+            except BaseException as error:
+                call.error = error
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
@@ -0,0 +1,86 @@
+import datetime
+from io import StringIO
+
+from core import archive
+from core.models import (ArchivedMonth, Compra, CompraArchive, MonthlySummary,
+                         Revendedor)
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+LIST_PURCHASES_URL = reverse('cashback:compra-list-purchases')
+
+
+def sample_revendedor(email='archive@grupoboticario.com.br',
+                      cpf='870.091.100-34'):
+    """Creates a sample revendedor"""
+    user = get_user_model().objects.create_user(
+        email=email, password='pass1234')
+    return Revendedor.objects.create(user=user, cpf=cpf, name='archive')
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        self.revendedor = sample_revendedor()
+        self.old = datetime.date(2019, 3, 1)
+        self.recent = datetime.date.today()
+        purchases = (
+            (1, 800.0, self.old, 1),
+            (2, 700.0, self.old.replace(day=20), 2),
+            (3, 10.0, self.recent, 1),
+        )
+        for code, value, date, status_code in purchases:
+            Compra.objects.create(
+                code=code, value=value, date=date, status=status_code,
+                revendedor=self.revendedor)
+
+    def test_archive_cutoff(self):
+        """Test the cutoff is the first day of the retention window"""
+        cutoff = archive.archive_cutoff(
+            retention=24, today=datetime.date(2021, 8, 15))
+
+        self.assertEqual(cutoff, datetime.date(2019, 8, 1))
+
+    def test_archive_command_moves_old_months(self):
+        """Test closed months are moved to the archive with a summary"""
+        call_command('archive_purchases', retention=12, stdout=StringIO())
+
+        self.assertEqual(
+            list(Compra.objects.values_list('code', flat=True)), [3])
+        self.assertEqual(CompraArchive.objects.count(), 2)
+        self.assertTrue(ArchivedMonth.objects.filter(month=self.old).exists())
+        summary = MonthlySummary.objects.get(
+            revendedor=self.revendedor, month=self.old)
+        self.assertEqual(summary.purchase_count, 2)
+        self.assertEqual(summary.total_cents, 150000)
+        self.assertEqual(summary.cashback_percent, 15)
+        self.assertEqual(summary.cashback_cents, 22500)
+        self.assertEqual(summary.em_validacao_count, 1)
+        self.assertEqual(summary.aprovado_count, 1)
+
+    def test_archive_command_dry_run(self):
+        """Test a dry run does not move anything"""
+        out = StringIO()
+        call_command(
+            'archive_purchases', retention=12, dry_run=True, stdout=out)
+
+        self.assertIn('Would archive 2019-03', out.getvalue())
+        self.assertEqual(Compra.objects.count(), 3)
+
+    def test_list_purchases_reads_archive(self):
+        """Test archived months are listed the same as before archiving"""
+        client = APIClient()
+        client.force_authenticate(user=self.revendedor.user)
+        params = {'year': self.old.year, 'month': self.old.month}
+        before = client.get(LIST_PURCHASES_URL, params)
+
+        archive.archive_month(self.old)
+        after = client.get(LIST_PURCHASES_URL, params)
+
+        self.assertEqual(after.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(after.data), 2)
+        self.assertEqual(after.content, before.content)
@@ -1,8 +1,10 @@
+from io import StringIO
 from unittest.mock import patch
 
+from core.models import Compra
 from django.core.management import call_command
 from django.db.utils import OperationalError
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 
 class CommandTests(TestCase):
@@ -21,3 +23,28 @@ class CommandTests(TestCase):
             gi.side_effect = [OperationalError] * 5 + [True]
             call_command('wait_for_db')
             self.assertEqual(gi.call_count, 6)
+
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_benchmark_hashing(self):
+        """Test the hashing benchmark runs"""
+        out = StringIO()
+        call_command('benchmark', 'hashing', size=2, repeat=1, stdout=out)
+
+        self.assertIn('logins/s', out.getvalue())
+
+    def test_benchmark_renderers(self):
+        """Test the renderers benchmark runs"""
+        out = StringIO()
+        call_command(
+            'benchmark', 'renderers', size=10, repeat=1, stdout=out)
+
+        self.assertIn('ORJSONRenderer', out.getvalue())
+
+    def test_benchmark_serializers(self):
+        """Test the serializers benchmark runs and leaves no data behind"""
+        out = StringIO()
+        call_command(
+            'benchmark', 'serializers', size=10, repeat=1, stdout=out)
+
+        self.assertIn('CompraReadSerializer', out.getvalue())
+        self.assertFalse(Compra.objects.exists())
@@ -0,0 +1,64 @@
+import threading
+from unittest.mock import patch
+
+from core import hashers
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+
+class HasherTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@grupoboticario.com.br',
+            password='pass1234'
+        )
+
+    def test_password_hashed_in_pool(self):
+        """Test passwords are hashed off the calling thread"""
+        threads = []
+
+        def make_password(password):
+            threads.append(threading.current_thread().name)
+            return 'hash'
+
+        with patch.object(hashers.hashers, 'make_password', make_password):
+            self.user.set_password('pass1234')
+
+        self.assertEqual(self.user.password, 'hash')
+        self.assertTrue(threads[0].startswith('password-hashing'))
+
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_pbkdf2_iterations_setting(self):
+        """Test the tuned PBKDF2 hasher uses the configured iterations"""
+        self.user.set_password('pass1234')
+
+        self.assertTrue(
+            self.user.password.startswith('pbkdf2_sha256$1000$'))
+
+    def test_rehash_on_login(self):
+        """Test an outdated hash is upgraded when the password checks"""
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            self.user.set_password('pass1234')
+            self.user.save()
+
+        self.assertFalse(self.user.check_password('wrong-pass'))
+        self.user.refresh_from_db()
+        self.assertIn('$1000$', self.user.password)
+
+        self.assertTrue(self.user.check_password('pass1234'))
+        self.user.refresh_from_db()
+        self.assertNotIn('$1000$', self.user.password)
+        self.assertTrue(self.user.check_password('pass1234'))
+
+    def test_argon2_profile_parameters(self):
+        """Test the tuned Argon2 hasher reads its costs from settings"""
+        with override_settings(
+                PASSWORD_ARGON2_TIME_COST=3,
+                PASSWORD_ARGON2_MEMORY_COST=8192,
+                PASSWORD_ARGON2_PARALLELISM=2):
+            hasher = hashers.TunedArgon2PasswordHasher()
+
+            self.assertEqual(
+                (hasher.time_cost, hasher.memory_cost, hasher.parallelism),
+                (3, 8192, 2))
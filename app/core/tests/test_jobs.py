@@ -0,0 +1,137 @@
+from io import StringIO
+from unittest.mock import patch
+
+from core import jobs
+from core.models import Job
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+calls = []
+
+
+@jobs.task('tests.record')
+def record(value):
+    calls.append(value)
+
+
+@jobs.task('tests.fail')
+def fail():
+    raise RuntimeError('boom')
+
+
+@jobs.task('tests.in_transaction')
+def in_transaction():
+    calls.append(connection.in_atomic_block)
+
+
+@jobs.task('tests.taken_over')
+def taken_over():
+    # Another worker claims the job after its lease expired
+    Job.objects.update(attempts=F('attempts') + 1)
+
+
+class JobTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_run_next(self):
+        """Test due jobs run with their payload and are deleted"""
+        jobs.enqueue('tests.record', {'value': 1})
+
+        job = jobs.run_next()
+
+        self.assertEqual(job.name, 'tests.record')
+        self.assertEqual(calls, [1])
+        self.assertFalse(Job.objects.exists())
+        self.assertIsNone(jobs.run_next())
+
+    def test_run_next_skips_future_jobs(self):
+        """Test jobs scheduled later are not run yet"""
+        jobs.enqueue(
+            'tests.record', {'value': 1},
+            run_at=timezone.now() + jobs.retry_delay(1))
+
+        self.assertIsNone(jobs.run_next())
+        self.assertEqual(calls, [])
+
+    @override_settings(JOB_MAX_ATTEMPTS=2)
+    def test_failed_job_retried(self):
+        """Test a failing job is retried with backoff, then kept failed"""
+        jobs.enqueue('tests.fail')
+
+        with self.assertLogs('core.jobs', 'ERROR'):
+            jobs.run_next()
+        job = Job.objects.get()
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.status, Job.Status.QUEUED)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('boom', job.last_error)
+
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs('core.jobs', 'ERROR'):
+            jobs.run_next()
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertIsNone(jobs.run_next())
+
+    def test_expired_lease_claimed_again(self):
+        """Test a job is claimed again once the lease of its worker expired"""
+        jobs.enqueue('tests.record', {'value': 1})
+        job = jobs.claim()
+        self.assertEqual(job.status, Job.Status.RUNNING)
+
+        self.assertIsNone(jobs.run_next())
+        Job.objects.update(run_at=timezone.now())
+        job = jobs.run_next()
+
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(calls, [1])
+        self.assertFalse(Job.objects.exists())
+
+    def test_taken_over_job_kept(self):
+        """Test a worker whose lease expired leaves the job to the next"""
+        jobs.enqueue('tests.taken_over')
+
+        jobs.run_next()
+
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.Status.RUNNING)
+        self.assertEqual(job.attempts, 2)
+
+    def test_retry_delay_doubles(self):
+        """Test the delay between attempts doubles"""
+        self.assertEqual(jobs.retry_delay(3), 4 * jobs.retry_delay(1))
+
+
+class RunWorkersTests(TransactionTestCase):
+
+    def test_task_runs_outside_transaction(self):
+        """Test no transaction is held open while a task runs"""
+        calls.clear()
+        jobs.enqueue('tests.in_transaction')
+
+        jobs.run_next()
+
+        self.assertEqual(calls, [False])
+
+    def test_run_workers_burst(self):
+        """Test the workers run every due job and exit when idle"""
+        calls.clear()
+        for value in range(10):
+            jobs.enqueue('tests.record', {'value': value})
+
+        # Without SKIP LOCKED (SQLite) concurrent workers can claim the
+        # same job
+        skip_locked = connection.features.has_select_for_update_skip_locked
+        workers = 3 if skip_locked else 1
+        with patch.object(jobs, 'autodiscover'):
+            call_command(
+                'run_workers', workers=workers, burst=True, stdout=StringIO())
+
+        self.assertEqual(sorted(calls), list(range(10)))
+        self.assertFalse(Job.objects.exists())
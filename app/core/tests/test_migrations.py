@@ -0,0 +1,51 @@
+import datetime
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+
+class MigrationTests(TransactionTestCase):
+    """Runs migrations from a past state of the core app"""
+    migrate_from = ('core', '0010_compra_value_cents')
+    migrate_to = ('core', '0011_backfill_compra_value_cents')
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        if self.migrate_from not in executor.loader.graph.nodes:
+            self.skipTest('core migrations are disabled')
+        self.latest = executor.loader.graph.leaf_nodes('core')
+        executor.migrate([self.migrate_from])
+        self.apps = executor.loader.project_state(
+            [self.migrate_from]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.latest)
+
+    def migrate(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([self.migrate_to])
+        return executor.loader.project_state([self.migrate_to]).apps
+
+    def test_backfill_rounds_half_cents_up(self):
+        """Test the value_cents backfill rounds like to_cents"""
+        User = self.apps.get_model('core', 'User')
+        Compra = self.apps.get_model('core', 'Compra')
+        user = User.objects.create(email='backfill@grupoboticario.com.br')
+        # The historical Revendedor still subclasses User, insert its row
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO core_revendedor (user_id, cpf, name) '
+                'VALUES (%s, %s, %s)', [user.id, '87009110034', 'backfill'])
+        # 1.005 is stored as 1.00499999..., so value * 100 rounds to 100
+        compra = Compra.objects.create(
+            code=1, value=1.005, date=datetime.date(2021, 8, 1),
+            revendedor_id=user.id)
+
+        apps = self.migrate()
+
+        compra = apps.get_model('core', 'Compra').objects.get(id=compra.id)
+        self.assertEqual(compra.value_cents, 101)
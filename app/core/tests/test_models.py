@@ -90,10 +90,11 @@ class ModelTests(TestCase):
 
     def test_create_new_superuser(self):
         """Test creating a new superuser"""
-        user = get_user_model().objects.create_superuser(
-            email='teste@grupoboticario.com.br',
-            password='pass123'
-        )
+        with self.assertNumQueries(1):
+            user = get_user_model().objects.create_superuser(
+                email='teste@grupoboticario.com.br',
+                password='pass123'
+            )
 
         self.assertTrue(user.is_superuser)
         self.assertTrue(user.is_staff)
@@ -317,4 +318,19 @@ class ModelTests(TestCase):
         compra = sample_compra()
 
         self.assertEqual(compra.status, Status.EM_VALIDACAO.value)
+
+    def test_compra_value_stored_in_cents(self):
+        """Test the purchase value is stored as exact integer cents"""
+        compra = sample_compra(value=1000.01)
+        compra.refresh_from_db()
+
+        self.assertEqual(compra.value_cents, 100001)
+        self.assertEqual(compra.value, 1000.01)
+
+    def test_compra_cashback_value_rounding(self):
+        """Test the cashback value is rounded half up on exact cents"""
+        compra = sample_compra(value=0.05)
+
+        self.assertEqual(compra.cashback_percent, 10)
+        self.assertEqual(compra.cashback_value, 0.01)
     # endregion
@@ -0,0 +1,199 @@
+import datetime
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from core import outbox, reconciliation
+from core.models import Compra, OutboxEvent, OutboxOffset, Revendedor
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+CASHBACK_URL = reverse('cashback:compra-list')
+
+
+def detail_url(pk):
+    return reverse('cashback:compra-detail', args=[pk])
+
+
+class FailingSink:
+
+    def send(self, events):
+        raise ConnectionError('down')
+
+
+class OutboxTests(TransactionTestCase):
+    """Commits every change, as the relay only sees committed events"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='outbox@grupoboticario.com.br', password='pass1234')
+        self.revendedor = Revendedor.objects.create(
+            user=self.user, cpf='870.091.100-34', name='outbox')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        handle, self.path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+    def create_purchase(self, code=1):
+        return self.client.post(CASHBACK_URL, {
+            'code': code,
+            'value': 10.5,
+            'date': datetime.date.today(),
+            'revendedor': self.revendedor.pk,
+        })
+
+    def events(self):
+        return list(OutboxEvent.objects.order_by('id').values_list(
+            'event', 'key', 'payload'))
+
+    def relayed(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_purchase_changes_write_events(self):
+        """Test create, update and delete write their outbox events"""
+        res = self.create_purchase()
+        self.create_purchase()
+        pk = res.data['id']
+        self.client.put(detail_url(pk), {
+            'code': 1,
+            'value': 20.0,
+            'date': datetime.date.today(),
+            'revendedor': self.revendedor.pk,
+        })
+        res = self.client.delete(detail_url(pk))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        events = self.events()
+        self.assertEqual(
+            [(event, key) for event, key, _ in events],
+            [('created', '1'), ('updated', '1'), ('deleted', '1')])
+        self.assertEqual(events[0][2], {
+            'id': pk,
+            'code': 1,
+            'value': 10.5,
+            'date': datetime.date.today().isoformat(),
+            'revendedor': self.revendedor.pk,
+            'status': 1,
+        })
+        self.assertEqual(events[1][2]['value'], 20.0)
+
+    def test_reconciliation_writes_events(self):
+        """Test only purchases changed by a decision get an event"""
+        self.create_purchase(1)
+        self.create_purchase(2)
+        Compra.objects.filter(code=2).update(status=2)
+
+        reconciliation.apply_decisions([(1, 2), (2, 2)])
+
+        self.assertEqual(
+            [(event, key, payload['status'])
+             for event, key, payload in self.events()[2:]],
+            [('status_changed', '1', 2)])
+
+    def test_relay_command(self):
+        """Test the relay sends each event once and saves the offset"""
+        self.create_purchase(1)
+        self.create_purchase(2)
+
+        for _ in range(2):
+            call_command(
+                'relay_outbox', 'finance', 'file:%s' % self.path,
+                batch_size=1, stderr=StringIO())
+
+        self.assertEqual(
+            [event['key'] for event in self.relayed()], ['1', '2'])
+        self.assertEqual(
+            OutboxOffset.objects.get(consumer='finance').position,
+            OutboxEvent.objects.latest('id').id)
+
+    def test_relay_keeps_offset_when_sink_fails(self):
+        """Test events are sent again when the sink failed"""
+        self.create_purchase()
+
+        with self.assertRaises(ConnectionError):
+            outbox.relay_batch('finance', FailingSink())
+
+        self.assertEqual(outbox.relay_batch(
+            'finance', outbox.FileSink(self.path)), 1)
+
+    def begin(self):
+        """Opens another connection and starts a transaction with an id"""
+        pg = connection.get_new_connection(
+            connection.get_connection_params())
+        self.addCleanup(pg.close)
+        cursor = pg.cursor()
+        cursor.execute('SELECT txid_current()')
+        return pg, cursor
+
+    def insert_event(self, cursor, key):
+        cursor.execute(
+            "INSERT INTO core_outboxevent "
+            "(topic, event, key, payload, created_at, txid) "
+            "VALUES ('compra', 'created', %s, '{}', now(), txid_current())",
+            [key])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Requires PostgreSQL')
+    def test_relay_lower_id_committed_later(self):
+        """
+        Test an event committed after a higher id was relayed is still
+        relayed
+        """
+        first, first_cursor = self.begin()
+        second, second_cursor = self.begin()
+        self.insert_event(second_cursor, 'lower id')
+        self.insert_event(first_cursor, 'higher id')
+        first.commit()
+        sink = outbox.FileSink(self.path)
+
+        self.assertEqual(outbox.relay_batch('finance', sink), 1)
+        second.commit()
+        self.assertEqual(outbox.relay_batch('finance', sink), 1)
+        self.assertEqual(
+            [event['key'] for event in self.relayed()],
+            ['higher id', 'lower id'])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Requires PostgreSQL')
+    def test_relay_waits_for_running_transactions(self):
+        """
+        Test events are held while an older transaction is running, and
+        relayed in order once it committed
+        """
+        older, older_cursor = self.begin()
+        self.insert_event(older_cursor, 'older')
+        self.create_purchase()
+        sink = outbox.FileSink(self.path)
+
+        self.assertEqual(outbox.relay_batch('finance', sink), 0)
+        older.commit()
+        self.assertEqual(outbox.relay_batch('finance', sink), 2)
+        self.assertEqual(
+            [event['key'] for event in self.relayed()], ['older', '1'])
+
+    def test_prune(self):
+        """Test events are deleted once every consumer received them"""
+        self.create_purchase(1)
+        outbox.relay_batch('finance', outbox.FileSink(self.path))
+        OutboxOffset.objects.create(consumer='provider')
+
+        self.assertEqual(outbox.prune(), 0)
+        outbox.relay_batch('provider', outbox.FileSink(self.path))
+        self.assertEqual(outbox.prune(), 1)
+
+    @patch('requests.Session.post')
+    def test_http_sink(self, post):
+        """Test the HTTP sink posts the batch"""
+        outbox.get_sink('http://finance.local/events').send([{'id': 1}])
+
+        post.assert_called_once_with(
+            'http://finance.local/events', json={'events': [{'id': 1}]},
+            timeout=10)
@@ -0,0 +1,143 @@
+import datetime
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from core import partitioning
+from core.models import Compra, Revendedor, next_month
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+CASHBACK_URL = reverse('cashback:compra-list')
+
+
+class PartitioningTests(SimpleTestCase):
+
+    def test_partition_name(self):
+        """Test the partition name of a month"""
+        self.assertEqual(
+            partitioning.partition_name(datetime.date(2021, 8, 15)),
+            'core_compra_p2021_08')
+
+    def test_partition_sql_bounds(self):
+        """Test a partition covers exactly one month"""
+        sql = partitioning.partition_sql(datetime.date(2021, 12, 31))
+
+        self.assertIn('core_compra_p2021_12 PARTITION OF core_compra', sql)
+        self.assertIn("FROM ('2021-12-01') TO ('2022-01-01')", sql)
+
+    def test_months_between(self):
+        """Test every month of a range is listed once"""
+        months = list(partitioning.months_between(
+            datetime.date(2021, 11, 20), datetime.date(2022, 2, 1)))
+
+        self.assertEqual(months, [
+            datetime.date(2021, 11, 1),
+            datetime.date(2021, 12, 1),
+            datetime.date(2022, 1, 1),
+            datetime.date(2022, 2, 1),
+        ])
+
+    @patch('core.partitioning.is_supported', return_value=False)
+    def test_command_requires_postgresql(self, supported):
+        """Test the command refuses to run on unsupported databases"""
+        with self.assertRaises(CommandError):
+            call_command('partition_compra', 'create', stdout=StringIO())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Requires PostgreSQL')
+@override_settings(COMPRA_PARTITIONING=True)
+class ConvertTests(TestCase):
+    """Converts core_compra inside the test transaction"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            email='partition@grupoboticario.com.br', password='pass1234')
+        self.revendedor = Revendedor.objects.create(
+            user=user, cpf='870.091.100-34', name='partition')
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+        self.today = datetime.date.today()
+
+    def sample_compra(self, code, date):
+        return Compra.objects.create(
+            code=code, value=10.0, date=date, revendedor=self.revendedor)
+
+    def partition_of(self, compra):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT tableoid::regclass::text FROM core_compra '
+                'WHERE id = %s', [compra.id])
+            return cursor.fetchone()[0]
+
+    def test_convert_keeps_purchases(self):
+        """Test converting moves every purchase to its month partition"""
+        old = self.sample_compra(1, datetime.date(2021, 8, 15))
+        new = self.sample_compra(2, self.today)
+
+        partitioning.convert(months_ahead=1)
+
+        self.assertTrue(partitioning.is_partitioned())
+        self.assertEqual(self.partition_of(old), 'core_compra_p2021_08')
+        self.assertEqual(
+            self.partition_of(new), partitioning.partition_name(self.today))
+        self.assertEqual(
+            Compra.objects.in_month(2021, 8).get().id, old.id)
+
+    def test_convert_keeps_index_names(self):
+        """Test the partitioned table has the indexes of the model"""
+        partitioning.convert(months_ahead=1)
+
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, 'core_compra')
+        for index in Compra._meta.indexes:
+            self.assertEqual(
+                constraints[index.name]['columns'],
+                partitioning.index_columns(index))
+
+    def test_duplicate_code_after_convert(self):
+        """Test duplicated codes are still rejected once partitioned"""
+        self.sample_compra(1, datetime.date(2021, 8, 15))
+        partitioning.convert(months_ahead=1)
+        payload = {
+            'code': 1,
+            'value': 20.0,
+            'date': self.today,
+            'revendedor': self.revendedor.pk
+        }
+
+        res = self.client.post(CASHBACK_URL, payload)
+        payload['code'] = 2
+        first = self.client.post(CASHBACK_URL, payload)
+        retry = self.client.post(CASHBACK_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('code', res.data)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(Compra.objects.count(), 2)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.sample_compra(1, self.today)
+
+    def test_create_partition_moves_default_rows(self):
+        """Test creating a partition moves its rows out of the default"""
+        partitioning.convert(months_ahead=0)
+        month = next_month(next_month(self.today))
+        compra = self.sample_compra(1, month)
+        self.assertEqual(
+            self.partition_of(compra), partitioning.DEFAULT_PARTITION)
+
+        created = partitioning.ensure_future_partitions(2)
+
+        self.assertIn(partitioning.partition_name(month), created)
+        self.assertEqual(
+            self.partition_of(compra), partitioning.partition_name(month))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.sample_compra(1, self.today)
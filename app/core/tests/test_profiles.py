@@ -0,0 +1,57 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+# Prints the status of a few paths in a process using a settings profile
+PROBE_SCRIPT = '''
+import json
+import django
+from django.conf import settings
+django.setup()
+from django.test import Client
+from django.test.utils import setup_test_environment
+setup_test_environment()
+client = Client()
+print(json.dumps({
+    'apps': settings.INSTALLED_APPS,
+    'middleware': settings.MIDDLEWARE,
+    'api': client.get('/api/cashback/cashback/').status_code,
+    'admin': client.get('/admin/login/').status_code,
+}))
+'''
+
+
+def probe(profile):
+    """Returns the settings and statuses of a process using profile"""
+    env = dict(
+        os.environ, DJANGO_PROFILE=profile, THROTTLE_ENABLED='0',
+        SECRET_KEY=os.environ.get('SECRET_KEY') or 'profile-test')
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE_SCRIPT], env=env, check=True,
+        cwd=settings.BASE_DIR, stdout=subprocess.PIPE).stdout
+    return json.loads(out.decode().splitlines()[-1])
+
+
+class ProfileTests(SimpleTestCase):
+
+    def test_api_profile(self):
+        """Test the api profile serves the API without the admin stack"""
+        result = probe('api')
+
+        self.assertEqual(result['api'], 401)
+        self.assertEqual(result['admin'], 404)
+        self.assertNotIn('django.contrib.sessions', result['apps'])
+        self.assertNotIn(
+            'django.middleware.csrf.CsrfViewMiddleware', result['middleware'])
+
+    def test_admin_profile(self):
+        """Test the admin profile only serves the admin"""
+        result = probe('admin')
+
+        self.assertEqual(result['api'], 404)
+        self.assertIn('django.contrib.admin', result['apps'])
@@ -0,0 +1,150 @@
+import datetime
+import threading
+from io import StringIO
+from unittest import skipUnless
+
+from core import rankings
+from core.archive import archive_month
+from core.models import Compra, MonthlyRanking, Revendedor
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+LEADERBOARD_URL = reverse('cashback:compra-leaderboard')
+MONTH = datetime.date(2021, 8, 1)
+
+
+def sample_revendedor(name, cpf):
+    user = get_user_model().objects.create_user(
+        email='%s@grupoboticario.com.br' % name, password='pass1234')
+    return Revendedor.objects.create(user=user, cpf=cpf, name=name)
+
+
+class RankingTests(TestCase):
+
+    def setUp(self):
+        self.first = sample_revendedor('first', '945.086.080-78')
+        self.second = sample_revendedor('second', '865.550.330-45')
+        self.tied = sample_revendedor('tied', '077.282.440-19')
+        purchases = (
+            (1, 300.0, MONTH, self.first),
+            (2, 200.0, MONTH.replace(day=15), self.first),
+            (3, 100.0, MONTH, self.second),
+            (4, 100.0, MONTH, self.tied),
+            (5, 999.0, MONTH.replace(month=9), self.tied),
+        )
+        for code, value, date, revendedor in purchases:
+            Compra.objects.create(
+                code=code, value=value, date=date, revendedor=revendedor)
+
+    def test_refresh_month(self):
+        """Test a month is ranked by total, ties sharing their rank"""
+        self.assertEqual(rankings.refresh_month(MONTH), 3)
+
+        top = rankings.top(MONTH, 10)
+
+        self.assertEqual(
+            [(r.rank, r.revendedor_id, r.total_cents) for r in top], [
+                (1, self.first.pk, 50000),
+                (2, self.second.pk, 10000),
+                (2, self.tied.pk, 10000),
+            ])
+        self.assertEqual(top[0].purchase_count, 2)
+
+    def test_refresh_replaces_ranking(self):
+        """Test refreshing a month again replaces its ranking"""
+        rankings.refresh_month(MONTH)
+        Compra.objects.create(
+            code=6, value=1000.0, date=MONTH, revendedor=self.second)
+
+        rankings.refresh_month(MONTH)
+
+        self.assertEqual(MonthlyRanking.objects.filter(month=MONTH).count(), 3)
+        self.assertEqual(rankings.rank_of(MONTH, self.second).rank, 1)
+
+    def test_refresh_archived_month(self):
+        """Test archived months are ranked from their summaries"""
+        archive_month(MONTH)
+
+        rankings.refresh_month(MONTH)
+
+        self.assertEqual(rankings.rank_of(MONTH, self.first).rank, 1)
+        self.assertEqual(rankings.rank_of(MONTH, self.tied).total_cents, 10000)
+
+    def test_refresh_rankings_command(self):
+        """Test the command ranks the given month"""
+        out = StringIO()
+        call_command('refresh_rankings', month='2021-09', stdout=out)
+
+        self.assertIn('2021-09: 1 revendedores ranked', out.getvalue())
+        self.assertEqual(
+            rankings.rank_of(MONTH.replace(month=9), self.tied).rank, 1)
+
+    def test_leaderboard(self):
+        """Test the leaderboard reads the top and a rank from the index"""
+        rankings.refresh_month(MONTH)
+        admin = get_user_model().objects.create_superuser(
+            email='admin@grupoboticario.com.br', password='pass1234')
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        with self.assertNumQueries(2):
+            res = client.get(LEADERBOARD_URL, {
+                'month': '2021-08', 'size': 2,
+                'revendedor': self.tied.pk})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['top'][0], {
+            'rank': 1,
+            'revendedor': self.first.pk,
+            'name': 'first',
+            'total': 500.0,
+            'purchase_count': 2,
+        })
+        self.assertEqual(len(res.data['top']), 2)
+        self.assertEqual(res.data['revendedor']['rank'], 2)
+
+    def test_leaderboard_admin_only(self):
+        """Test revendedores can not read the leaderboard"""
+        client = APIClient()
+        client.force_authenticate(self.first.user)
+
+        res = client.get(LEADERBOARD_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs concurrent writers')
+class ConcurrentRefreshTests(TransactionTestCase):
+
+    def test_concurrent_refreshes(self):
+        """Test refreshes of a month running together do not conflict"""
+        for code, cpf in enumerate(('945.086.080-78', '865.550.330-45')):
+            Compra.objects.create(
+                code=code, value=10.0, date=MONTH,
+                revendedor=sample_revendedor('r%d' % code, cpf))
+        errors = []
+        start = threading.Barrier(4)
+
+        def refresh():
+            try:
+                start.wait()
+                for _ in range(5):
+                    rankings.refresh_month(MONTH)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=refresh) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(MonthlyRanking.objects.filter(month=MONTH).count(), 2)
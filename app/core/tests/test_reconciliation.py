@@ -0,0 +1,95 @@
+import datetime
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from core import archive, reconciliation
+from core.models import Compra, CompraArchive, MonthlySummary, Revendedor
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+
+def sample_revendedor(email='reconcile@grupoboticario.com.br',
+                      cpf='870.091.100-34'):
+    """Creates a sample revendedor"""
+    user = get_user_model().objects.create_user(
+        email=email, password='pass1234')
+    return Revendedor.objects.create(user=user, cpf=cpf, name='reconcile')
+
+
+class ReconciliationTests(TestCase):
+
+    def setUp(self):
+        self.revendedor = sample_revendedor()
+        self.old = datetime.date(2019, 3, 1)
+        today = datetime.date.today()
+        for code, date in ((1, self.old), (2, today), (3, today)):
+            Compra.objects.create(
+                code=code, value=100.0, date=date,
+                revendedor=self.revendedor)
+        archive.archive_month(self.old)
+
+    def statuses(self):
+        return dict(Compra.objects.values_list('code', 'status'))
+
+    def test_parse_status(self):
+        """Test statuses are parsed by value or by name"""
+        self.assertEqual(reconciliation.parse_status('2'), 2)
+        self.assertEqual(reconciliation.parse_status('nao_aprovado'), 3)
+        with self.assertRaises(ValueError):
+            reconciliation.parse_status('4')
+
+    def test_apply_decisions(self):
+        """Test decisions update live and archived purchases"""
+        stats = reconciliation.apply_decisions(
+            [(1, 2), (2, 2), (3, 3), (99, 2)], chunk_size=2)
+
+        self.assertEqual(self.statuses(), {2: 2, 3: 3})
+        self.assertEqual(CompraArchive.objects.get(code=1).status, 2)
+        summary = MonthlySummary.objects.get(
+            revendedor=self.revendedor, month=self.old)
+        self.assertEqual(summary.aprovado_count, 1)
+        self.assertEqual(summary.em_validacao_count, 0)
+        self.assertEqual(
+            (stats['decisions'], stats['updated'], stats['archived']),
+            (4, 2, 1))
+
+    def test_apply_decisions_again(self):
+        """Test applying the same decisions again updates nothing"""
+        reconciliation.apply_decisions([(2, 2), (3, 3)])
+
+        # one UPDATE and one archive lookup per status, in a savepoint
+        with self.assertNumQueries(6):
+            stats = reconciliation.apply_decisions([(2, 2), (3, 3)])
+
+        self.assertEqual(stats['updated'], 0)
+
+    def test_reconcile_command_file(self):
+        """Test the command applies a CSV file and skips invalid rows"""
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w') as f:
+            f.write('code,status\n2,APROVADO\n3,2\nx,2\n3,9\n')
+        self.addCleanup(os.remove, path)
+        out = StringIO()
+
+        call_command('reconcile_statuses', file=path, stdout=out)
+
+        self.assertEqual(self.statuses(), {2: 2, 3: 2})
+        self.assertIn('2 invalid decisions skipped', out.getvalue())
+
+    @patch('requests.Session.get')
+    def test_reconcile_command_url(self, get):
+        """Test the command follows the pages of the decision service"""
+        get.return_value.json.side_effect = [
+            {'decisions': [{'code': 2, 'status': 2}], 'next': '/page/2'},
+            {'decisions': [{'code': 3, 'status': 3}], 'next': None},
+        ]
+
+        call_command(
+            'reconcile_statuses', url='http://decisions.local/',
+            stdout=StringIO())
+
+        self.assertEqual(self.statuses(), {2: 2, 3: 3})
+        self.assertEqual(get.call_count, 2)
@@ -0,0 +1,74 @@
+import datetime
+import io
+from decimal import Decimal
+from unittest.mock import patch
+
+from core import parsers, renderers
+from django.test import SimpleTestCase
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+
+class RendererTests(SimpleTestCase):
+
+    def setUp(self):
+        self.data = [{
+            'id': 1,
+            'code': 10,
+            'value': 135.9,
+            'date': datetime.date(2021, 8, 1),
+            'created': datetime.datetime(
+                2021, 8, 1, 10, 30, 15, 123456,
+                tzinfo=datetime.timezone.utc),
+            'amount': Decimal('1000.01'),
+            'status_str': 'Em validação',
+        }]
+
+    def test_render_same_output_as_json_renderer(self):
+        """Test orjson output is byte-identical to the DRF renderer"""
+        self.assertEqual(
+            renderers.ORJSONRenderer().render(self.data),
+            JSONRenderer().render(self.data))
+
+    def test_render_dates_and_decimals(self):
+        """Test dates, datetimes and decimals are encoded"""
+        res = renderers.ORJSONRenderer().render(self.data)
+
+        self.assertIn(b'"date":"2021-08-01"', res)
+        self.assertIn(b'"created":"2021-08-01T10:30:15.123456Z"', res)
+        self.assertIn(b'"amount":1000.01', res)
+
+    def test_render_none(self):
+        """Test rendering None returns an empty body"""
+        self.assertEqual(renderers.ORJSONRenderer().render(None), b'')
+
+    def test_render_without_orjson(self):
+        """Test the renderer falls back to json when orjson is missing"""
+        with patch.object(renderers, 'orjson', None):
+            res = renderers.ORJSONRenderer().render(self.data)
+
+        self.assertEqual(res, JSONRenderer().render(self.data))
+
+
+class ParserTests(SimpleTestCase):
+
+    def test_parse_same_output_as_json_parser(self):
+        """Test orjson parsing matches the DRF parser"""
+        body = '{"code": 1, "value": 135.9, "name": "ção"}'.encode()
+
+        self.assertEqual(
+            parsers.ORJSONParser().parse(io.BytesIO(body)),
+            JSONParser().parse(io.BytesIO(body)))
+
+    def test_parse_invalid_json(self):
+        """Test invalid JSON raises a parse error"""
+        with self.assertRaises(ParseError):
+            parsers.ORJSONParser().parse(io.BytesIO(b'{"code": '))
+
+    def test_parse_without_orjson(self):
+        """Test the parser falls back to json when orjson is missing"""
+        with patch.object(parsers, 'orjson', None):
+            res = parsers.ORJSONParser().parse(io.BytesIO(b'{"code": 1}'))
+
+        self.assertEqual(res, {'code': 1})
@@ -0,0 +1,44 @@
+import threading
+import time
+
+from core.singleflight import SingleFlight
+from django.test import SimpleTestCase
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def test_concurrent_calls_share_result(self):
+        """Test concurrent calls of a key run the function once"""
+        flights = SingleFlight()
+        calls = []
+        results = []
+
+        def slow(value):
+            calls.append(value)
+            time.sleep(0.1)
+            return value * 2
+
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(flights.do('a', slow, 21)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, [21])
+        self.assertEqual(results, [42] * 5)
+
+    def test_errors_shared_and_not_kept(self):
+        """Test the error of a call is raised, then the key runs again"""
+        flights = SingleFlight()
+
+        def fail():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            flights.do('a', fail)
+        self.assertEqual(flights.do('a', lambda: 1), 1)
+        self.assertEqual(flights.calls, {})
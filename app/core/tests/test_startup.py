@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+import time
+from io import StringIO
+from unittest import skipUnless
+
+from core.management.commands.importtime import parse_importtime
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+
+# Wall clock budgets depend on the machine: their tests only run with
+# PERFORMANCE_TESTS=1
+PERFORMANCE_TESTS = bool(os.environ.get('PERFORMANCE_TESTS'))
+
+# Seconds a fresh worker may take to answer its first request
+BOOT_TIME_BUDGET = float(os.environ.get('BOOT_TIME_BUDGET', 3))
+
+# Boots the WSGI application and serves one request, printing its status
+FIRST_REQUEST_SCRIPT = '''
+from io import BytesIO
+from app.wsgi import application
+statuses = []
+application({
+    'REQUEST_METHOD': 'GET',
+    'PATH_INFO': '/api/cashback/cashback/',
+    'SERVER_NAME': 'localhost',
+    'SERVER_PORT': '80',
+    'HTTP_HOST': 'localhost',
+    'wsgi.input': BytesIO(),
+    'wsgi.url_scheme': 'http',
+}, lambda status, headers: statuses.append(status))
+print(statuses[0])
+'''
+
+
+class StartupTests(SimpleTestCase):
+
+    @skipUnless(PERFORMANCE_TESTS, 'Set PERFORMANCE_TESTS=1 to run')
+    def test_boot_to_first_request(self):
+        """Test a fresh worker answers its first request within budget"""
+        env = dict(
+            os.environ, DEBUG='1', THROTTLE_ENABLED='0',
+            SECRET_KEY=os.environ.get('SECRET_KEY') or 'startup-test')
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+        start = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, '-c', FIRST_REQUEST_SCRIPT], env=env,
+            cwd=settings.BASE_DIR, check=True,
+            stdout=subprocess.PIPE).stdout
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(out.decode().split()[0], '401')
+        self.assertLess(elapsed, BOOT_TIME_BUDGET)
+
+    def test_importtime_budget(self):
+        """Test the importtime command fails over its budget"""
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, 'the budget is 1.0 ms'):
+            call_command('importtime', budget=1, top=3, stdout=out)
+
+        self.assertIn('Import time by package', out.getvalue())
+
+    def test_parse_importtime(self):
+        """Test the -X importtime output is parsed by module"""
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |   json.decoder\n'
+            'import time:       300 |        420 | json\n'
+        )
+
+        self.assertEqual(parse_importtime(output), [
+            ('json.decoder', 120, 120),
+            ('json', 300, 420),
+        ])
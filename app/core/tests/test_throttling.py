@@ -0,0 +1,154 @@
+import sys
+import threading
+
+from core import checks, throttling
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+EXTERNAL_URL = reverse('cashback:compra-accumulated-cashback')
+CREATE_USER_URL = reverse('user:create')
+
+
+class SlidingWindowTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_parse_rate(self):
+        """Test a rate is parsed into its calls and period in seconds"""
+        self.assertEqual(throttling.parse_rate('120/m'), (120, 60))
+        self.assertEqual(throttling.parse_rate('5/sec'), (5, 1))
+
+    def test_window_slides(self):
+        """Test calls of the previous window count as it slides out"""
+        bucket = [('test', '2/m')]
+
+        self.assertEqual(throttling.take(bucket, now=0), 0)
+        self.assertEqual(throttling.take(bucket, now=0), 0)
+        self.assertEqual(throttling.take(bucket, now=0), 90)
+        # Half the previous window slid out: one of its calls counts
+        self.assertEqual(throttling.take(bucket, now=90), 0)
+        self.assertEqual(throttling.take(bucket, now=90), 30)
+        self.assertEqual(throttling.take(bucket, now=120), 0)
+
+    def test_no_burst_across_windows(self):
+        """Test a full window keeps the start of the next one limited"""
+        bucket = [('test', '10/m')]
+        for _ in range(10):
+            self.assertEqual(throttling.take(bucket, now=59), 0)
+
+        self.assertGreater(throttling.take(bucket, now=60), 0)
+        self.assertGreater(throttling.take(bucket, now=65), 0)
+
+    def test_throttled_take_keeps_calls(self):
+        """Test no window counts a call when one of them is full"""
+        throttling.take([('full', '1/m')], now=0)
+
+        wait = throttling.take([('empty', '1/m'), ('full', '1/m')], now=0)
+
+        self.assertEqual(wait, 120)
+        self.assertEqual(throttling.take([('empty', '1/m')], now=0), 0)
+
+    def test_per_process_cache_warned(self):
+        """Test the deploy check warns when limits are not shared"""
+        warnings = checks.check_shared_cache(None)
+        self.assertEqual([warning.id for warning in warnings], ['core.W001'])
+
+        with override_settings(
+                THROTTLE_ENABLED=False, CASHBACK_PROVIDER_RATE=''):
+            self.assertEqual(checks.check_shared_cache(None), [])
+
+    def test_concurrent_takes_within_rate(self):
+        """Test threads racing on a window are granted the rate only"""
+        granted = []
+        start = threading.Barrier(8)
+
+        def worker():
+            start.wait()
+            for _ in range(100):
+                if not throttling.take([('race', '400/m')], now=0):
+                    granted.append(1)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        # Switch threads often, as workers running in parallel would
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+
+        self.assertEqual(len(granted), 400)
+
+
+@override_settings(THROTTLE_ENDPOINT_RATES={
+    'cashback:compra-accumulated-cashback': '1/m',
+    'user:create': '1/m',
+})
+class ThrottleMiddlewareTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email='throttle@grupoboticario.com.br', password='pass1234')
+        self.client = APIClient()
+
+    def authenticate(self, user):
+        token = RefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % token)
+
+    def test_throttled_before_database(self):
+        """Test a throttled request gets a 429 without any query"""
+        self.authenticate(self.user)
+        self.client.get(EXTERNAL_URL)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(EXTERNAL_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # Until the call slides out of the endpoint rate period
+        self.assertIn(int(res['Retry-After']), range(1, 121))
+
+    def test_buckets_per_user(self):
+        """Test every user has its own endpoint bucket"""
+        other = get_user_model().objects.create_user(
+            email='other@grupoboticario.com.br', password='pass1234')
+        self.authenticate(self.user)
+        self.client.get(EXTERNAL_URL)
+
+        self.authenticate(other)
+        res = self.client.get(EXTERNAL_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(THROTTLE_RATES={
+        'user': '100/m', 'anon': '100/m', 'cpf': '1/m'})
+    def test_buckets_per_cpf(self):
+        """Test the balance of a CPF is limited whoever asks it"""
+        throttling.take([('cpf:94508608078', '1/m')])
+        self.authenticate(self.user)
+
+        res = self.client.get(EXTERNAL_URL, {'cpf': '945.086.080-78'})
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_anonymous_by_address(self):
+        """Test anonymous requests are limited by client address"""
+        payload = {'email': 'new@grupoboticario.com.br', 'password': 'x'}
+        self.client.post(CREATE_USER_URL, payload)
+
+        res = self.client.post(
+            CREATE_USER_URL, payload, REMOTE_ADDR='10.0.0.2')
+        throttled = self.client.post(CREATE_USER_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            throttled.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
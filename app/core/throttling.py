@@ -0,0 +1,168 @@
+"""
+Sliding window rate limiting kept in the shared cache
+
+A rate 'N/period' (period s, m, h or d, as DRF rates) grants N calls per
+sliding period. The calls of each window of a period are a counter in
+the default cache, created by add and counted by incr, both atomic: the
+workers racing on the last call of a period never all get it. A call is
+granted when the calls of the current window, plus those of the previous
+window weighted by how much of it the sliding period still covers, are
+within N. Unlike fixed windows, a burst at the end of a window is still
+counted at the start of the next one, rather than allowing 2N.
+
+The counters are shared by the workers only when CACHES is (memcached,
+redis): with the default per process cache every limit, the provider
+rate included, applies per process. `manage.py check --deploy` warns
+about it.
+
+ThrottleMiddleware checks the THROTTLE_RATES buckets of a request before
+its view runs: per user (read from the JWT, without the database) or per
+client address when anonymous, per CPF asked, and per user and endpoint
+for the THROTTLE_ENDPOINT_RATES views. A throttled request is answered
+429 with a Retry-After header, before any query.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """Returns (calls, period in seconds) of a rate"""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+def bucket_key(key):
+    return 'throttle:%s' % key
+
+
+def window_key(key, period, now):
+    """Returns the cache key counting the calls of the window of now"""
+    return '%s:%d' % (bucket_key(key), now // period)
+
+
+def count(key, timeout):
+    """Atomically adds a call to the counter key, returns the calls"""
+    cache.add(key, 0, timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Expired between add and incr
+        cache.add(key, 0, timeout)
+        return cache.incr(key)
+
+
+def sliding_wait(before, calls, limit, period, offset):
+    """
+    Returns the seconds until a call fits in the sliding period
+
+    `before` and `calls` are the calls granted in the previous and
+    current windows, `offset` the seconds elapsed in the current window.
+    """
+    if calls < limit:
+        # Room once enough calls of the previous window slid out
+        return period * (1 - (limit - calls - 1) / before) - offset
+    # Room in the next window, once enough of this one slid out
+    return period - offset + period * (1 - (limit - 1) / calls)
+
+
+def take(buckets, now=None):
+    """
+    Counts a call in the current window of every (key, rate) bucket
+
+    Returns 0 when every sliding period had room for it. Otherwise the
+    call is given back and the seconds until every period has room again
+    are returned.
+    """
+    now = time.time() if now is None else now
+    rates = [parse_rate(rate) for _, rate in buckets]
+    previous = cache.get_many([
+        window_key(key, period, now - period)
+        for (key, _), (_, period) in zip(buckets, rates)])
+    counted = []
+    wait = 0
+    for (key, _), (limit, period) in zip(buckets, rates):
+        before = previous.get(window_key(key, period, now - period), 0)
+        key = window_key(key, period, now)
+        # Kept as the previous window of the next one, and a second
+        # more against clock skew of workers
+        calls = count(key, 2 * period + 1)
+        counted.append(key)
+        offset = now % period
+        if before * (1 - offset / period) + calls > limit:
+            wait = max(wait, sliding_wait(
+                before, calls - 1, limit, period, offset))
+    if wait:
+        for key in counted:
+            try:
+                cache.decr(key)
+            except ValueError:
+                pass
+    return wait
+
+
+def get_user_id(request):
+    """Returns the user id of the request access token, None if invalid"""
+    header = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(header) != 2 or header[0] not in api_settings.AUTH_HEADER_TYPES:
+        return None
+    try:
+        return AccessToken(header[1]).get(api_settings.USER_ID_CLAIM)
+    except TokenError:
+        return None
+
+
+def request_buckets(request, view_name):
+    """Returns the (key, rate) buckets a request takes a token from"""
+    rates = settings.THROTTLE_RATES
+    user_id = get_user_id(request)
+    if user_id is not None:
+        ident = 'user:%s' % user_id
+        buckets = [(ident, rates['user'])]
+    else:
+        ident = 'anon:%s' % request.META.get('REMOTE_ADDR')
+        buckets = [(ident, rates['anon'])]
+
+    cpf = ''.join(c for c in request.GET.get('cpf', '') if c.isdigit())
+    if cpf:
+        buckets.append(('cpf:%s' % cpf, rates['cpf']))
+
+    if view_name in settings.THROTTLE_ENDPOINT_RATES:
+        buckets.append((
+            '%s:%s' % (view_name, ident),
+            settings.THROTTLE_ENDPOINT_RATES[view_name]))
+    return buckets
+
+
+class ThrottleMiddleware:
+    """Rejects the requests over the THROTTLE_RATES with a 429"""
+
+    def __init__(self, get_response):
+        if not settings.THROTTLE_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        wait = take(request_buckets(
+            request, request.resolver_match.view_name))
+        if not wait:
+            return None
+        seconds = math.ceil(wait)
+        response = JsonResponse({
+            'detail': 'Request was throttled. Expected available in '
+                      '%d seconds.' % seconds,
+        }, status=429)
+        response['Retry-After'] = str(seconds)
+        return response
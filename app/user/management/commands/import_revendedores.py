@@ -0,0 +1,241 @@
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
+
+import django
+from core.models import Revendedor
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from user.serializers import unique_error, violated_unique_field
+from user.validators import cpf_forms, is_valid_cpf, normalize_cpf
+
+REPORT_FIELDS = ('line', 'email', 'cpf', 'error')
+PASSWORD_MIN_LENGTH = 8
+
+
+def chunks(rows, size):
+    """Yields lists of up to `size` rows"""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def row_error(row):
+    """Returns why a CSV row can not be imported, or None"""
+    if not row['email']:
+        return 'You must provide an email!'
+    try:
+        validate_email(row['email'])
+    except ValidationError:
+        return 'Enter a valid email address.'
+    if not row['cpf']:
+        return 'You must provide a CPF!'
+    if not row['name']:
+        return 'You must provide a Name!'
+    if not is_valid_cpf(row['cpf']):
+        return 'You must provide a valid CPF!'
+    password = row['password']
+    if password is not None and len(password) < PASSWORD_MIN_LENGTH:
+        return 'Password must have at least %d characters.' % (
+            PASSWORD_MIN_LENGTH)
+    return None
+
+
+class Command(BaseCommand):
+    """
+    Django command to onboard revendedores in bulk from a CSV file
+
+    Usage: python manage.py import_revendedores <file> [--report FILE]
+
+    The CSV needs an email, cpf and name header and may have a password
+    column; rows without a password get an unusable one. The file is
+    streamed in chunks: each chunk is validated with two queries,
+    its passwords are hashed in a process pool and its users and
+    revendedores are inserted with bulk_create in one transaction.
+    Rejected rows are written to the error report.
+    """
+    help = 'Imports revendedores from a CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='CSV file, - for stdin')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Rows inserted per transaction')
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Password hashing processes, 0 hashes in this process')
+        parser.add_argument(
+            '--report', help='CSV file receiving the rejected rows')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] <= 0:
+            raise CommandError('--chunk-size must be greater than 0')
+        self.imported = 0
+        self.rejected = 0
+        start = time.perf_counter()
+
+        source = (
+            sys.stdin if options['file'] == '-'
+            else open(options['file'], newline='', encoding='utf-8'))
+        report = (
+            open(options['report'], 'w', newline='', encoding='utf-8')
+            if options['report'] else self.stderr)
+        try:
+            reader = csv.DictReader(source)
+            missing = {'email', 'cpf', 'name'} - set(reader.fieldnames or ())
+            if missing:
+                raise CommandError('Missing CSV columns: %s' % ', '.join(
+                    sorted(missing)))
+            self.report = csv.DictWriter(report, REPORT_FIELDS)
+            self.report.writeheader()
+            self.seen_emails = set()
+            self.seen_cpfs = set()
+            with self.executor(options['workers']) as self.pool:
+                rows = (
+                    self.clean(line, row)
+                    for line, row in enumerate(reader, start=2))
+                for chunk in chunks(rows, options['chunk_size']):
+                    self.import_chunk(chunk)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if options['report']:
+                report.close()
+
+        seconds = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            '%d revendedores imported, %d rows rejected in %.1f s '
+            '(%.0f rows/s)' % (
+                self.imported, self.rejected, seconds,
+                (self.imported + self.rejected) / seconds)))
+
+    def executor(self, workers):
+        """Returns the password hashing process pool"""
+        if workers == 0:
+            return nullcontext()
+        self.workers = workers or os.cpu_count() or 1
+        return ProcessPoolExecutor(
+            max_workers=self.workers, initializer=django.setup)
+
+    def clean(self, line, row):
+        """Normalizes a CSV row"""
+        email = (row.get('email') or '').strip()
+        return {
+            'line': line,
+            'email': email and get_user_model().objects.normalize_email(email),
+            'cpf': (row.get('cpf') or '').strip(),
+            'name': (row.get('name') or '').strip(),
+            'password': row.get('password') or None,
+        }
+
+    def reject(self, row, error):
+        self.rejected += 1
+        self.report.writerow({
+            'line': row['line'],
+            'email': row['email'],
+            'cpf': row['cpf'],
+            'error': error,
+        })
+
+    def validate(self, chunk):
+        """
+        Returns the rows of chunk that can be imported
+
+        CPFs are compared by their digits: 870.091.100-34 and
+        87009110034 are the same revendedor, in the file as in the
+        database, where either form may be stored.
+        """
+        rows = []
+        for row in chunk:
+            error = row_error(row)
+            if error is None and row['email'] in self.seen_emails:
+                error = 'Duplicated email in file.'
+            if error is None and normalize_cpf(row['cpf']) in self.seen_cpfs:
+                error = 'Duplicated CPF in file.'
+            if error:
+                self.reject(row, error)
+                continue
+            self.seen_emails.add(row['email'])
+            self.seen_cpfs.add(normalize_cpf(row['cpf']))
+            rows.append(row)
+
+        existing_emails = set(get_user_model().objects.filter(
+            email__in=[row['email'] for row in rows]
+        ).values_list('email', flat=True))
+        forms = [form for row in rows for form in cpf_forms(row['cpf'])]
+        existing_cpfs = {
+            normalize_cpf(cpf) for cpf in Revendedor.objects.filter(
+                cpf__in=forms).values_list('cpf', flat=True)}
+        valid = []
+        for row in rows:
+            if row['email'] in existing_emails:
+                self.reject(row, 'user with this email already exists.')
+            elif normalize_cpf(row['cpf']) in existing_cpfs:
+                self.reject(
+                    row, 'revendedor with this cpf already exists.')
+            else:
+                valid.append(row)
+        return valid
+
+    def import_chunk(self, chunk):
+        rows = self.validate(chunk)
+        if not rows:
+            return
+        passwords = self.hash_passwords([row['password'] for row in rows])
+        users = [
+            get_user_model()(email=row['email'], password=password)
+            for row, password in zip(rows, passwords)
+        ]
+        try:
+            with transaction.atomic():
+                self.insert(rows, users)
+            self.imported += len(rows)
+        except IntegrityError:
+            # Someone signed up with one of the emails or CPFs meanwhile:
+            # insert the chunk row by row to find out which
+            for row, user in zip(rows, users):
+                try:
+                    with transaction.atomic():
+                        user.pk = None
+                        self.insert([row], [user])
+                    self.imported += 1
+                except IntegrityError as error:
+                    field = violated_unique_field(error)
+                    if field is None:
+                        raise
+                    self.reject(row, unique_error(*field))
+
+    def hash_passwords(self, passwords):
+        """Hashes passwords in the process pool, keeping their order"""
+        if self.pool is None:
+            return [make_password(password) for password in passwords]
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self.pool.map(
+            make_password, passwords, chunksize=chunksize))
+
+    def insert(self, rows, users):
+        """Inserts the users and their revendedores"""
+        User = get_user_model()
+        users = User.objects.bulk_create(users)
+        if users[0].pk is None:
+            # The backend can not return the ids of a bulk insert
+            ids = dict(User.objects.filter(
+                email__in=[user.email for user in users]
+            ).values_list('email', 'id'))
+            for user in users:
+                user.pk = ids[user.email]
+        Revendedor.objects.bulk_create([
+            Revendedor(user=user, cpf=row['cpf'], name=row['name'])
+            for row, user in zip(rows, users)
+        ])
@@ -1,9 +1,65 @@
-from core.models import Revendedor
+from core.models import Revendedor, violated_constraint
 from django.contrib.auth import get_user_model
-from django.db import transaction
+from django.db import IntegrityError, connection, transaction
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers, status
 from rest_framework.exceptions import APIException
+from user.validators import calculate_cpf_digit, is_valid_cpf
+
+
+# Fields whose uniqueness signup leaves to the database constraints
+UNIQUE_FIELDS = ((get_user_model(), 'email'), (Revendedor, 'cpf'))
+
+
+def unique_error(model, field_name):
+    """Returns the message of a unique field, as its UniqueValidator does"""
+    field = model._meta.get_field(field_name)
+    return field.error_messages['unique'] % {
+        'model_name': model._meta.verbose_name,
+        'field_label': field.verbose_name,
+    }
+
+
+def violated_unique_field(error):
+    """
+    Returns the (model, field name) whose unique constraint an
+    IntegrityError violated, None when it is not email or CPF
+
+    The constraint is known by the name the database reports, looked up
+    in the constraints of the field table, so neither the language of
+    the message nor other constraints naming those columns matter.
+    """
+    name = violated_constraint(error)
+    if name is None:
+        return None
+    for model, field_name in UNIQUE_FIELDS:
+        with connection.cursor() as cursor:
+            constraint = connection.introspection.get_constraints(
+                cursor, model._meta.db_table).get(name)
+        if (constraint and constraint['unique'] and
+                constraint['columns'] == [
+                    model._meta.get_field(field_name).column]):
+            return model, field_name
+    return None
+
+
+def raise_unique_error(error):
+    """
+    Maps an IntegrityError of a signup to the unique field errors
+
+    Uniqueness of email and CPF is left to the database constraints, so
+    signup does not SELECT them first; a violation is reported with the
+    same messages the UniqueValidators gave. Other errors are raised.
+    """
+    field = violated_unique_field(error)
+    if field is None:
+        raise error
+    model, field_name = field
+    if field_name == 'email':
+        raise serializers.ValidationError({
+            'email': [unique_error(model, 'email')]})
+    raise serializers.ValidationError({
+        'revendedor': {'cpf': [unique_error(model, 'cpf')]}})
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -12,11 +68,18 @@ class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = get_user_model()
         fields = ('email', 'password')
-        extra_kwargs = {'password': {'write_only': True, 'min_length': 8}}
+        extra_kwargs = {
+            'email': {'validators': []},
+            'password': {'write_only': True, 'min_length': 8},
+        }
 
     def create(self, validated_data):
         """Create a new user with encrypted password and returns it"""
-        return get_user_model().objects.create_user(**validated_data)
+        try:
+            with transaction.atomic():
+                return get_user_model().objects.create_user(**validated_data)
+        except IntegrityError as error:
+            raise_unique_error(error)
 
     def update(self, instance, validated_data):
         """Updates an user, setting a new password"""
@@ -40,6 +103,8 @@ class RevendedorSerializer(serializers.ModelSerializer):
     class Meta:
         model = Revendedor
         fields = ('cpf', 'name',)
+        # CPF can not be updated, and signup relies on the unique constraint
+        extra_kwargs = {'cpf': {'validators': []}}
 
     def update(self, instance, validated_data):
         if validated_data.get('cpf', None):
@@ -57,64 +122,18 @@ class UserRevendedorSerializer(serializers.ModelSerializer):
     class Meta:
         model = get_user_model()
         fields = ('email', 'password', 'revendedor')
-        extra_kwargs = {'password': {'write_only': True, 'min_length': 8}}
+        extra_kwargs = {
+            'email': {'validators': []},
+            'password': {'write_only': True, 'min_length': 8},
+        }
 
     def calculate_digit(self, cpf_digits):
-        """
-        Calculate CPF digit
-
-        Formula:
-        Original CPF = 945.086.080-78
-        To calculate first digit, remove last 2 digits:
-        945.086.080
-        Multiply each number by below weights:
-        [10, 9, 8, 7, 6, 5, 4, 3, 2]
-        The result will be:
-        [90, 36, 40, 0, 48, 30, 0, 24, 0]
-        Sum the list: 268
-        Divide the result by 11, and consider only the modulus: 4
-        If modulus < 2, the digit will be 0
-        Else, the digit will be 11 - modulus
-        So, in this case, the digit will be 11 - 7 = 4
-
-        For the second digit, the idea is the same, but you will include
-        the first calculated digit:
-        945.086.080-7
-        And will multiply by the weights:
-        [11, 10, 9, 8, 7, 6, 5, 4, 3, 2]
-        The rest of the operation still the same.
-        """
-        list2 = sorted(list(range(2, len(cpf_digits) + 2)), reverse=True)
-        digit = sum([a * b for a, b in zip(cpf_digits, list2)]) % 11
-        if digit < 2:
-            return 0
-        else:
-            return 11 - digit
+        """Calculate CPF digit, see calculate_cpf_digit"""
+        return calculate_cpf_digit(cpf_digits)
 
     def validate_cpf(self, cpf):
-        """
-        Validates if a CPF is valid
-
-
-        If given CPF last two numbers are equal to the calculated digits,
-        the CPF is valid, otherwise, it is invalid
-        """
-        test_cpf = ''.join(c for c in cpf if c.isdigit())
-        # CPF size must be 11
-        if len(test_cpf) != 11:
-            return False
-        # CPFs where all numbers are repeated will pass the rule,
-        # but are invalid
-        if len(set(test_cpf)) == 1:
-            return False
-        cpf_digits = [int(d) for d in test_cpf[:9]]
-        first_digit = self.calculate_digit(cpf_digits)
-        cpf_digits.append(first_digit)
-        second_digit = self.calculate_digit(cpf_digits)
-        if int(cpf[-1]) == second_digit and int(cpf[-2]) == first_digit:
-            return True
-        else:
-            return False
+        """Validates if a CPF is valid, see is_valid_cpf"""
+        return is_valid_cpf(cpf)
 
     def validate(self, attrs):
         """Validate Revendedor object"""
@@ -156,6 +175,8 @@ class UserRevendedorSerializer(serializers.ModelSerializer):
                     name=revendedor_data.get('name')
                 )
                 return user
+        except IntegrityError as error:
+            raise_unique_error(error)
         except APIException:
             raise APIException(
                 detail='Failed to create a Revendedor.',
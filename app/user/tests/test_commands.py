@@ -0,0 +1,93 @@
+import csv
+import os
+import tempfile
+from io import StringIO
+
+from core.models import Revendedor
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+ROWS = [
+    ('email', 'cpf', 'name', 'password'),
+    ('revendedor1@grupoboticario.com.br', '945.086.080-78', 'Rev 1',
+     'pass1234'),
+    ('revendedor2@grupoboticario.com.br', '865.550.330-45', 'Rev 2', ''),
+    ('revendedor3@grupoboticario.com.br', '111.111.111-11', 'Rev 3',
+     'pass1234'),
+    ('revendedor1@grupoboticario.com.br', '077.282.440-19', 'Rev 4',
+     'pass1234'),
+]
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+class ImportRevendedoresTests(TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w', newline='') as f:
+            csv.writer(f).writerows(ROWS)
+        self.addCleanup(os.remove, self.path)
+
+    def import_revendedores(self, **options):
+        report = StringIO()
+        call_command(
+            'import_revendedores', self.path, stdout=StringIO(),
+            stderr=report, **options)
+        return list(csv.DictReader(StringIO(report.getvalue())))
+
+    def test_import_revendedores(self):
+        """Test valid rows are imported and the others reported"""
+        errors = self.import_revendedores(workers=0, chunk_size=2)
+
+        self.assertEqual(
+            sorted(Revendedor.objects.values_list('cpf', flat=True)),
+            ['865.550.330-45', '945.086.080-78'])
+        user = get_user_model().objects.get(
+            email='revendedor1@grupoboticario.com.br')
+        self.assertTrue(user.check_password('pass1234'))
+        self.assertFalse(get_user_model().objects.get(
+            email='revendedor2@grupoboticario.com.br').has_usable_password())
+        self.assertEqual(
+            [(row['line'], row['error']) for row in errors],
+            [('4', 'You must provide a valid CPF!'),
+             ('5', 'Duplicated email in file.')])
+
+    def test_import_existing_revendedores(self):
+        """Test rows of existing users or CPFs are reported"""
+        self.import_revendedores(workers=0)
+        errors = self.import_revendedores(workers=0)
+
+        self.assertEqual(Revendedor.objects.count(), 2)
+        self.assertIn(
+            ('2', 'user with this email already exists.'),
+            [(row['line'], row['error']) for row in errors])
+
+    def test_import_same_cpf_other_form(self):
+        """Test a CPF with or without punctuation is the same revendedor"""
+        user = get_user_model().objects.create_user(
+            email='existing@grupoboticario.com.br', password='pass1234')
+        Revendedor.objects.create(user=user, cpf='86555033045', name='Rev')
+        with open(self.path, 'w', newline='') as f:
+            csv.writer(f).writerows([
+                ROWS[0],
+                ('new1@grupoboticario.com.br', '945.086.080-78', 'New 1', ''),
+                ('new2@grupoboticario.com.br', '94508608078', 'New 2', ''),
+                ('new3@grupoboticario.com.br', '865.550.330-45', 'New 3', ''),
+            ])
+
+        errors = self.import_revendedores(workers=0)
+
+        self.assertEqual(Revendedor.objects.count(), 2)
+        self.assertEqual(
+            [(row['line'], row['error']) for row in errors],
+            [('3', 'Duplicated CPF in file.'),
+             ('4', 'revendedor with this cpf already exists.')])
+
+    def test_import_hashes_in_process_pool(self):
+        """Test passwords hashed by the process pool check"""
+        self.import_revendedores(workers=1)
+
+        user = get_user_model().objects.get(
+            email='revendedor1@grupoboticario.com.br')
+        self.assertTrue(user.check_password('pass1234'))
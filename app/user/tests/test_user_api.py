@@ -1,9 +1,11 @@
 from core.models import Revendedor
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
 from django.test import TestCase
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
+from user.serializers import raise_unique_error, violated_unique_field
 
 URL_CREATE_USER = reverse('user:create')
 URL_TOKEN = reverse('token_obtain_pair')
@@ -50,6 +52,8 @@ class PublicUserApiTests(TestCase):
         res = self.client.post(URL_CREATE_USER, payload)
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            res.data, {'email': ['user with this email already exists.']})
 
     def test_password_too_short(self):
         """Test that password have at least 8 characters"""
@@ -151,6 +155,8 @@ class PublicUserApiTests(TestCase):
         revendedores = Revendedor.objects.all()
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            res.data, {'email': ['user with this email already exists.']})
         self.assertEqual(len(users), 1)
         self.assertEqual(len(revendedores), 1)
 
@@ -181,9 +187,44 @@ class PublicUserApiTests(TestCase):
         users = get_user_model().objects.filter(email=email2)
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data, {
+            'revendedor': {
+                'cpf': ['revendedor with this cpf already exists.']}})
         self.assertEqual(len(revendedores), 1)
         self.assertEqual(len(users), 0)
 
+    def test_other_integrity_error_is_raised(self):
+        """
+        Test an IntegrityError of a constraint other than the unique ones
+        is raised, even if its message names the email column
+        """
+        with self.assertRaises(IntegrityError) as error:
+            with transaction.atomic():
+                get_user_model().objects.create(email=None)
+
+        self.assertIn('email', str(error.exception))
+        self.assertIsNone(violated_unique_field(error.exception))
+        with self.assertRaises(IntegrityError):
+            raise_unique_error(error.exception)
+
+    def test_create_revendedor_number_of_queries(self):
+        """Test signup only inserts the user and the revendedor"""
+        payload = {
+            'email': 'revendedor@grupoboticario.com.br',
+            'password': 'pass1234',
+            'revendedor': {
+                'cpf': '945.086.080-78',
+                'name': 'revendedor 1'
+            }
+        }
+
+        # savepoint, user insert, revendedor insert, release savepoint
+        with self.assertNumQueries(4):
+            res = self.client.post(
+                URL_CREATE_REVENDEDOR, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
     def test_authentication_revendedor_details(self):
         """Test that authentication is required to get revendedor details"""
         res = self.client.get(URL_PROFILE)
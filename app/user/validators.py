@@ -0,0 +1,68 @@
+def calculate_cpf_digit(cpf_digits):
+    """
+    Calculate CPF digit
+
+    Formula:
+    Original CPF = 945.086.080-78
+    To calculate first digit, remove last 2 digits:
+    945.086.080
+    Multiply each number by below weights:
+    [10, 9, 8, 7, 6, 5, 4, 3, 2]
+    The result will be:
+    [90, 36, 40, 0, 48, 30, 0, 24, 0]
+    Sum the list: 268
+    Divide the result by 11, and consider only the modulus: 4
+    If modulus < 2, the digit will be 0
+    Else, the digit will be 11 - modulus
+    So, in this case, the digit will be 11 - 7 = 4
+
+    For the second digit, the idea is the same, but you will include
+    the first calculated digit:
+    945.086.080-7
+    And will multiply by the weights:
+    [11, 10, 9, 8, 7, 6, 5, 4, 3, 2]
+    The rest of the operation still the same.
+    """
+    list2 = sorted(list(range(2, len(cpf_digits) + 2)), reverse=True)
+    digit = sum([a * b for a, b in zip(cpf_digits, list2)]) % 11
+    if digit < 2:
+        return 0
+    else:
+        return 11 - digit
+
+
+def normalize_cpf(cpf):
+    """Returns the digits of a CPF, without its punctuation"""
+    return ''.join(c for c in cpf if c.isdigit())
+
+
+def cpf_forms(cpf):
+    """Returns the ways a CPF can be stored: digits only or punctuated"""
+    digits = normalize_cpf(cpf)
+    return [digits, '%s.%s.%s-%s' % (
+        digits[:3], digits[3:6], digits[6:9], digits[9:])]
+
+
+def is_valid_cpf(cpf):
+    """
+    Validates if a CPF is valid
+
+    If given CPF last two numbers are equal to the calculated digits,
+    the CPF is valid, otherwise, it is invalid
+    """
+    test_cpf = normalize_cpf(cpf)
+    # CPF size must be 11
+    if len(test_cpf) != 11:
+        return False
+    # CPFs where all numbers are repeated will pass the rule,
+    # but are invalid
+    if len(set(test_cpf)) == 1:
+        return False
+    cpf_digits = [int(d) for d in test_cpf[:9]]
+    first_digit = calculate_cpf_digit(cpf_digits)
+    cpf_digits.append(first_digit)
+    second_digit = calculate_cpf_digit(cpf_digits)
+    if int(test_cpf[-1]) == second_digit and int(test_cpf[-2]) == first_digit:
+        return True
+    else:
+        return False